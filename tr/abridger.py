@@ -5,7 +5,9 @@ abridger.py : a module to handle how to make abridged lightcurves
 
 import numpy as np
 
-def abridger( s_table, date_offset, flags=256 ):
+from season_calendar import get_calendar
+
+def abridger( s_table, date_offset, flags=256, calendar='orion' ):
     """
     A function that "intelligently" calculates 'abridging' parameters.
 
@@ -25,6 +27,8 @@ def abridger( s_table, date_offset, flags=256 ):
         MJD value to use as "zero" date.
     flags : int, optional 
         Maximum ppErrBit quality flags to use (default 0)    
+    calendar : str or SeasonCalendar, optional
+        Whose season breaks to use (default: Orion's).
         
     Returns
     -------
@@ -48,9 +52,11 @@ def abridger( s_table, date_offset, flags=256 ):
     # and on the edges?
     spacing = 5
 
-    s1_start = 54034 - date_offset
-    s1_s2_bound = 54300 - date_offset
-    s2_s3_bound = 54600 - date_offset
+    boundaries = get_calendar(calendar).boundaries
+
+    s1_start = boundaries[0] - date_offset
+    s1_s2_bound = boundaries[1] - date_offset
+    s2_s3_bound = boundaries[2] - date_offset
 
     # extract the data that beat "flags" from s_table; 
     # that's our "working table"
@@ -0,0 +1,425 @@
+"""
+benchmark.py : time the package's heavy functions on synthetic data.
+
+Builds synthetic catalogs (see synthetic.py) at several scales and
+times, at each scale:
+
+  data_cut - helpers3.data_cut, one star at a time
+  statcruncher - spread3.statcruncher (robust stats and periods)
+  fasper - scargle.fasper on one star's light curve
+  test_analyze - chi2.test_analyze on one star's light curve
+  core_match - match.core_match of the catalog against itself, jittered
+  make_corrections_table - network2.make_corrections_table
+  spreadsheet_write - spread3.spreadsheet_write (without writing a file)
+  basic_lc - plot4.basic_lc, a new figure per star (saved as PNG)
+  lightcurve_template - plot4.LightcurveTemplate, one figure redrawn
+                        per star (saved as PNG)
+
+and saves the timings as JSON, so runs can be compared over time:
+
+  {"meta": {...machine and software versions...},
+   "results": [{"function": "data_cut", "n_sources": 1000,
+                "n_epochs": 100, "n_rows": 100000, "calls": 50,
+                "seconds": [...one total per repeat...],
+                "best_per_call": ...}, ...]}
+
+Run it from this directory:
+
+  python benchmark.py --scales 100x50,1000x100 --output bench.json
+
+The plot4 templates should draw exactly what the functions they replace
+do. To check, render the same synthetic stars both ways, save them, and
+compare the images (and timings):
+
+  python benchmark.py --compare-templates template_check/
+
+Useful functions:
+  run_benchmarks - Times every function at every scale.
+  compare_templates - Checks plot4's templates against the functions
+                      they replace, image by image.
+  main - The command-line interface.
+
+"""
+
+from __future__ import division
+import sys
+import json
+import platform
+import datetime
+import argparse
+import timeit
+import os
+from cStringIO import StringIO
+
+import numpy as np
+
+from synthetic import synthetic_catalog, synthetic_constants
+
+benchmark_names = ['data_cut', 'statcruncher', 'fasper', 'test_analyze',
+                   'core_match', 'make_corrections_table',
+                   'spreadsheet_write', 'basic_lc', 'lightcurve_template']
+
+# How many stars the figure benchmarks draw (figures are slow).
+n_figures = 5
+
+
+def _light_curve(table, sid):
+    """ One star's good K-band light curve: (date, mag, err). """
+
+    from helpers3 import data_cut, band_cut
+
+    k_table = band_cut(data_cut(table, sid, season=123), 'k', max_flag=0)
+
+    return (np.asarray(k_table.MEANMJDOBS), np.asarray(k_table.KAPERMAG3),
+            np.asarray(k_table.KAPERMAG3ERR))
+
+
+def _jobs(table, truth, n_calls):
+    """
+    One zero-argument callable per benchmark (doing `calls` calls'
+    worth of work), keyed by name, plus how many calls each makes.
+
+    """
+
+    import atpy
+    import matplotlib.pyplot as plt
+    from helpers3 import data_cut
+    from spread3 import statcruncher, spreadsheet_write
+    from plot4 import StarData, basic_lc, LightcurveTemplate
+    from scargle import fasper
+    from timing import lsp_tuning
+    from chi2 import test_analyze
+    from match import core_match
+    from network2 import make_corrections_table
+
+    sids = truth.SOURCEID
+    some_sids = sids[:n_calls]
+
+    # Periodic stars make the most honest period-finding benchmarks.
+    periodic = truth.SOURCEID[truth.kind == 1]
+    if periodic.size == 0:
+        periodic = sids
+    date, mag, err = _light_curve(table, periodic[0])
+
+    # Every source's mean position, jittered by up to 0.2 arcsec.
+    rng = np.random.RandomState(1)
+    ra = np.degrees(table.RA[::table.RA.size // sids.size])
+    dec = np.degrees(table.DEC[::table.DEC.size // sids.size])
+    jitter = 0.2 / 3600.
+    ra2 = ra + rng.uniform(-jitter, jitter, size=ra.size)
+    dec2 = dec + rng.uniform(-jitter, jitter, size=dec.size)
+
+    lookup = atpy.Table()
+    lookup.add_column('SOURCEID', some_sids)
+    lookup.add_column('Designation', np.array([str(s) for s in some_sids]))
+
+    # Both figure benchmarks draw (and save) the same stars.
+    plt.switch_backend('Agg')
+    stardatas = [StarData(table, sid, date_offset=54579, name=str(sid))
+                 for sid in sids[:n_figures]]
+
+    def run_data_cut():
+        for sid in some_sids:
+            data_cut(table, sid, season=123)
+
+    def run_statcruncher():
+        for sid in some_sids:
+            statcruncher(table, sid, season=123, rob=True, per=True)
+
+    def run_fasper():
+        fasper(date, mag, 6., lsp_tuning(date), cache=False)
+
+    def run_test_analyze():
+        test_analyze(date, mag, err)
+
+    def run_core_match():
+        core_match(ra, dec, ra2, dec2, 1., verbose=False)
+
+    def run_make_corrections_table():
+        # it adds columns to `constants`, so start fresh every time
+        make_corrections_table(synthetic_constants(truth), table)
+
+    def run_spreadsheet_write():
+        spreadsheet_write(table, lookup, 123, '', nowrite=True, rob=True,
+                          per=True)
+
+    def run_basic_lc():
+        for stardata in stardatas:
+            fig = basic_lc(stardata)
+            fig.savefig(StringIO(), format='png')
+            plt.close(fig)
+
+    def run_lightcurve_template():
+        template = LightcurveTemplate()
+        for stardata in stardatas:
+            template.draw(stardata).savefig(StringIO(), format='png')
+        plt.close(template.figure)
+
+    return {'data_cut': (run_data_cut, some_sids.size),
+            'statcruncher': (run_statcruncher, some_sids.size),
+            'fasper': (run_fasper, 1),
+            'test_analyze': (run_test_analyze, 1),
+            'core_match': (run_core_match, ra.size),
+            'make_corrections_table': (run_make_corrections_table, 1),
+            'spreadsheet_write': (run_spreadsheet_write, some_sids.size),
+            'basic_lc': (run_basic_lc, len(stardatas)),
+            'lightcurve_template': (run_lightcurve_template, 
+                                    len(stardatas))}
+
+
+def run_benchmarks(scales=[(100, 50), (1000, 100), (5000, 200)],
+                   names=benchmark_names, repeat=3, n_calls=50, seed=0,
+                   verbose=True):
+    """
+    Times every benchmark in `names` at every scale.
+
+    Parameters
+    ----------
+    scales : list of (int, int), optional
+        (n_sources, n_epochs) of each synthetic catalog.
+    names : list of str, optional
+        Which benchmarks to run. Default: all of `benchmark_names`.
+    repeat : int, optional
+        How many times to time each one (report the best). Default 3.
+    n_calls : int, optional
+        How many stars the per-star benchmarks (data_cut,
+        statcruncher, spreadsheet_write) go through. Default 50.
+    seed : int, optional
+        Seed for the synthetic catalogs.
+    verbose : bool, optional
+        Print each timing as it's made.
+
+    Returns
+    -------
+    results : list of dict
+        One per (scale, benchmark); see the module docstring.
+
+    """
+
+    for name in names:
+        if name not in benchmark_names:
+            raise ValueError("Unknown benchmark: %s (choose from %s)" %
+                             (name, ", ".join(benchmark_names)))
+
+    results = []
+    for n_sources, n_epochs in scales:
+
+        start = timeit.default_timer()
+        table, truth = synthetic_catalog(n_sources, n_epochs, seed=seed)
+        build_seconds = timeit.default_timer() - start
+
+        if verbose:
+            print "%d sources x %d epochs (%d rows), made in %.2f s" % (
+                n_sources, n_epochs, len(table), build_seconds)
+
+        jobs = _jobs(table, truth, n_calls)
+
+        for name in names:
+            job, calls = jobs[name]
+
+            seconds = []
+            for i in range(repeat):
+                start = timeit.default_timer()
+                job()
+                seconds.append(timeit.default_timer() - start)
+
+            result = {'function': name,
+                      'n_sources': n_sources,
+                      'n_epochs': n_epochs,
+                      'n_rows': len(table),
+                      'calls': calls,
+                      'seconds': seconds,
+                      'best': min(seconds),
+                      'best_per_call': min(seconds) / max(calls, 1)}
+            results.append(result)
+
+            if verbose:
+                print "  %-24s %10.4f s  (%.3g s per call)" % (
+                    name, result['best'], result['best_per_call'])
+
+    return results
+
+
+def compare_templates(outdir, n_sources=20, n_epochs=100, n_stars=5,
+                      tol=0, seed=0, verbose=True):
+    """
+    Draws the same synthetic stars with plot4's templates and with the
+    functions they replace, and checks that the saved images match.
+
+    Each template draws every star in turn into its one figure, so this
+    also checks that nothing of one star is left in the next's figure.
+
+    Parameters
+    ----------
+    outdir : str
+        Where to save the images: <SOURCEID>_<function>.png and
+        <SOURCEID>_<template>.png, plus a -failed-diff.png for each
+        pair that doesn't match.
+    n_sources, n_epochs : int, optional
+        Size of the synthetic catalog (see synthetic.synthetic_catalog).
+    n_stars : int, optional
+        How many of its stars to draw. Periodic stars are drawn first,
+        since the phase-folded figures need a period.
+    tol : float, optional
+        The largest acceptable RMS pixel difference; see
+        matplotlib.testing.compare.compare_images. Default 0 (identical).
+    seed : int, optional
+        Seed for the synthetic catalog.
+    verbose : bool, optional
+        Print each mismatch and the timings.
+
+    Returns
+    -------
+    report : dict
+        {'seconds': {figure: total seconds drawing and saving},
+         'mismatches': [(sid, template, message), ...]}
+
+    """
+
+    import matplotlib.pyplot as plt
+    plt.switch_backend('Agg')
+    from matplotlib.testing.compare import compare_images
+    from plot4 import (StarData, basic_lc, LightcurveTemplate,
+                       lc_and_phase_and_colors, LcPhaseColorsTemplate)
+
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    table, truth = synthetic_catalog(n_sources, n_epochs, seed=seed)
+
+    order = np.argsort(truth.kind != 1, kind='mergesort')[:n_stars]
+    sids = truth.SOURCEID[order]
+    periods = np.where(truth.period[order] > 0, truth.period[order], 1.)
+
+    stardatas = [StarData(table, sid, date_offset=54579, name=str(sid))
+                 for sid in sids]
+
+    lc_template = LightcurveTemplate()
+    phase_template = LcPhaseColorsTemplate()
+
+    # (name, draws a star's figure, closes it after saving?)
+    figures = [
+        ('basic_lc', lambda i: basic_lc(stardatas[i]), True),
+        ('LightcurveTemplate', 
+         lambda i: lc_template.draw(stardatas[i]), False),
+        ('lc_and_phase_and_colors',
+         lambda i: lc_and_phase_and_colors(stardatas[i], periods[i]), True),
+        ('LcPhaseColorsTemplate',
+         lambda i: phase_template.draw(stardatas[i], periods[i]), False)]
+
+    seconds = {}
+    for name, draw, close in figures:
+        start = timeit.default_timer()
+        for i, sid in enumerate(sids):
+            fig = draw(i)
+            fig.savefig(os.path.join(outdir, "%d_%s.png" % (sid, name)))
+            if close:
+                plt.close(fig)
+        seconds[name] = timeit.default_timer() - start
+
+    plt.close(lc_template.figure)
+    plt.close(phase_template.figure)
+
+    mismatches = []
+    for function, template in [('basic_lc', 'LightcurveTemplate'),
+                               ('lc_and_phase_and_colors', 
+                                'LcPhaseColorsTemplate')]:
+        for sid in sids:
+            message = compare_images(
+                os.path.join(outdir, "%d_%s.png" % (sid, function)),
+                os.path.join(outdir, "%d_%s.png" % (sid, template)), tol)
+            if message is not None:
+                mismatches.append( (sid, template, message) )
+                if verbose:
+                    print "%d: %s differs from %s: %s" % (
+                        sid, template, function, message)
+
+    if verbose:
+        for function, template in [('basic_lc', 'LightcurveTemplate'),
+                                   ('lc_and_phase_and_colors', 
+                                    'LcPhaseColorsTemplate')]:
+            print "%-24s %8.3f s   %-22s %8.3f s" % (
+                function, seconds[function], template, seconds[template])
+        print "%d of %d images differ" % (len(mismatches), 2*len(sids))
+
+    return {'seconds': seconds, 'mismatches': mismatches}
+
+
+def _meta():
+    """ What the timings were measured on. """
+
+    meta = {'date': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'numpy': np.__version__,
+            'argv': sys.argv}
+
+    try:
+        import atpy
+        meta['atpy'] = atpy.__version__
+    except (ImportError, AttributeError):
+        pass
+
+    return meta
+
+
+def _parse_scales(text):
+    """ "100x50,1000x100" -> [(100, 50), (1000, 100)] """
+
+    scales = []
+    for scale in text.split(','):
+        n_sources, n_epochs = scale.lower().split('x')
+        scales.append((int(n_sources), int(n_epochs)))
+
+    return scales
+
+
+def main(argv=None):
+    """ Runs the benchmarks from the command line; see --help. """
+
+    parser = argparse.ArgumentParser(
+        description="Time wuvars functions on synthetic WFCAM catalogs.")
+    parser.add_argument('--scales', default='100x50,1000x100,5000x200',
+                        help="comma-separated SOURCESxEPOCHS catalog sizes "
+                        "(default: %(default)s)")
+    parser.add_argument('--functions', default=','.join(benchmark_names),
+                        help="comma-separated benchmarks to run "
+                        "(default: all)")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="timings per benchmark; the best is kept "
+                        "(default: %(default)s)")
+    parser.add_argument('--calls', type=int, default=50,
+                        help="stars per per-star benchmark "
+                        "(default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark.json',
+                        help="where to save the JSON results "
+                        "(default: %(default)s)")
+    parser.add_argument('--compare-templates', metavar='DIR',
+                        help="instead of timing, check plot4's templates "
+                        "against the functions they replace, saving the "
+                        "images to DIR")
+    args = parser.parse_args(argv)
+
+    if args.compare_templates:
+        report = compare_templates(args.compare_templates, seed=args.seed)
+        if report['mismatches']:
+            sys.exit(1)
+        return
+
+    results = run_benchmarks(scales=_parse_scales(args.scales),
+                             names=args.functions.split(','),
+                             repeat=args.repeat, n_calls=args.calls,
+                             seed=args.seed)
+
+    f = open(args.output, 'w')
+    json.dump({'meta': _meta(), 'results': results}, f, indent=1,
+              sort_keys=True)
+    f.close()
+
+    print "Saved %d timings to %s" % (len(results), args.output)
+
+
+if __name__ == '__main__':
+    main()
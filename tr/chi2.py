@@ -6,6 +6,9 @@ is found at http://public.lanl.gov/palmer/fastchi.html and described in
 Useful functions:
   chi_analyze - returns best frequency for one source in a table
   test_analyze - returns best frequency for raw input arrays t, x, xerr
+  fast_chi2 - a NumPy implementation of the same fast chi-squared 
+              search, which runs in-process (no runchi2 needed)
+  batch_analyze - runs runchi2 over many light curves, in parallel
 
 '''
 
@@ -16,7 +19,11 @@ Useful functions:
 # Update (2 Oct '12) : The above issue never comes up in practice.
 
 import os
+import time
+import shutil
 import subprocess
+import tempfile
+import warnings
 
 import numpy as np
 
@@ -225,7 +232,150 @@ def chi_analyze (table, sid, band = 'j', season=123) :
     
     return parse_chi ( run_chi ( datafile ) )
 
-def test_analyze (t, x, err, ret_chimin=False):
+def fast_chi2 (t, x, err, nharmonics=3, freqmax=12., ofac=2., 
+               chunk_size=1024):
+    """
+    Palmer's fast chi-squared period search, in NumPy.
+
+    At every frequency on a grid, fits a constant plus `nharmonics`
+    harmonics (sine and cosine) to the data, weighted by 1/err**2, 
+    and records how much that fit reduces chi-squared relative to 
+    a constant (the weighted mean). See 2009ApJ...695..496P.
+
+    The weighted trigonometric sums at each frequency are built from 
+    powers of exp(i*2*pi*f*t), and the (2*nharmonics+1)-square normal 
+    equations are solved for a whole chunk of frequencies at once.
+
+    Parameters
+    ----------
+    t, x, err : array-like
+        Arrays for the time values, x-values, and error-bar values to 
+        use in the period-finding.
+    nharmonics : int, optional
+        Number of harmonics to fit (default 3, as run_chi uses).
+    freqmax : float, optional
+        Highest frequency to search, in inverse days (default 12, 
+        as run_chi uses).
+    ofac : float, optional
+        Oversampling factor: the frequency grid spacing is 
+        1 / (ofac * time span). Default 2.
+    chunk_size : int, optional
+        How many frequencies to solve at once (bounds memory use).
+
+    Returns
+    -------
+    fbest : float
+        The best-fit frequency (-1 if there's too little data to fit).
+    chimin : float
+        The chi-squared of the best fit, at `fbest` (-1 on failure).
+    freq : np.ndarray
+        The frequencies searched.
+    chisq_red : np.ndarray
+        The chi-squared reduction (larger is better) at each frequency.
+
+    """
+
+    t = np.asarray(t, dtype='float')
+    x = np.asarray(x, dtype='float')
+    err = np.asarray(err, dtype='float')
+
+    if not (t.size == x.size == err.size):
+        raise ValueError("Input arrays must be the same size!")
+
+    H = int(nharmonics)
+    nparam = 2*H + 1
+
+    # Repeated observations of one time add no constraints, so it's the
+    # number of distinct times that has to exceed the number of parameters.
+    tspan = t.max() - t.min() if t.size else 0.
+    if np.unique(t).size <= nparam or tspan <= 0:
+        return -1, -1, np.zeros(0), np.zeros(0)
+
+    w = 1. / err**2
+    y = x - np.sum(w*x) / np.sum(w)
+    tt = t - t.min()
+
+    chi2_const = np.sum(w * y**2)
+
+    df = 1. / (ofac * tspan)
+    freq = df * np.arange(1, int(freqmax / df) + 1)
+    chisq_red = np.zeros(freq.size)
+
+    # Basis order: [1, cos(1), sin(1), cos(2), sin(2), ...].
+    for first in range(0, freq.size, chunk_size):
+        f = freq[first:first+chunk_size]
+        z = np.exp(2j*np.pi * np.outer(f, tt))
+
+        # S[k] = sum(w * z**k) for k = 0..2H; Y[h] = sum(w * y * z**h).
+        S = np.zeros((2*H+1, f.size), dtype='complex')
+        Y = np.zeros((H+1, f.size), dtype='complex')
+        zk = np.ones_like(z)
+        for k in range(2*H+1):
+            S[k] = np.dot(zk, w)
+            if k <= H:
+                Y[k] = np.dot(zk, w*y)
+            zk = zk * z
+
+        C = S.real
+        Sn = S.imag
+
+        def cos_sum(k):
+            return C[abs(k)]
+        def sin_sum(k):
+            return np.sign(k) * Sn[abs(k)]
+
+        A = np.zeros((f.size, nparam, nparam))
+        r = np.zeros((f.size, nparam))
+
+        A[:,0,0] = C[0]
+        for h in range(1, H+1):
+            ch, sh = 2*h-1, 2*h
+            A[:,0,ch] = A[:,ch,0] = C[h]
+            A[:,0,sh] = A[:,sh,0] = Sn[h]
+            r[:,ch] = Y[h].real
+            r[:,sh] = Y[h].imag
+            for g in range(1, H+1):
+                cg, sg = 2*g-1, 2*g
+                A[:,ch,cg] = (cos_sum(h-g) + cos_sum(h+g)) / 2.
+                A[:,sh,sg] = (cos_sum(h-g) - cos_sum(h+g)) / 2.
+                A[:,sh,cg] = (sin_sum(h+g) + sin_sum(h-g)) / 2.
+                A[:,cg,sh] = A[:,sh,cg]
+
+        chisq_red[first:first+chunk_size] = _chisq_reduction(A, r)
+
+    best = chisq_red.argmax()
+
+    return freq[best], chi2_const - chisq_red[best], freq, chisq_red
+
+
+def _chisq_reduction (A, r):
+    """
+    Solves a stack of normal equations A . coeffs = r and returns the
+    chi-squared reduction r . coeffs of each.
+
+    If any matrix in the stack is singular (e.g. the harmonics alias
+    onto each other at that frequency), the stack is solved one matrix
+    at a time, and the singular ones get a reduction of 0.
+
+    """
+
+    try:
+        coeffs = np.linalg.solve(A, r[:,:,np.newaxis])[:,:,0]
+        return np.sum(r * coeffs, axis=1)
+    except np.linalg.LinAlgError:
+        pass
+
+    reduction = np.zeros(len(A))
+    for i in range(len(A)):
+        try:
+            reduction[i] = np.dot(r[i], np.linalg.solve(A[i], r[i]))
+        except np.linalg.LinAlgError:
+            pass
+
+    return reduction
+
+
+def test_analyze (t, x, err, ret_chimin=False, method='numpy'):
     """
     Takes in test data, returns best frequency 
 
@@ -236,6 +386,9 @@ def test_analyze (t, x, err, ret_chimin=False):
         use in the period-finding.
     ret_chimin : bool, optional (default False)
         Return a chimin value?
+    method : {'numpy', 'runchi2'}, optional
+        Use the in-process fast_chi2() (default), or write a file and 
+        run Palmer's runchi2 program on it.
 
     Returns
     -------
@@ -247,11 +400,24 @@ def test_analyze (t, x, err, ret_chimin=False):
         
     """
 
-    datafile = chi_input_writer("test", t, x, err, 
-                                script_location+'/chitest.in')
+    if method == 'numpy':
+        fbest, chimin, freq, chisq_red = fast_chi2(t, x, err)
+        if ret_chimin:
+            return fbest, chimin
+        else:
+            return fbest
+
+    # A private directory per call, so that simultaneous period 
+    # searches can't overwrite each other's input.
+    work_dir = tempfile.mkdtemp(prefix='chi2_')
+    try:
+        datafile = chi_input_writer("test", t, x, err, 
+                                    os.path.join(work_dir, 'chitest.in'))
+
+        return_value = parse_chi( run_chi(datafile), ret_chimin=ret_chimin )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True) # clean up our tracks
 
-    return_value = parse_chi( run_chi(datafile), ret_chimin=ret_chimin )
-    os.remove(datafile) # clean up your tracks so we don't clutter
     return return_value
 
 # Next step... combine stat and chi2 to make a table of best-freq and chi^2 
@@ -287,7 +453,7 @@ def parse_diagnostic( diagnostic ) :
     return freq, chisq_red
 
 
-def diagnostic_analyze(t, x, err):
+def diagnostic_analyze(t, x, err, method='numpy'):
     """
     Takes in test data, returns fx2 periodogram. 
     
@@ -299,6 +465,9 @@ def diagnostic_analyze(t, x, err):
     t, x, err : array-like
         Arrays for the time values, x-values, and error-bar values to 
         use in the period-finding.
+    method : {'numpy', 'runchi2'}, optional
+        Compute the spectrum in memory with fast_chi2() (default), or 
+        run runchi2 and read back its diagnostic file.
 
     Returns
     -------
@@ -310,18 +479,206 @@ def diagnostic_analyze(t, x, err):
 
     """
     
-    input_file = script_location+'/chitest.in'
-    diag_file = script_location+'/diagnostic.txt'
+    if method == 'numpy':
+        fbest, chimin, freq, chisq_red = fast_chi2(t, x, err)
+        return freq, chisq_red
 
-    # This line is the same as for test_analyze()
-    datafile = chi_input_writer("test", t, x, err, input_file)
+    work_dir = tempfile.mkdtemp(prefix='chi2_')
+    input_file = os.path.join(work_dir, 'chitest.in')
+    diag_file = os.path.join(work_dir, 'diagnostic.txt')
 
-    # do a runchi2, but ignore the piped output; we just want diag_file
-    run_chi(datafile, diagnostic=diag_file)
-    
-    return_value = parse_diagnostic( diag_file )
+    try:
+        # This line is the same as for test_analyze()
+        datafile = chi_input_writer("test", t, x, err, input_file)
 
-    os.remove(datafile) # removing clutter
-    os.remove(diag_file) 
+        # do a runchi2, but ignore the piped output; we just want diag_file
+        run_chi(datafile, diagnostic=diag_file)
+    
+        return_value = parse_diagnostic( diag_file )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True) # removing clutter
 
     return return_value
+
+
+def chi_batch_writer (names, ts, xs, errs, outfile):
+    """
+    Writes many sources' data into one runchi2 input file.
+
+    Each source gets the same block that chi_input_writer() writes
+    (name, number of points, then the data), one after another.
+
+    Parameters
+    ----------
+    names : list of str
+        The (unique, whitespace-free) names of the sources.
+    ts, xs, errs : lists of array-like
+        Time, x-value and error arrays for each source.
+    outfile : str
+        Path to write an output file to.
+
+    Returns
+    -------
+    outfile : str
+        Same value as input `outfile`.
+
+    """
+
+    f = open(outfile,'w')
+
+    for name, t, x, err in zip(names, ts, xs, errs):
+        if not (t.size == x.size == err.size):
+            f.close()
+            raise ValueError("Input arrays for %s must be the same size!"
+                             % name)
+
+        f.write(name+"\n")
+        f.write(str(t.size)+"\n")
+        for i in range(t.size):
+            f.write("%f \t %f \t %f \n" % (t[i], x[i], err[i]))
+
+    f.close()
+
+    return outfile
+
+
+def parse_chi_batch (string):
+    """
+    Parses runchi2's output for many sources.
+
+    Like parse_chi(), but reads every result line rather than only the
+    last one, and keys the results by source name.
+
+    Parameters
+    ----------
+    string : str
+        The text output of a runchi2 call on a chi_batch_writer() file.
+
+    Returns
+    -------
+    results : dict
+        Maps each source name to a tuple (fbest, chimin). 
+
+    """
+
+    results = {}
+
+    for line in string.split('\n'):
+        fields = line.split('\t')
+        if len(fields) < 4:
+            continue
+        try:
+            results[fields[0].strip()] = (float(fields[1]), float(fields[3]))
+        except ValueError:
+            continue
+
+    return results
+
+
+def batch_analyze (ts, xs, errs, stars_per_run=200, max_procs=None,
+                   nharmonics=3, freqmax=12, poll_interval=0.05):
+    """
+    Runs runchi2 over many light curves, a batch per process.
+
+    The light curves are packed `stars_per_run` to an input file, and 
+    up to `max_procs` runchi2 processes run at once. Every call gets its
+    own temporary directory, so this is safe to use from several 
+    processes at the same time.
+
+    A runchi2 that exits with a nonzero status raises a warning, and
+    the light curves in its batch are left at -1.
+
+    Parameters
+    ----------
+    ts, xs, errs : lists of array-like
+        Time, x-value and error arrays for each light curve.
+    stars_per_run : int, optional
+        How many light curves to hand each runchi2 process (default 200).
+    max_procs : int, optional
+        How many runchi2 processes to run at once (default: one per core).
+    nharmonics, freqmax : optional
+        Passed to runchi2 (defaults 3 and 12, as in run_chi).
+    poll_interval : float, optional
+        Seconds to wait between checks for a finished runchi2.
+
+    Returns
+    -------
+    fbest : np.ndarray
+        The best-fit frequency of each light curve (-1 on failure).
+    chimin : np.ndarray
+        The minimum chisquared value at `fbest` (-1 on failure).
+
+    """
+
+    if max_procs is None:
+        import multiprocessing
+        max_procs = multiprocessing.cpu_count()
+
+    n = len(ts)
+    names = ["star%d" % i for i in range(n)]
+
+    fbest = -1. * np.ones(n)
+    chimin = -1. * np.ones(n)
+
+    work_dir = tempfile.mkdtemp(prefix='chi2_batch_')
+    running = []
+
+    try:
+        pending = []
+        for first in range(0, n, stars_per_run):
+            last = min(first + stars_per_run, n)
+            infile = os.path.join(work_dir, 'batch%d.in' % first)
+            chi_batch_writer(names[first:last], ts[first:last], 
+                             xs[first:last], errs[first:last], infile)
+            pending.append(infile)
+
+        # Keep at most `max_procs` runchi2's going. Their output goes to
+        # files rather than pipes, so none of them can stall on a full pipe.
+        outfiles = []
+        infile_of = {}
+        while pending or running:
+            while pending and len(running) < max_procs:
+                infile = pending.pop(0)
+                outfile = infile[:-3] + '.out'
+                stdout = open(outfile, 'w')
+                args = ["runchi2", str(nharmonics), str(freqmax), 
+                        "-i", infile]
+                process = subprocess.Popen(args, stdout=stdout)
+                infile_of[process] = infile
+                running.append( (process, stdout) )
+                outfiles.append(outfile)
+
+            # Start the next batch as soon as *any* runchi2 finishes, so
+            # one slow batch doesn't hold up the free slots.
+            finished = [r for r in running if r[0].poll() is not None]
+            if not finished:
+                time.sleep(poll_interval)
+                continue
+
+            for process, stdout in finished:
+                stdout.close()
+                running.remove( (process, stdout) )
+                if process.returncode != 0:
+                    # Its stars keep fbest = chimin = -1.
+                    warnings.warn("runchi2 exited with status %d on %s" %
+                                  (process.returncode, infile_of[process]))
+
+        results = {}
+        for outfile in outfiles:
+            results.update( parse_chi_batch(open(outfile).read()) )
+
+    finally:
+        # If we got here early (an exception, ^C), don't leave runchi2's
+        # running, or their output files open, once work_dir is gone.
+        for process, stdout in running:
+            if process.poll() is None:
+                process.terminate()
+            process.wait()
+            stdout.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for i, name in enumerate(names):
+        if name in results:
+            fbest[i], chimin[i] = results[name]
+
+    return fbest, chimin
@@ -0,0 +1,236 @@
+"""
+column_store.py : a memory-mapped, one-file-per-column photometry store.
+
+Loading a whole WSA FITS file through atpy.Table reads every column of
+every row into memory, which takes minutes and several GB -- in every
+script, and again in every pool worker. A column store is a directory
+holding each column as its own .npy file (rows sorted by SOURCEID) plus
+the SOURCEID offset index. Opening it memory-maps the columns, so
+nothing is read until it's used, and processes opening the same store
+share the operating system's page cache instead of each holding a copy.
+
+The object you get back, a ColumnTable, acts enough like an atpy.Table
+(attribute columns, `.data[name]`, `.where()`, `.rows()`, `len()`)
+that data_cut, band_cut, statcruncher, spreadsheet_write and the plot
+functions accept it as-is.
+
+Useful functions:
+  write_store - Converts a table (or FITS file) into a column store.
+  open_store - Opens a column store as a memory-mapped ColumnTable.
+  column_names - The column names of a ColumnTable or atpy.Table.
+
+"""
+
+from __future__ import division
+import os
+
+import numpy as np
+import atpy
+
+from source_index import SourceIndex
+
+# Files in a store directory that aren't columns.
+_names_file = 'columns.txt'
+_index_names = ['order', 'sids', 'starts', 'stops']
+
+
+class ColumnTable(object):
+    """
+    A minimal table made of named 1-D column arrays.
+
+    Columns can be memory-mapped (see open_store) or ordinary arrays;
+    any subset made with where() or rows() lives in memory.
+
+    Parameters
+    ----------
+    columns : dict
+        Maps column names to 1-D arrays, all the same length.
+    names : list of str, optional
+        Column order. Defaults to sorted(columns).
+
+    Attributes
+    ----------
+    data : dict
+        The column arrays, so `table.data[name]` works like in atpy.
+    names : list of str
+        Column names, in order.
+
+    """
+
+    def __init__(self, columns, names=None):
+
+        if names is None:
+            names = sorted(columns)
+
+        # Set these through __dict__, since __getattr__ looks up columns.
+        self.__dict__['data'] = dict(columns)
+        self.__dict__['names'] = list(names)
+
+    def __getattr__(self, name):
+
+        try:
+            return self.__dict__['data'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __len__(self):
+
+        if len(self.names) == 0:
+            return 0
+        return len(self.data[self.names[0]])
+
+    def __repr__(self):
+
+        return "<ColumnTable: %d rows, %d columns>" % (len(self),
+                                                       len(self.names))
+
+    def _subset(self, selection):
+        """ A new in-memory ColumnTable of some of this table's rows. """
+
+        return ColumnTable(dict((name, np.asarray(self.data[name][selection]))
+                                for name in self.names), self.names)
+
+    def where(self, mask):
+        """ Returns the rows where boolean array `mask` is True. """
+
+        return self._subset(np.asarray(mask, dtype=bool))
+
+    def rows(self, row_ids):
+        """ Returns the rows numbered `row_ids`, in that order. """
+
+        return self._subset(np.asarray(row_ids, dtype=int))
+
+    def add_column(self, name, data):
+        """ Adds a column (kept in memory). """
+
+        if name in self.data:
+            raise Exception("Column %s already exists" % name)
+
+        self.data[name] = np.asarray(data)
+        self.names.append(name)
+
+    def remove_columns(self, remove_names):
+        """ Removes one or more columns. """
+
+        if isinstance(remove_names, basestring):
+            remove_names = [remove_names]
+
+        for name in remove_names:
+            del self.data[name]
+            self.names.remove(name)
+
+    def to_table(self):
+        """ Copies this table into an ordinary atpy.Table. """
+
+        table = atpy.Table()
+        for name in self.names:
+            table.add_column(name, np.asarray(self.data[name]))
+
+        return table
+
+    def write(self, *args, **kwargs):
+        """ Writes the table out with atpy (e.g. as FITS). """
+
+        self.to_table().write(*args, **kwargs)
+
+
+def column_names(table):
+    """ The column names of a ColumnTable or an atpy.Table, in order. """
+
+    if isinstance(table, ColumnTable):
+        return list(table.names)
+
+    return list(table.data.dtype.names)
+
+
+def write_store(table, directory, sort=True):
+    """
+    Converts a table into a column store directory.
+
+    Parameters
+    ----------
+    table : atpy.Table, ColumnTable or str
+        The photometry to convert (with a SOURCEID column), or the
+        filename of a table that atpy can read.
+    directory : str
+        Where to put the store. Created if it doesn't exist.
+    sort : bool, optional
+        Whether to (stably) sort the rows by SOURCEID first, so each
+        source's rows are contiguous on disk. Default True.
+
+    Returns
+    -------
+    directory : str
+        The store's directory, for passing to open_store().
+
+    """
+
+    if isinstance(table, basestring):
+        table = atpy.Table(table, verbose=False)
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    names = column_names(table)
+
+    sourceid = np.asarray(table.data['SOURCEID'])
+
+    if sort:
+        order = np.argsort(sourceid, kind='mergesort')
+    else:
+        order = np.arange(sourceid.size)
+
+    # One column in memory at a time.
+    for name in names:
+        np.save(os.path.join(directory, name+'.npy'),
+                np.asarray(table.data[name])[order])
+
+    index = SourceIndex(sourceid[order])
+    for attr in _index_names:
+        np.save(os.path.join(directory, '_index_'+attr+'.npy'),
+                getattr(index, attr))
+
+    # Written last: a store without this file is incomplete.
+    f = open(os.path.join(directory, _names_file), 'w')
+    f.write('\n'.join(names) + '\n')
+    f.close()
+
+    return directory
+
+
+def open_store(directory, mmap_mode='r'):
+    """
+    Opens a column store made by write_store().
+
+    Parameters
+    ----------
+    directory : str
+        The store's directory.
+    mmap_mode : {'r', 'r+', 'c', None}, optional
+        How to memory-map the columns (see np.load). Default 'r'
+        (read-only). None reads every column into memory.
+
+    Returns
+    -------
+    table : ColumnTable
+        The photometry, with its SOURCEID index already attached
+        (so source_index.get_source_index() won't re-sort it).
+
+    """
+
+    f = open(os.path.join(directory, _names_file))
+    names = [line.strip() for line in f if line.strip()]
+    f.close()
+
+    columns = {}
+    for name in names:
+        columns[name] = np.load(os.path.join(directory, name+'.npy'),
+                                mmap_mode=mmap_mode)
+
+    table = ColumnTable(columns, names)
+
+    index_arrays = [np.load(os.path.join(directory, '_index_'+attr+'.npy'))
+                    for attr in _index_names]
+    table._source_index = SourceIndex.from_arrays(*index_arrays)
+
+    return table
@@ -0,0 +1,230 @@
+"""
+figure_factory.py : render super.do_it_all's figures in parallel.
+
+do_it_all draws, for every star and every season, a light curve plus
+seven phase-folded / periodogram figures, each saved as PDF, PNG and
+EPS. Drawn one after another through pyplot's global state, a few
+hundred stars take most of a day.
+
+Here each (star, season) pair becomes one job:
+  - the star's data are cut for that season once, in the parent, and
+    shared by all eight of the job's figures (so workers never need the
+    whole table);
+  - jobs are farmed out to a pool of worker processes that draw with
+    the non-interactive Agg backend;
+  - every figure is drawn into a temporary directory next to its final
+    location and then renamed into place, so an interrupted run never
+    leaves a half-written file behind;
+  - each job reports how long its figures took.
+
+The output goes into the same directories as before:
+  path/lc/s1/<name>.pdf, path/phase/s123/j_fx2/<name>.png, etc.
+
+Useful functions:
+  render_figures - make every light curve and phase figure for a
+                   list of stars.
+
+"""
+
+from __future__ import division
+import os
+import shutil
+import tempfile
+import datetime
+
+import numpy as np
+import atpy
+
+from helpers3 import data_cut
+from column_store import ColumnTable, column_names
+from source_stream import per_source
+import figure_output
+from season_calendar import get_calendar
+
+seasons = [1, 2, 3, 123]
+season_names = ['s1', 's2', 's3', 's123']
+phase_types = ['h_fx2', 'h_lsp', 'j_fx2', 'j_lsp', 'k_fx2', 'k_lsp',
+               'lsp_power']
+
+
+def _init_worker (output_policy=None):
+    """ Makes each pool worker draw off-screen, saving as told. """
+
+    import matplotlib.pyplot as plt
+    plt.switch_backend('Agg')
+
+    if output_policy is not None:
+        figure_output.set_policy(**output_policy)
+
+
+def _atomic_plot (plot_function, outfile, *args, **kwargs):
+    """
+    Calls a plot3 function that saves to `outfile` (plus extensions),
+    but has it draw into a temporary directory first and then moves
+    the finished files into place.
+
+    """
+
+    directory, base = os.path.split(outfile)
+    tmp_dir = tempfile.mkdtemp(prefix='.tmp_', dir=directory)
+
+    try:
+        plot_function(outfile=os.path.join(tmp_dir, base), *args, **kwargs)
+
+        for filename in os.listdir(tmp_dir):
+            os.rename(os.path.join(tmp_dir, filename),
+                      os.path.join(directory, filename))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _render_job (job):
+    """
+    Draws every figure for one star in one season.
+
+    Returns (name, season, {figure: seconds}, tallies), where tallies
+    is what figure_output tallied for this job's files (so a pool
+    worker's tallies can be added to the parent's).
+
+    """
+
+    import plot3 as tplot
+
+    s_table, sid, name, season, s, periods, path = job
+
+    before = dict((fmt, list(tally)) for fmt, tally in
+                  figure_output.totals.items())
+
+    timings = {}
+    def timed (figure, plot_function, outfile, *args, **kwargs):
+        start = datetime.datetime.now()
+        _atomic_plot(plot_function, outfile, *args, **kwargs)
+        timings[figure] = _seconds(datetime.datetime.now() - start)
+
+    timed('lc', tplot.lc, path+"lc/"+s+"/"+name,
+          s_table, sid, season=season, name=name, png_too=True)
+
+    for t in phase_types:
+        if t == 'lsp_power':
+            timed(t, tplot.lsp_power, path+"phase/"+s+"/lsp_power/"+name,
+                  s_table, sid, season=season, name=name, png_too=True)
+        else:
+            timed(t, tplot.phase, path+"phase/"+s+"/"+t+"/"+name,
+                  s_table, sid, period=periods[t], season=season,
+                  name=name, png_too=True)
+
+    return name, season, timings, figure_output.tallies_since(before)
+
+
+def _seconds (delta):
+    return delta.days * 86400. + delta.seconds + delta.microseconds / 1e6
+
+
+def _portable (table):
+    """ A copy of a (small) table that pickles cheaply. """
+
+    names = column_names(table)
+    return ColumnTable(dict((n, np.asarray(table.data[n])) for n in names),
+                       names)
+
+
+def _jobs (table, sid_list, name_list, path, tables_path):
+    """ Yields one job per (star, season), cutting each star's data once. """
+
+    calendar = get_calendar()
+    spreadsheets = [atpy.Table(tables_path+s+'/spreadsheet.fits',
+                               verbose=False) for s in season_names]
+
+    for i, sid, table_i in per_source(table, sid_list):
+        name = name_list[i]
+
+        # Every season is a subset of "no season", so cut the star out
+        # of the big table just once, and split it up by season id.
+        star_table = _portable(data_cut(table_i, sid, season=0))
+        season_ids = calendar.season_ids(star_table.MEANMJDOBS)
+
+        for season, s, s_stats in zip(seasons, season_names, spreadsheets):
+            this_star = s_stats.SOURCEID == sid
+            periods = dict((t, s_stats.data[t+"_per"][this_star])
+                           for t in phase_types if t != 'lsp_power')
+
+            s_table = star_table.where(calendar.season_mask(season_ids,
+                                                            season))
+
+            yield (s_table, sid, name, season, s, periods, path)
+
+
+def render_figures (table, sid_list, name_list, path, n_workers=None,
+                    chunksize=1, output_policy=None):
+    """
+    Makes every light curve and phase figure that do_it_all makes.
+
+    Parameters
+    ----------
+    table : atpy.Table or source_stream.SourceStream
+        The WFCAM time-series data.
+    sid_list : (list or array) of int
+        SOURCEIDs of stars to be plotted.
+    name_list : list of str
+        Names that correspond to each SOURCEID (used in filenames).
+    path : str
+        The parent file path (with a trailing "/"). The directories
+        path/lc/s*/ and path/phase/s*/*/ must already exist, and the
+        spreadsheets path/tables/s*/spreadsheet.fits (for the periods).
+    n_workers : int or None, optional
+        How many processes to draw with. None uses every core;
+        1 draws everything in this process (still with atomic writes).
+    chunksize : int, optional
+        How many jobs to hand a worker at a time. Default 1.
+    output_policy : dict, optional
+        Settings for figure_output.set_policy (formats, dpi,
+        rasterize, ...) to save these figures with. Default: the
+        current policy.
+
+    Returns
+    -------
+    timings : list of (name, season, {figure: seconds})
+        How long each job's figures took to draw and save.
+
+    """
+
+    start = datetime.datetime.now()
+
+    jobs = _jobs(table, sid_list, name_list, path, path+"tables/")
+
+    if n_workers == 1:
+        if output_policy is not None:
+            old_policy = figure_output.set_policy(**output_policy)
+        try:
+            results = []
+            for job in jobs:
+                results.append(_render_job(job)[:3])
+        finally:
+            if output_policy is not None:
+                figure_output.set_policy(**old_policy)
+    else:
+        import multiprocessing
+
+        pool = multiprocessing.Pool(n_workers, initializer=_init_worker,
+                                    initargs=(output_policy,))
+        try:
+            results = []
+            for name, season, timings, tallies in pool.imap_unordered(
+                    _render_job, jobs, chunksize):
+                # The workers' files count towards figure_output.summary()
+                figure_output.add_tallies(tallies)
+                results.append((name, season, timings))
+        finally:
+            pool.close()
+            pool.join()
+
+    for name, season, timings in results:
+        print "%s (season %d): %.1f s  (%s)" % (
+            name, season, sum(timings.values()),
+            ", ".join("%s %.1f" % (f, timings[f]) for f in sorted(timings)))
+
+    print "Made %d figures for %d star-seasons in %s" % (
+        sum(len(t) for n, s, t in results), len(results),
+        datetime.datetime.now() - start)
+
+    return results
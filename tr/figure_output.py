@@ -0,0 +1,233 @@
+"""
+figure_output.py : one place that decides how figures are saved.
+
+The plot3 plotting functions used to save every `png_too=True` figure
+as PDF, PNG and EPS with matplotlib's defaults. For dense, time-colored
+scatter plots the vector formats become huge files, made of thousands
+of individual markers, which are slow to write and slow to open. Every
+saving function now goes through save_figure(), which follows a
+module-wide output policy:
+
+  formats - which formats `png_too` means (default pdf, png, eps)
+  dpi - resolution of raster output, including rasterized layers
+        (default: matplotlib's savefig.dpi)
+  rasterize - whether to rasterize dense data layers (scatter points,
+              errorbars, long lines) in vector formats while keeping
+              axes, ticks and text as vectors (default False)
+  min_points - how many points make a layer "dense" (default 500)
+  verbose - print bytes written and time taken for each file
+
+Every file saved is tallied by format, so summary() tells you where a
+book build spends its time and disk.
+
+Example use:
+
+    >>> import figure_output
+    >>> figure_output.set_policy(formats=['pdf', 'png'], rasterize=True,
+    ...                          dpi=150)
+    >>> # ... make plots with png_too=True ...
+    >>> figure_output.summary()
+
+Useful functions:
+  save_figure - Saves a figure according to the output policy.
+  set_policy - Changes the output policy.
+  rasterize_dense - Marks a figure's dense data layers for rasterizing.
+  summary - Prints bytes and seconds spent per format so far.
+  tallies_since, add_tallies - Carry tallies out of worker processes.
+
+"""
+
+from __future__ import division
+import os
+import datetime
+
+import matplotlib.pyplot as plt
+
+policy = {'formats': ['pdf', 'png', 'eps'],
+          'dpi': None,
+          'rasterize': False,
+          'min_points': 500,
+          'verbose': False}
+
+# format -> [files, bytes, seconds]
+totals = {}
+
+
+def set_policy(**kwargs):
+    """
+    Changes the output policy (see the module docstring for the keys).
+
+    Returns the old policy, so it can be restored with set_policy(**old).
+
+    """
+
+    for key in kwargs:
+        if key not in policy:
+            raise ValueError("Unknown output policy setting: %s" % key)
+
+    old = dict(policy)
+    policy.update(kwargs)
+
+    return old
+
+
+def _n_points(artist):
+    """ Roughly how many points a data layer draws. """
+
+    if hasattr(artist, 'get_xydata'):
+        return len(artist.get_xydata())
+
+    offsets = artist.get_offsets()
+    if offsets is not None and len(offsets) > 1:
+        return len(offsets)
+
+    return len(artist.get_paths())
+
+
+def rasterize_dense(fig, min_points=None):
+    """
+    Marks every line or collection with at least `min_points` points
+    to be rasterized when `fig` is saved in a vector format.
+
+    Parameters
+    ----------
+    fig : matplotlib.figure.Figure
+    min_points : int, optional
+        Default: policy['min_points'].
+
+    Returns
+    -------
+    n_rasterized : int
+        How many artists were marked.
+
+    """
+
+    if min_points is None:
+        min_points = policy['min_points']
+
+    n_rasterized = 0
+    for ax in fig.axes:
+        for artist in list(ax.collections) + list(ax.lines):
+            if _n_points(artist) >= min_points:
+                artist.set_rasterized(True)
+                n_rasterized += 1
+
+    return n_rasterized
+
+
+def save_figure(fig=None, outfile='', add_extensions=True, formats=None,
+                dpi=None, rasterize=None, close=True):
+    """
+    Saves a figure according to the output policy.
+
+    Parameters
+    ----------
+    fig : matplotlib.figure.Figure, optional
+        Default: the current figure.
+    outfile : str
+        Where to save it.
+    add_extensions : bool, optional
+        If True (what `png_too` used to mean), save `outfile` + "." +
+        each format in `formats`. If False, save `outfile` once, in
+        the format its extension implies. Default True.
+    formats, dpi, rasterize : optional
+        Override the policy for this figure.
+    close : bool, optional
+        Whether to close the figure afterwards. Default True.
+
+    Returns
+    -------
+    report : list of (filename, bytes, seconds)
+        One entry per file written.
+
+    """
+
+    if fig is None:
+        fig = plt.gcf()
+    if formats is None:
+        formats = policy['formats']
+    if dpi is None:
+        dpi = policy['dpi']
+    if rasterize is None:
+        rasterize = policy['rasterize']
+
+    if rasterize:
+        rasterize_dense(fig)
+
+    kwargs = {}
+    if dpi is not None:
+        kwargs['dpi'] = dpi
+
+    if add_extensions:
+        filenames = [(outfile+"."+fmt, fmt) for fmt in formats]
+    else:
+        fmt = os.path.splitext(outfile)[1].lstrip('.').lower()
+        filenames = [(outfile, fmt or 'png')]
+
+    report = []
+    for filename, fmt in filenames:
+        start = datetime.datetime.now()
+        fig.savefig(filename, **kwargs)
+        delta = datetime.datetime.now() - start
+
+        seconds = (delta.days * 86400. + delta.seconds +
+                   delta.microseconds / 1e6)
+        size = os.path.getsize(filename)
+
+        tally = totals.setdefault(fmt, [0, 0, 0.])
+        tally[0] += 1
+        tally[1] += size
+        tally[2] += seconds
+
+        if policy['verbose']:
+            print "%s: %d bytes, %.2f s" % (filename, size, seconds)
+
+        report.append((filename, size, seconds))
+
+    if close:
+        plt.close(fig)
+
+    return report
+
+
+def summary():
+    """ Prints (and returns) the files, bytes and seconds per format. """
+
+    for fmt in sorted(totals):
+        files, size, seconds = totals[fmt]
+        print ("%4s: %5d files, %12d bytes (%8.1f kB each), "
+               "%8.1f s (%.3f s each)" % (fmt, files, size,
+                                          size / files / 1024, seconds,
+                                          seconds / files))
+
+    return dict((fmt, tuple(totals[fmt])) for fmt in totals)
+
+
+def tallies_since(before):
+    """
+    What's been saved since `before` (an earlier copy of `totals`), as
+    {format: [files, bytes, seconds]}.
+
+    Pool workers return this, so the parent can add_tallies() it.
+
+    """
+
+    zero = [0, 0, 0.]
+    return dict((fmt, [now - then for now, then in
+                       zip(totals[fmt], before.get(fmt, zero))])
+                for fmt in totals)
+
+
+def add_tallies(tallies):
+    """ Adds {format: [files, bytes, seconds]} into `totals`. """
+
+    for fmt in tallies:
+        tally = totals.setdefault(fmt, [0, 0, 0.])
+        for i, value in enumerate(tallies[fmt]):
+            tally[i] += value
+
+
+def reset_summary():
+    """ Forgets the tallies summary() reports. """
+
+    totals.clear()
@@ -24,12 +24,11 @@ def happy_table ( big_table, sid_list, flags=-1 ):
 
 # 2. A function that eliminates bad chip-nights from a dataset
 # It works! (For a table of one sourceID) 
-# Now, how long does it take for longer than that...
-# Started at 4:37 ended at 4:39 - not that bad!! (for hh, the 473-sid table)
-# How long does the whole wserv table take?? well ima go to sleep
-# Almost exactly 5 hours, and uses up all my RAM so if I try to save
-# anything then it crashes T_T
-def happy_chipnights ( data_table, corrections_table, max_correction=.0125 ):
+# The row-by-row version took almost exactly 5 hours on the whole wserv
+# table and used up all my RAM. Now it's the same sorted join that
+# network2.apply_corrections uses, done in chunks.
+def happy_chipnights ( data_table, corrections_table, max_correction=.0125,
+                       chunk_size=500000 ):
     ''' Removes bad chip-nights from a data table.
     
     Inputs:
@@ -39,64 +38,41 @@ def happy_chipnights ( data_table, corrections_table, max_correction=.0125 ):
     Optional inputs:
       max_correction -- the minimum "chip deviation" to flag a chip_night as
                         needing removal.
+      chunk_size -- how many rows to look up at once 
+                    (see network2.lookup_corrections).
+
+    Returns the rows whose chip-night correction is smaller than 
+    max_correction in every band, with j,h,k_correction columns added.
+    Rows whose chip-night isn't in the corrections table are removed too.
     '''
 
-    # So, we'll load up the table, and... for every datapoint we'll 
-    # filter stuff? That might take forever!
-    # Alternatively, we could check every source for whether it's on only
-    # one chip
+    chip, j_corr, h_corr, k_corr = n2.lookup_corrections( 
+        data_table, corrections_table, chunk_size=chunk_size )
 
-    # How do I even delete a row from an atpy table? 
-    # Ah... I have a clever way to do it I think. 
-    # The best way to do this seems to be to add the j,h,k corrections columns to this table, then populate them row-by-row, and filter it all at the end! Okay, I'll do that.
-    
-    ctable = corrections_table
-    
+    print "Made corrections rows! They look like this (j, h, k):"
+    print j_corr[0]
+    print h_corr[0]
+    print k_corr[0]
 
-    # I think I just learned how to copy tables! 
-    # it uses really silly "where" calls like where something is positive or negative or zero
-    if atpy.__version__ == '0.9.3':
-        try:
-            # deleting the columns we need to create in a sec
-            data_table.remove_columns( ['j_correction',
-                                        'h_correction',
-                                        'k_correction'])
-        except: 
-            pass
-        table = data_table
-    else:
-        # making a friggin copy so we can use it, and calling it table
-        table = data_table.copy()
-    
-    table.add_empty_column('j_correction', np.float64)
-    table.add_empty_column('h_correction', np.float64)
-    table.add_empty_column('k_correction', np.float64)
-   
-    for row in data_table:
-        chip = n2.get_chip( row['MEANMJDOBS'], 
-                            np.degrees(row['RA']),
-                            np.degrees(row['DEC']) )
-        
-        local_corrections = ctable.where( (ctable.date == row['MEANMJDOBS']) &
-                                          (ctable.chip == chip) )
-        
-        row['j_correction'] = local_corrections.j_correction
-        row['h_correction'] = local_corrections.h_correction
-        row['k_correction'] = local_corrections.k_correction
+    # Filter first and only then copy, so we never hold two full tables.
+    # (NaN, i.e. no correction found, fails every comparison.)
+    happy = ( (np.abs(j_corr) < max_correction) &
+              (np.abs(h_corr) < max_correction) &
+              (np.abs(k_corr) < max_correction) )
 
-    
-    print "Made corrections rows! They look like this (j, h, k):"
-    print table.j_correction[0]
-    print table.h_correction[0]
-    print table.k_correction[0]
+    f_table = data_table.where( happy )
 
-    # Now I guess it's time to filter stuff... though the above seems 
-    # pretty useful on its own... like, that's basically the implementation
-    # for apply_corrections...
-    
-    f_table = table.where( (np.abs(table.j_correction) < max_correction) &
-                           (np.abs(table.h_correction) < max_correction) &
-                           (np.abs(table.k_correction) < max_correction) )
+    try:
+        # deleting the columns we need to create in a sec
+        f_table.remove_columns( ['j_correction',
+                                 'h_correction',
+                                 'k_correction'])
+    except: 
+        pass
+
+    f_table.add_column('j_correction', j_corr[happy])
+    f_table.add_column('h_correction', h_corr[happy])
+    f_table.add_column('k_correction', k_corr[happy])
 
     print "done filtering!"
     
@@ -0,0 +1,128 @@
+"""
+grouped.py : segmented ("grouped") reductions over many stars at once.
+
+Instead of looping over stars and calling arr.mean(), np.median(arr),
+etc. on each star's little array, we lay every star's data end to end
+in one array `x` and keep a parallel array `g` of group numbers
+(0 .. n_groups-1) saying which star each element belongs to. Then each
+statistic is one bincount / reduceat / lexsort call for the whole catalog.
+
+Conventions:
+  - `g` must be sorted (non-decreasing), i.e. each group's elements
+    are contiguous in `x`. SourceIndex.gather() output is already like this.
+  - Empty groups come out as NaN (counts come out as 0).
+
+Useful functions:
+  group_count, group_sum, group_mean, group_std,
+  group_min, group_max, group_median - what they say.
+  group_offsets - Start/stop offsets of each group.
+
+"""
+
+from __future__ import division
+import numpy as np
+
+
+def group_count (g, n_groups):
+    """ Number of elements in each group. """
+
+    return np.bincount(g, minlength=n_groups)[:n_groups]
+
+
+def group_offsets (g, n_groups):
+    """
+    Returns an array of length n_groups+1 such that group i occupies
+    x[offsets[i]:offsets[i+1]].
+
+    """
+
+    return np.concatenate(([0], np.cumsum(group_count(g, n_groups))))
+
+
+def group_sum (x, g, n_groups):
+    """ Sum of `x` within each group. """
+
+    return np.bincount(g, weights=x, minlength=n_groups)[:n_groups]
+
+
+def group_mean (x, g, n_groups):
+    """ Mean of `x` within each group (NaN for empty groups). """
+
+    count = group_count(g, n_groups)
+    total = group_sum(x, g, n_groups)
+
+    return np.where(count > 0, total / np.maximum(count, 1), np.nan)
+
+
+def group_std (x, g, n_groups, ddof=0):
+    """
+    Standard deviation of `x` within each group (NaN for empty groups).
+
+    Like np.std, uses a divisor of N - `ddof` (default 0).
+
+    """
+
+    count = group_count(g, n_groups)
+    mean = group_mean(x, g, n_groups)
+
+    sqdev = group_sum((x - mean[g])**2, g, n_groups)
+    divisor = count - ddof
+
+    return np.where(divisor > 0,
+                    np.sqrt(sqdev / np.maximum(divisor, 1)), np.nan)
+
+
+def _group_reduceat (ufunc, x, g, n_groups):
+    """ Applies ufunc.reduceat over the non-empty groups. """
+
+    count = group_count(g, n_groups)
+    offsets = np.concatenate(([0], np.cumsum(count)))
+    nonempty = count > 0
+
+    ret = np.nan * np.ones(n_groups)
+    if nonempty.any():
+        ret[nonempty] = ufunc.reduceat(x, offsets[:-1][nonempty])
+
+    return ret
+
+
+def group_min (x, g, n_groups):
+    """ Minimum of `x` within each group (NaN for empty groups). """
+
+    return _group_reduceat(np.minimum, x, g, n_groups)
+
+
+def group_max (x, g, n_groups):
+    """ Maximum of `x` within each group (NaN for empty groups). """
+
+    return _group_reduceat(np.maximum, x, g, n_groups)
+
+
+def group_median (x, g, n_groups):
+    """
+    Median of `x` within each group (NaN for empty groups).
+
+    Sorts once by (group, value), then picks the middle element(s)
+    of each group just like np.median does.
+
+    """
+
+    count = group_count(g, n_groups)
+    offsets = np.concatenate(([0], np.cumsum(count)))
+    nonempty = count > 0
+
+    ret = np.nan * np.ones(n_groups)
+    if not nonempty.any():
+        return ret
+
+    xs = np.asarray(x)[np.lexsort((x, g))]
+
+    start = offsets[:-1][nonempty]
+    n = count[nonempty]
+
+    lower = xs[start + (n - 1) // 2]
+    upper = xs[start + n // 2]
+
+    ret[nonempty] = (lower + upper) / 2.
+
+    return ret
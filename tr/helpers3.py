@@ -1,18 +1,55 @@
 """
 This is a module that contains 'helper' functions that are called 
 by the other '3'-series packages in wuvars. It does not import any 
-of my other modules, for dependency reasons.
+of my other modules, for dependency reasons (except source_index and
+season_calendar, which import nothing).
 
 Useful functions:
   data_cut - Cuts a table for a selection of sources and seasons
+  season_bounds - Gives the MJD boundaries of an observing season.
+  get_season_ids - Which season each row of a table is in (computed once).
   band_cut - Selects only data where a certain band (J,H,K) is well-defined.
+  band_validity - Bitmask of which bands (J,H,K) are well-defined in each row.
+  get_band_validity - Same, but computed only once per table and max_flag.
+  band_mask - Which rows of a band_validity bitmask have all of some bands.
 
 """
 
 import numpy as np
 import atpy
 
-def data_cut (table, sid_list, season=0):
+from source_index import season_rows, _fingerprint
+from season_calendar import get_calendar
+
+def season_bounds (season, calendar=None):
+    """
+    Returns the MJD boundaries of an observing season.
+
+    The seasons come from a season_calendar.SeasonCalendar; by
+    default, the one defined by the Cyg OB7 variability study.
+    Data in `season` satisfy low < MEANMJDOBS < high.
+
+    Parameters
+    ----------
+    season : int
+        Which observing season of our dataset (1, 2, 3, or 123 for
+        all three). Any other value, including non-integers, means
+        "no season" and gives bounds that include every observation.
+    calendar : str or SeasonCalendar, optional
+        Which field's seasons to use (e.g. 'orion'). 
+        Default: season_calendar.default_field.
+
+    Returns
+    -------
+    low, high : float
+        The (exclusive) lower and upper MJD bounds.
+
+    """
+
+    return get_calendar(calendar).bounds(season)
+
+
+def data_cut (table, sid_list, season=0, calendar=None):
     """
     Selects data corresponding to specified source(s).
 
@@ -36,6 +73,8 @@ def data_cut (table, sid_list, season=0):
         Entering "123" will make a time-cut at the beginning of season
         1 and at the end of season 3, excluding any prior or latter 
         observations.
+    calendar : str or SeasonCalendar, optional
+        Which field's seasons to use. Default: Cyg OB7.
 
     Returns
     -------
@@ -45,42 +84,13 @@ def data_cut (table, sid_list, season=0):
 
     """
 
-    # 0. make sure input data is a list
-    if type(sid_list) is not list:
-        sid_list = [sid_list]
-    
-    # First, select these sources' data from the table.
-    # This code taken from tr_helpers.data_cut.
-    source = table.where( 
-        np.array( [sid in sid_list for sid in table.SOURCEID] )
-        )
-    
-    # Second, slice the data by season.
-    # These seasons defined by the Cyg OB7 variability study.
-    offset = 54579
-    cut1 = 100
-    cut2 = 300
-    cut3 = 600
-
-    if season == 1:
-        low = offset
-        high = offset+cut1
-    elif season == 2:
-        low = offset+cut1
-        high = offset+cut2
-    elif season == 3:
-        low = offset+cut2
-        high = offset+cut3
-    elif season == 123:
-        low = offset
-        high = offset+cut3
-    else:
-        low = 0
-        high = 1e6
-    
-    cut_table = source.where( (source.MEANMJDOBS < high) & 
-                              (source.MEANMJDOBS > low))
-    
+    # The source index is built once per table, with each source's
+    # rows sorted by date (see source_index.py), so both the source
+    # and the season are found by binary search rather than a scan.
+    low, high = season_bounds(season, calendar)
+
+    cut_table = table.rows( season_rows(table, sid_list, low, high) )
+   
     return cut_table
 
 
@@ -154,4 +164,171 @@ def band_cut (table, band, min_flag=0, max_flag=2147483648,
 
     return cut_table
 
-    
+
+# Bits used by band_validity().
+band_bits = {'j': 1, 'h': 2, 'k': 4}
+
+
+def band_validity (table, min_flag=0, max_flag=2147483648,
+                   null=np.double(-9.99999488e+08), rows=None):
+    """
+    Marks which bands are well-defined in each row of a table.
+
+    Row `i` has bit band_bits['j'] set if band_cut(table, 'j', min_flag,
+    max_flag) would keep it, and likewise for 'h' and 'k'. So instead 
+    of chaining band_cut calls (and making a new table each time) to 
+    find e.g. the rows with good J and K, use 
+    band_mask(band_validity(table), 'jk').
+
+    Parameters
+    ----------
+    table : atpy.Table
+        An ATpy Table containing time-series photometry from the 
+        WFCAM Science Archive.
+    min_flag : int, optional
+        The lowest ppErrBits flag to accept. Default 0.
+    max_flag : int, optional
+        The highest ppErrBits flag to accept. Default 2147483648 (2**31).
+    null : float, optional
+        What value to use as a 'null' when filtering data.
+        Default value -9.99999e+08 (as used by WSA).
+    rows : array_like of int, optional
+        Only look at these rows (so, for a memory-mapped table, only
+        they are read). Default: every row.
+
+    Returns
+    -------
+    validity : np.ndarray of uint8
+        One bitmask per row of `table` (or per entry of `rows`).
+
+    """
+
+    def column (name):
+        if rows is None:
+            return table.data[name]
+        return table.data[name][rows]
+
+    if rows is None:
+        validity = np.zeros(len(table.MEANMJDOBS), dtype=np.uint8)
+    else:
+        validity = np.zeros(len(rows), dtype=np.uint8)
+
+    for band, bit in band_bits.items():
+        B = band.upper()
+        pperrbits = column(B+'PPERRBITS')
+
+        ok = ( (column(B+'APERMAG3') != null) &
+               (column(B+'APERMAG3ERR') != null) &
+               (pperrbits >= min_flag) & (pperrbits <= max_flag) )
+
+        validity[ok] |= bit
+
+    return validity
+
+
+def get_band_validity (table, max_flag=2147483648):
+    """
+    Returns band_validity(table, max_flag=max_flag), building it only once.
+
+    The bitmasks are cached on the table itself (one per `max_flag`), 
+    and are rebuilt if any of the J, H, K APERMAG3, APERMAG3ERR or 
+    PPERRBITS columns has since changed (been replaced, e.g. by a sort,
+    or had sampled values edited; see source_index.get_source_index).
+    After other in-place edits, call source_index.invalidate_indexes.
+
+    Parameters
+    ----------
+    table : atpy.Table
+        An ATpy Table containing time-series photometry.
+    max_flag : int, optional
+        The highest ppErrBits flag to accept. Default 2147483648 (2**31).
+
+    Returns
+    -------
+    validity : np.ndarray of uint8
+        One bitmask per row of `table`.
+
+    """
+
+    # atpy's __getattr__ looks up columns, so go through __dict__ here.
+    cache = table.__dict__.get('_band_validity')
+    fingerprint = tuple(_fingerprint(table.data[B+column])
+                        for B in 'JHK'
+                        for column in ['APERMAG3', 'APERMAG3ERR', 
+                                       'PPERRBITS'])
+
+    if cache is None or cache['fingerprint'] != fingerprint:
+        cache = {'fingerprint': fingerprint}
+        table._band_validity = cache
+
+    if max_flag not in cache:
+        cache[max_flag] = band_validity(table, max_flag=max_flag)
+
+    return cache[max_flag]
+
+
+def band_mask (validity, bands):
+    """
+    Selects the rows where every one of some bands is well-defined.
+
+    Parameters
+    ----------
+    validity : np.ndarray
+        Bitmasks from band_validity().
+    bands : str
+        Any combination of 'j', 'h' and 'k', e.g. 'jhk' or 'hk'.
+
+    Returns
+    -------
+    mask : np.ndarray of bool
+        True where all of `bands` are well-defined.
+
+    """
+
+    bits = sum(band_bits[b] for b in bands.lower())
+
+    return (validity & bits) == bits
+
+
+def get_season_ids (table, calendar=None):
+    """
+    Returns which season each row of `table` falls in, computing it
+    only once per table and calendar.
+
+    Jobs that run over several seasons can select rows with
+    SeasonCalendar.season_mask(ids, season) -- or group rows by `ids`
+    -- instead of comparing every date against every season's bounds.
+    The ids are rebuilt if MEANMJDOBS has since changed, as in
+    get_band_validity.
+
+    Parameters
+    ----------
+    table : atpy.Table
+        An ATpy Table containing time-series photometry.
+    calendar : str or SeasonCalendar, optional
+        Which field's seasons to use. 
+        Default: season_calendar.default_field.
+
+    Returns
+    -------
+    ids : np.ndarray of np.int8
+        1, 2, 3... for each row's season; 0 for rows outside every
+        season. (See SeasonCalendar.season_ids.)
+
+    """
+
+    calendar = get_calendar(calendar)
+
+    # atpy's __getattr__ looks up columns, so go through __dict__ here.
+    cache = table.__dict__.get('_season_ids')
+    fingerprint = _fingerprint(table.data['MEANMJDOBS'])
+
+    if cache is None or cache['fingerprint'] != fingerprint:
+        cache = {'fingerprint': fingerprint}
+        table._season_ids = cache
+
+    key = (calendar.name, tuple(calendar.boundaries))
+    if key not in cache:
+        cache[key] = calendar.season_ids(table.data['MEANMJDOBS'])
+
+    return cache[key]
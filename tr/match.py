@@ -2,6 +2,9 @@
 A collection of functions for matching tables based on source positions.
 
 Available functions:
+  core_match, gen_match, smart_match, small_match, coords_match - matching
+  angular_separation - vectorized separations, in arcsec
+  radius_query - every source within some radius of a position
 
 
 Modification History:
@@ -10,6 +13,11 @@ June 2010: Created. Tom Rice (t.rice90@gmail.com)
 17 March 2012: Added 'units' keyword to coords_match.
 15 May 2012: Updating code.
 17 May 2012: Still updating code, mainly by standardizing documentation.
+core_match now finds candidates in a Decl.-sorted copy of table 2 
+  with searchsorted, instead of four np.where's per source.
+  A single source still takes one linear scan (no sort).
+Offsets now come from the vectorized angular_separation(), so 
+  matching no longer needs coords/astrolib. Added radius_query.
 
 """
 
@@ -17,10 +25,6 @@ import atpy
 import numpy as np
 #import math
 import matplotlib.pyplot as plt
-try:
-    import coords
-except ImportError:
-    import astrolib.coords as coords
 
 where = np.where
 sect = np.intersect1d
@@ -35,12 +39,114 @@ def vprint ( string ):
     if v:
         print string
 
-def core_match ( radd1, dedd1, radd2, dedd2, max_match, verbose = True ) :
+def angular_separation ( ra1, dec1, ra2, dec2, units='deg' ) :
+    """
+    Angular separation (in arcsec) between positions, vectorized.
+
+    Uses the Vincenty formula, which is accurate at all separations
+    (unlike the plain haversine, near 180 degrees). Broadcasts like 
+    any NumPy arithmetic, so one position against a whole table works.
+
+    Parameters
+    ----------
+    ra1, dec1, ra2, dec2 : float or numpy arrays
+        R.A. and Decl. of the two sets of positions.
+    units : str, optional
+        'deg' (default) for decimal degrees, or 'rad' for radians.
+
+    Returns
+    -------
+    offset : float or numpy array
+        The separation(s), in arcseconds.
+    """
+
+    if units == 'rad':
+        ra1, dec1, ra2, dec2 = [np.asarray(a, dtype=float) 
+                                for a in (ra1, dec1, ra2, dec2)]
+    else:
+        ra1, dec1, ra2, dec2 = [np.radians(a) 
+                                for a in (ra1, dec1, ra2, dec2)]
+
+    dra = ra2 - ra1
+    sin_dra, cos_dra = np.sin(dra), np.cos(dra)
+    sin_d1, cos_d1 = np.sin(dec1), np.cos(dec1)
+    sin_d2, cos_d2 = np.sin(dec2), np.cos(dec2)
+
+    num = np.hypot( cos_d2 * sin_dra, 
+                    cos_d1 * sin_d2 - sin_d1 * cos_d2 * cos_dra )
+    den = sin_d1 * sin_d2 + cos_d1 * cos_d2 * cos_dra
+
+    return np.degrees( np.arctan2(num, den) ) * 3600.
+
+
+def pair_offsets ( radd1, dedd1, radd2, dedd2 ) :
+    """
+    Angular separations (in arcsec) between pairs of positions.
+
+    Parameters
+    ----------
+    radd1, dedd1, radd2, dedd2 : numpy arrays
+        R.A. and Decl. of the two members of each pair. In decimal degrees.
+
+    Returns
+    -------
+    offset : numpy array
+        Separation of each pair, in arcseconds.
+    """
+
+    return angular_separation( radd1, dedd1, radd2, dedd2, units='deg' )
+
+
+def radius_query ( ra, dec, ra2, dec2, radius, units='deg' ) :
+    """
+    Finds every source in a table within `radius` of one position.
+
+    Parameters
+    ----------
+    ra, dec : float
+        R.A. and Decl. of the position to search around.
+    ra2, dec2 : numpy arrays
+        R.A. and Decl. arrays for the table.
+    radius : float
+        Search radius, in arcsec.
+    units : str, optional
+        'deg' (default) for decimal degrees, or 'rad' for radians.
+        Applies to all of the positions.
+
+    Returns
+    -------
+    index : numpy array
+        Indices of the table sources within `radius`, closest first.
+    offset : numpy array
+        Their separations from the position, in arcsec.
+    """
+
+    offset = angular_separation( ra, dec, ra2, dec2, units=units )
+
+    index = where( offset < radius )[0]
+    index = index[ np.argsort( offset[index], kind='mergesort' ) ]
+
+    return index, offset[index]
+
+
+def core_match ( radd1, dedd1, radd2, dedd2, max_match, verbose = True,
+                 chunk_size = 10000, dec_order = None ) :
     """ 
     Matches two sets of position arrays and returns (two numpy arrays).
 
     Assumes all positions are decimal degrees.
 
+    Table 2 is sorted by declination once, so each source's candidates
+    are found with a binary search instead of a scan over all of table 2.
+    The candidates are exactly the ones in the same box as before:
+    within `max_match` in Decl., and within `max_match`/cos(max |Decl.|)
+    in R.A.
+
+    Sorting costs more than a plain scan when table 1 is a single
+    source, so that case scans table 2 instead (unless `dec_order`
+    is given). Callers matching many times against the same table 2
+    can pass its `dec_order` to skip the sort.
+
     Parameters
     ----------
     radd1, dedd1 : numpy arrays
@@ -49,6 +155,10 @@ def core_match ( radd1, dedd1, radd2, dedd2, max_match, verbose = True ) :
         R.A. and Decl. arrays for the second table. In decimal degrees.
     max_match : float
         Largest acceptable offset (in arcsec) for two sources to match.
+    chunk_size : int, optional
+        How many table 1 sources to match at once (bounds memory use).
+    dec_order : numpy array, optional
+        np.argsort(dedd2, kind='mergesort'), if already computed.
 
     Returns
     -------
@@ -69,47 +179,68 @@ def core_match ( radd1, dedd1, radd2, dedd2, max_match, verbose = True ) :
     min_offset = -0.1 * np.ones_like(radd1)
     match      = -1   * np.ones_like(radd1).astype(int)
 
-    counter = 1
-
-    for s1 in range(radd1.size):
-        p1 = coords.Position( (radd1[s1], dedd1[s1]), \
-                                 units = 'deg')
-
-        w1 = where(radd2 < radd1[s1] + boxsize/delta)[0]
-        w2 = where(radd2 > radd1[s1] - boxsize/delta)[0]
-        w3 = where(dedd2 < dedd1[s1] + boxsize)[0]
-        w4 = where(dedd2 > dedd1[s1] - boxsize)[0]
+    # Find each source's strip of candidates:
+    # dedd1 - boxsize < dedd2 < dedd1 + boxsize.
+    if dec_order is None and radd1.size == 1:
+        # One source: scan table 2 once, its strip is the whole `order`.
+        order = np.flatnonzero( (dedd2 > dedd1[0] - boxsize) & 
+                                (dedd2 < dedd1[0] + boxsize) )
+        lo = np.zeros(1, dtype=int)
+        hi = np.array([order.size])
+    else:
+        # Sort table 2 by Decl. and binary-search each source's strip.
+        if dec_order is None:
+            order = np.argsort(dedd2, kind='mergesort')
+        else:
+            order = np.asarray(dec_order)
+        dec_sorted = dedd2[order]
+
+        lo = np.searchsorted(dec_sorted, dedd1 - boxsize, side='right')
+        hi = np.searchsorted(dec_sorted, dedd1 + boxsize, side='left')
+    lengths = np.maximum(hi - lo, 0)
+
+    for first in range(0, radd1.size, chunk_size):
+        s1 = np.arange(first, min(first + chunk_size, radd1.size))
+
+        # Every (source, candidate) pair in this chunk, without a loop:
+        # candidate k of source s1 sits at order[lo[s1] + k].
+        n_pairs = lengths[s1].sum()
+        if n_pairs == 0:
+            continue
+        src = np.repeat(s1, lengths[s1])
+        starts = np.cumsum(lengths[s1]) - lengths[s1]
+        s2 = order[ np.repeat(lo[s1] - starts, lengths[s1]) + 
+                    np.arange(n_pairs) ]
+
+        # Let's slice a box around each source (R.A. side of the box)
+        inbox = ( (radd2[s2] < radd1[src] + boxsize/delta) &
+                  (radd2[s2] > radd1[src] - boxsize/delta) )
+        src = src[inbox]
+        s2 = s2[inbox]
+        if src.size == 0:
+            continue
 
-        # Let's slice a box around our source
-        box = sect(sect(w1,w2),sect(w3,w4))
+        # And calculate offsets to all sources inside that box
+        offset = pair_offsets(radd1[src], dedd1[src], radd2[s2], dedd2[s2])
 
-#       HEY. dear anybody who ever edits this code:
-#       DO NOT change the implementation of how "box" works. It works.
-#       Leave it be. Do not attempt anything silly like the following.
+        # Keep each source's closest match (lowest table 2 index on ties)
+        best = np.lexsort( (s2, offset, src) )
+        src = src[best]; s2 = s2[best]; offset = offset[best]
+        closest = np.ones(src.size, dtype=bool)
+        closest[1:] = src[1:] != src[:-1]
 
-#        box = np.array( (radd2 < radd1[s1] + boxsize/delta) &
-#                        (radd2 > radd1[s1] - boxsize/delta) &
-#                        (dedd2 < dedd1[s1] + boxsize) &
-#                        (dedd2 > dedd1[s1] - boxsize))
+        # If the closest match is within our matching circle
+        good = closest & (offset < max_match)
+        match[src[good]] = s2[good]
+        min_offset[src[good]] = offset[good]
 
-        # And calculate offsets to all sources inside that box
-        offset = -1. * np.ones_like(radd2[box])
-        if offset.size != 0:
-            for s2 in range(offset.size):
-                p2 = coords.Position( (radd2[box][s2], dedd2[box][s2]),  units = 'deg')
-                offset[s2] = p1.angsep(p2).arcsec()
-
-            # If the closest match is within our matching circle
-            if offset.min() < max_match:
-                min_offset[s1] = offset.min()
-                match[s1] = box[where(offset == offset.min() )][0]
+    if v:
+        for s in range(radd1.size):
+            if match[s] >= 0:
                 vprint( "Source %d: Matched with %f arcsec" \
-                        % (counter, offset.min() ) )
+                        % (s+1, min_offset[s] ) )
             else:
-                vprint( "Source %d: Failed to match" % counter)
-        else:
-            vprint( "Source %d: Failed to match" % counter)
-        counter += 1
+                vprint( "Source %d: Failed to match" % (s+1))
 
     return (match, min_offset)
 
@@ -202,7 +333,8 @@ def smart_match(table1, table2, boxsize, verbose=True) :
     return gen_match (table1, table2, ra1, dec1, ra2, dec2, boxsize, 
                       verbose=verbose)
 
-def small_match ( ra, dec, radd2, dedd2, max_match, verbose=True ) :
+def small_match ( ra, dec, radd2, dedd2, max_match, verbose=True,
+                  dec_order=None ) :
     """ 
     Matches one position in decimal degrees to a source in a table. 
 
@@ -216,6 +348,9 @@ def small_match ( ra, dec, radd2, dedd2, max_match, verbose=True ) :
         R.A. and Decl. arrays for the table. In decimal degrees.
     max_match : float
         Largest acceptable offset (in arcsec) for two sources to match.
+    dec_order : numpy array, optional
+        Decl. sort order of the table (see core_match); without it the
+        table is scanned once, which is cheapest for a single match.
 
     Returns
     -------
@@ -231,13 +366,17 @@ def small_match ( ra, dec, radd2, dedd2, max_match, verbose=True ) :
     radd1 = np.array([ra])
     dedd1 = np.array([dec])
 
-    match, min_offset = core_match(radd1,dedd1,radd2,dedd2,max_match,verbose)
+    match, min_offset = core_match(radd1,dedd1,radd2,dedd2,max_match,verbose,
+                                   dec_order=dec_order)
     return (match[0], min_offset[0])
 
 def coords_match ( position, table, max_match = 10, verbose=True, units='rad') :
     """ 
     Matches a coords.Position object to a table with coordinates.
 
+    (Any object with a coords-style dd() method, returning decimal 
+    degrees, will do; this module no longer imports coords itself.)
+
     Parameters
     ----------
     position : coords.Position object
@@ -16,6 +16,7 @@ import robust as rb
 import atpy
 import pickle
 from tr_helpers import data_cut, season_cut
+from source_index import source_mask
 
 # Loading up some good default data, which can be completely ignored
 # with proper keyword usage. (I don't anticipate this happening, but...)
@@ -52,27 +53,65 @@ def get_chip( date, ra, dec,
                            to specific chips.
 
     '''
-    # I might move these back outside the function definition (for speed),
-    # but then it breaks the portability of this code.
-    which_chipset = np.arange(dates.size) % 4
-    chipset_map = dict( zip( dates.astype('|S14'), which_chipset ) )
+    chip = get_chips( date, ra, dec, dates = dates, center_map = center_map,
+                      chip_quadrant_map = chip_quadrant_map )[0]
 
-    if date not in dates:
+    if chip == -1:
         print "Faulty date"
-        return -1
 
-    # First, determine which chipset we're on based on the timestamp
-    chipset = chipset_map[ str(date) ]
-    
+    return chip
+
+
+def get_chips( date, ra, dec, 
+               dates = dates, center_map = center_map, 
+               chip_quadrant_map = chip_quadrant_map ) :
+    ''' Gets the chip of every detection in some columns, all at once.
+
+    Inputs:
+      date -- array of observation timestamps (e.g. table.MEANMJDOBS).
+      ra -- array of positions in degrees.
+      dec -- array of positions in degrees.
+      
+    Keywords:
+      dates -- a sorted numpy array of valid dates to use.
+      center_map -- a dictionary mapping chipsets to coordinates.
+      chip_quadrant_map -- a dictionary mapping chipset + location information
+                           to specific chips.
+
+    Returns:
+      chip -- integer array of chips, -1 wherever the date isn't in `dates`.
+
+    Same answers as get_chip, row for row, but a whole table's worth of
+    detections is one binary search into `dates` and a few array 
+    comparisons instead of a Python call per row.
+    '''
+
+    date = np.atleast_1d( date )
+    ra = np.atleast_1d( ra )
+    dec = np.atleast_1d( dec )
+
+    # First, determine which chipset we're on based on the timestamp:
+    # the chipsets cycle 0,1,2,3,0,1,... through the sorted dates.
+    pos = np.searchsorted( dates, date )
+    pos[pos >= dates.size] = 0
+    known = ( dates[pos] == date )
+
+    chipset = pos % 4
+
     # Then, use the chipset and the star's position to pinpoint 
     # which chip we're on
-    center = center_map[chipset]
-    
-    chip = chip_quadrant_map[ ( chipset, 
-                                ra > center[0], 
-                                dec > center[1] ) ]
+    centers = np.array( [ center_map[c] for c in range(4) ] )
+
+    quadrant_lookup = -1 * np.ones( (4, 2, 2), dtype=int )
+    for (c, east, north), chip in chip_quadrant_map.items():
+        quadrant_lookup[ c, int(east), int(north) ] = chip
+
+    east = ( ra > centers[chipset, 0] ).astype(int)
+    north = ( dec > centers[chipset, 1] ).astype(int)
+
+    chip = quadrant_lookup[ chipset, east, north ]
     
-    return chip
+    return np.where( known, chip, -1 )
 
 
 # This function works
@@ -103,7 +142,7 @@ def feed_chip_four ( table, sid ):
       table -- an ATpy table with time-series data and positions.
       sid -- a 13-digit WFCAM source ID.
 
-    Calls get_chip. A convenience function. Uses default get_chip keywords.
+    Calls get_chips. A convenience function. Uses default get_chip keywords.
     Looks up a star's chip for its first four detections,
     to see if the star is on multiple chips.
 
@@ -117,7 +156,7 @@ def feed_chip_four ( table, sid ):
     RA = np.degrees(s_table.RA)
     DEC= np.degrees(s_table.DEC)
     
-    chips = [ get_chip( date[x], RA[x], DEC[x] ) for x in range(4) ]
+    chips = list( get_chips( date[:4], RA[:4], DEC[:4] ) )
 
     # chips = [ get_chip( date[0], RA[0], DEC[0] ),
     #           get_chip( date[1], RA[1], DEC[1] ),
@@ -188,13 +227,34 @@ def make_constants_table ( stats_table, selection_column='j_rms', num=10 ):
     # finally, concatenate them all and lookup the proper rows in stats_table
     constant_ids = np.concatenate( constants_list )
     constant_table = stats_table.where(
-        np.array( [sid in constant_ids for sid in stats_table.SOURCEID] )
-        )
+        source_mask(stats_table.SOURCEID, constant_ids) )
 
     print "constant table has %d rows!" % constant_table.shape[0]
     return constant_table
 
 
+def _positions ( sids, sourceid ):
+    """ Where each entry of `sourceid` is found in the array `sids`. """
+
+    order = np.argsort( sids, kind='mergesort' )
+    return order[ np.searchsorted( sids[order], sourceid ) ]
+
+
+def _ranks ( group ):
+    """ Each element's rank (0, 1, 2, ...) among equal values of `group`,
+    in order of appearance. """
+
+    order = np.argsort( group, kind='mergesort' )
+    sorted_group = group[order]
+
+    starts = np.concatenate( ([0], np.nonzero(np.diff(sorted_group))[0]+1) )
+    lengths = np.diff( np.concatenate( (starts, [group.size]) ) )
+
+    rank = np.zeros( group.size, dtype=int )
+    rank[order] = np.arange(group.size) - np.repeat(starts, lengths)
+    return rank
+
+
 # This function works!
 def make_corrections_table ( constants, table ):
     ''' Creates a table of photometric corrections per chip per night.
@@ -211,22 +271,28 @@ def make_corrections_table ( constants, table ):
       '54582.6251067'  3      +0.13         +0.07    -0.03
 
     '''
-    # rb.meanr(x) is the robust mean
+    # rb.meanr(x) is the robust mean.
+    # Everything below works on (star x night) matrices instead of
+    # looking up each star-night pair in the table: missing star-nights
+    # are NaN, which the robust means ignore.
 
     # First - let's compute every constant star's robust mean in each band.
     # And keep track of them.
 
-    j_meanr = np.zeros(constants.SOURCEID.size) * 1.
-    h_meanr = np.zeros(constants.SOURCEID.size) * 1.
-    k_meanr = np.zeros(constants.SOURCEID.size) * 1.
-    
-    for sid, i in zip(constants.SOURCEID, range(constants.SOURCEID.size)):
-        stable = season_cut(table, sid, 123, flags=0)
-        
-        j_meanr[i] = rb.meanr( stable.JAPERMAG3 )
-        h_meanr[i] = rb.meanr( stable.HAPERMAG3 )
-        k_meanr[i] = rb.meanr( stable.KAPERMAG3 )
-        del stable
+    cids = constants.SOURCEID
+    stable = data_cut( table, cids, 123, flags=0 )
+
+    star = _positions( cids, stable.SOURCEID )
+    rank = _ranks( star )
+
+    means = []
+    for band in ['J', 'H', 'K']:
+        mags = np.nan * np.ones( (cids.size, rank.max()+1 if rank.size else 0) )
+        mags[star, rank] = stable.data[band+'APERMAG3']
+        means.append( rb.meanr_rows( mags ) )
+
+    j_meanr, h_meanr, k_meanr = means
+    del stable
     
     try:
         constants.add_column('j_meanr', j_meanr)
@@ -245,78 +311,34 @@ def make_corrections_table ( constants, table ):
     for chip in chip_list:
         
         local_network = constants.where(constants.chip == chip)
-        
-        # so I'm taking all of the local stars, and for every night...
-        # do i calculate it by each star first, or each night first?
-        # each night first I think would work better.
-
-        #let's grab a slice of the big table corresponding only to our 
-        # favorite sources' photometry. 
-
-        # by joining together the season_cuts from all 10 sources!
-        # no that's stupid. Use an "or |" operator! this is gonna be painful
-
-        cids= local_network.SOURCEID
-        ids = table.SOURCEID
-        #local_table = season_cut( table, local_network[0], 123 )
 
+        # let's grab a slice of the big table corresponding only to our 
+        # favorite sources' photometry.
+        cids = local_network.SOURCEID
         local_table = data_cut( table, cids, 123, flags=0 ) # aww yeah
 
-        # local_table = table.where( ( (ids == cids[0]) | # I really, really wish
-        #                              (ids == cids[1]) | # I knew how to make
-        #                              (ids == cids[2]) | # this more elegant.
-        #                              (ids == cids[3]) | 
-        #                              (ids == cids[4]) |
-        #                              (ids == cids[5]) |
-        #                              (ids == cids[6]) |
-        #                              (ids == cids[7]) |
-        #                              (ids == cids[8]) |
-        #                              (ids == cids[9]) ) &
-        #                            (table.JPPERRBITS <= 0) &
-        #                            (table.HPPERRBITS <= 0) &
-        #                            (table.KPPERRBITS <= 0) )
-
-        # okay, now that i've got the local table... let's get each night's
-        # meanr deviation.
-        # first, let's make some dates to iterate through
-        date_list = list( set( local_table.MEANMJDOBS ) )
-        
-        # at some point i need to make a structure to save the corrections to
+        # Integer indices: which star (column) and night (row) each
+        # photometry row belongs to.
+        date_arr, night = np.unique( local_table.MEANMJDOBS, 
+                                     return_inverse=True )
+        star = _positions( cids, local_table.SOURCEID )
 
-        ld = len(date_list)
-        
-        date_arr = np.zeros(ld)
-        j_correction = np.zeros(ld)
-        h_correction = np.zeros(ld)
-        k_correction = np.zeros(ld)
+        ld = date_arr.size
         chip_arr = chip * np.ones(ld, dtype=int)
 
-        # get each night's correction!
-        for date, j in zip( date_list, range(ld) ):
-            
-            # a temporary place to keep the individual deviations
-            j_deviation = np.zeros_like(cids) * 1.
-            h_deviation = np.zeros_like(cids) * 1.
-            k_deviation = np.zeros_like(cids) * 1.
-
-            for star, i in zip(cids, range(cids.size) ):
-                star_night_row = local_table.where( 
-                    (local_table.SOURCEID == star) &
-                    (local_table.MEANMJDOBS == date) )
-
-                # deviation: the meanr minus that night's magnitude.
-                j_deviation[i] = (constants.j_meanr[constants.SOURCEID==star]- 
-                                  star_night_row.JAPERMAG3 )
-                h_deviation[i] = (constants.h_meanr[constants.SOURCEID==star]- 
-                                  star_night_row.HAPERMAG3 )
-                k_deviation[i] = (constants.k_meanr[constants.SOURCEID==star]- 
-                                  star_night_row.KAPERMAG3 )
-
-            date_arr[j] = date
-            j_correction[j] = -rb.meanr(j_deviation)
-            h_correction[j] = -rb.meanr(h_deviation)
-            k_correction[j] = -rb.meanr(k_deviation)
+        corrections = []
+        for band, meanr_col in zip( ['J', 'H', 'K'], 
+                                    ['j_meanr', 'h_meanr', 'k_meanr'] ):
+            mags = np.nan * np.ones( (ld, cids.size) )
+            mags[night, star] = local_table.data[band+'APERMAG3']
+
+            # deviation: the meanr minus that night's magnitude.
+            deviation = local_network.data[meanr_col][np.newaxis,:] - mags
+
+            # each night's correction!
+            corrections.append( -rb.meanr_rows( deviation ) )
 
+        j_correction, h_correction, k_correction = corrections
 
         # make a table for each chip, and (at the end) 
         # add it to the corrections_list. We'll join them up at the end.
@@ -360,13 +382,118 @@ def make_corrections_table ( constants, table ):
 
 
 
-def apply_corrections( data_table, corrections_table ):
-    ''' the real docstring comes later '''
+def _correction_chunks( data_table, corrections_table, chunk_size ):
+    ''' Yields (start, stop, chip, [j, h, k corrections]) for each chunk
+    of data_table's rows; see lookup_corrections.
+
+    This is a sorted join on (date, chip): the corrections table is 
+    sorted once by a combined (date, chip) key, and every chunk of 
+    detections is matched against it with a binary search. Only one
+    chunk's worth of arrays exists at a time.
+    '''
+
+    ctable = corrections_table
+
+    # Turn (date, chip) into a single integer key we can sort on.
+    cdates = np.unique( ctable.date )
+    max_chip = ctable.chip.max() + 1 if ctable.chip.size else 1
+    ckey = np.searchsorted( cdates, ctable.date ) * max_chip + ctable.chip
+    corder = np.argsort( ckey, kind='mergesort' )
+    ckey = ckey[corder]
+
+    n_rows = len(data_table.MEANMJDOBS)
+
+    for start in range(0, n_rows, chunk_size):
+        stop = min( start+chunk_size, n_rows )
+
+        date = data_table.MEANMJDOBS[start:stop]
+        chip = get_chips( date,
+                          np.degrees(data_table.RA[start:stop]),
+                          np.degrees(data_table.DEC[start:stop]) )
+
+        corrections = [ np.nan * np.ones( stop-start ) for band in 'jhk' ]
+
+        if ckey.size > 0:
+            dpos = np.searchsorted( cdates, date )
+            dpos[dpos >= cdates.size] = 0
+            key = dpos * max_chip + chip
+
+            pos = np.searchsorted( ckey, key )
+            pos[pos >= ckey.size] = 0
+
+            found = ( (cdates[dpos] == date) & (chip >= 0) & 
+                      (ckey[pos] == key) )
+            crow = corder[ pos[found] ]
+
+            for band, correction in zip('jhk', corrections):
+                correction[found] = ctable.data[band+'_correction'][crow]
+
+        yield start, stop, chip, corrections
+
+
+def lookup_corrections( data_table, corrections_table, chunk_size=500000 ):
+    ''' Finds each detection's chip and that chip-night's corrections.
+
+    Inputs:
+      data_table -- an ATpy table with WFCAM time-series photometry.
+      corrections_table -- an ATpy table with per-night per-chip corrections
+                           (see make_corrections_table).
+
+    Optional inputs:
+      chunk_size -- how many rows of data_table to join at once.
+
+    Returns:
+      chip -- each row's chip (-1 for faulty dates).
+      j_correction, h_correction, k_correction -- each row's corrections
+        (NaN where the corrections table has no entry for that chip-night).
+
+    The join itself runs a chunk at a time, but the four returned arrays
+    are as long as data_table (about 28 bytes per row). To correct the
+    photometry without them, use apply_corrections.
+    '''
+
+    n_rows = len(data_table.MEANMJDOBS)
+
+    chip = -1 * np.ones( n_rows, dtype=int )
+    corrections = [ np.nan * np.ones( n_rows ) for band in 'jhk' ]
+
+    for start, stop, local_chip, local_corrections in _correction_chunks(
+            data_table, corrections_table, chunk_size ):
+        chip[start:stop] = local_chip
+        for correction, local in zip( corrections, local_corrections ):
+            correction[start:stop] = local
+
+    j_correction, h_correction, k_correction = corrections
+
+    return chip, j_correction, h_correction, k_correction
+
+
+def apply_corrections( data_table, corrections_table, chunk_size=500000, 
+                       copy=False ):
+    ''' Applies per-chip per-night photometric corrections to a data table.
+
+    Inputs:
+      data_table -- an ATpy table with WFCAM time-series photometry.
+      corrections_table -- an ATpy table with per-night per-chip corrections
+                           (see make_corrections_table).
+
+    Optional inputs:
+      chunk_size -- how many rows to join and correct at once; memory
+                    use beyond the table itself is a few arrays of
+                    this length.
+      copy -- if False (default), corrects data_table in place and 
+              returns it. If True, corrects and returns a copy, which 
+              costs a second table's worth of memory.
+
+    Returns:
+      table -- the corrected table.
+
+    '''
 
     ''' 
     To apply corrections:
     FOR EACH star, FOR EACH night (timestamp),
-      -Lookup chip for that timestamp (using get_chip),
+      -Lookup chip for that timestamp (using get_chips),
       -Lookup appropriate correction, 
        add it to photometry, 
        and save the new magnitude.
@@ -374,7 +501,35 @@ def apply_corrections( data_table, corrections_table ):
        sigma_new = sqrt( sigma_old**2 + correction**2 )
        "that's not exactly right, but it's good enough"
 
-     this might take forever.
+     this used to look like it would take forever; now it's a join,
+     applied one chunk at a time.
     '''
 
-    pass
+    if copy:
+        table = data_table.where( np.ones(len(data_table.MEANMJDOBS), 
+                                          dtype=bool) )
+    else:
+        table = data_table
+
+    n_rows = len(table.MEANMJDOBS)
+    n_corrected = 0
+
+    for start, stop, chip, corrections in _correction_chunks(
+            table, corrections_table, chunk_size ):
+
+        for band, c in zip( ['J', 'H', 'K'], corrections ):
+            # Slices of the columns are views, so this writes into table.
+            m = table.data[band+'APERMAG3'][start:stop]
+            e = table.data[band+'APERMAG3ERR'][start:stop]
+
+            # Leave null photometry and uncorrectable chip-nights alone.
+            good = np.isfinite(c) & (m > 0) & (e > 0)
+            
+            m[good] += c[good]
+            e[good] = np.sqrt( e[good]**2 + c[good]**2 )
+
+        n_corrected += np.isfinite(corrections[0]).sum()
+
+    print "Applied corrections to %d of %d rows" % ( n_corrected, n_rows )
+
+    return table
@@ -5,7 +5,9 @@ A better re-implementation of abridger.py.
 
 import numpy as np
 
-def abridger( stardata, flags=256 ):
+from season_calendar import get_calendar
+
+def abridger( stardata, flags=256, calendar='orion' ):
     """
     A function that "intelligently" calculates 'abridging' parameters.
 
@@ -49,8 +51,10 @@ def abridger( stardata, flags=256 ):
     # number of buffer nights between separators and on edges
     spacing = 5
 
-    s1_s2_bound = 54300 - stardata.date_offset
-    s2_s3_bound = 54600 - stardata.date_offset
+    boundaries = get_calendar(calendar).boundaries
+
+    s1_s2_bound = boundaries[1] - stardata.date_offset
+    s2_s3_bound = boundaries[2] - stardata.date_offset
 
     # extract the data that beat "flags" from s_table; 
     # that's our "working table"
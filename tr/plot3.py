@@ -33,6 +33,8 @@ from scargle import fasper as lsp
 from timing import lsp_mask, lsp_tuning
 from spread3 import Stetson_machine
 from abridger import abridger
+from season_calendar import get_calendar
+from figure_output import save_figure
 from color_slope import slope
 
 #import coords
@@ -73,7 +75,8 @@ def lc (table, sid, season=0, outfile='', name='',
         A string to use as a plot header.
     png_too : bool, optional (default: False)
         If `png_too` is True (and `outfile` is not ''), then 
-        save the plot in 3 file formats: PDF, PNG, and EPS.
+        save the plot in each of figure_output's formats
+        (by default PDF, PNG, and EPS).
         Do not specify a file extension in `outfile`.
     date_offset : float, optional
         What MJD to use as day "zero". Default 01/01/2000, 
@@ -372,14 +375,7 @@ def lc (table, sid, season=0, outfile='', name='',
     if outfile == '':
         plt.show()
     else:
-        if png_too:
-            plt.savefig(outfile+".pdf")
-            plt.savefig(outfile+".png")
-            plt.savefig(outfile+".eps")
-            plt.close()
-        else:
-            plt.savefig(outfile)
-            plt.close()
+        save_figure(fig, outfile, add_extensions=png_too)
 
 
     fig.ax_k = ax_k
@@ -480,7 +476,8 @@ def phase (table, sid, period='auto', season=0, offset=0,
         A string to use as a plot header.
     png_too : bool, optional (default: False)
         If `png_too` is True (and `outfile` is not ''), then 
-        save the plot in 3 file formats: PDF, PNG, and EPS.
+        save the plot in each of figure_output's formats
+        (by default PDF, PNG, and EPS).
         Do not specify a file extension in `outfile`.
     color_slope : bool, optional (default: False)
         Whether to fit color slope lines to the KvH-K and J-HvH-K plots.
@@ -824,14 +821,7 @@ def phase (table, sid, period='auto', season=0, offset=0,
     if outfile == '':
         plt.show()
     else:
-        if png_too:
-            plt.savefig(outfile+".pdf")
-            plt.savefig(outfile+".png")
-            plt.savefig(outfile+".eps")
-            plt.close()
-        else:
-            plt.savefig(outfile)
-            plt.close()
+        save_figure(fig, outfile, add_extensions=png_too)
 
     fig.ax_k = ax_k
     fig.ax_h = ax_h
@@ -867,7 +857,8 @@ def jjh (table, sid, season=0, outfile='', name='',
         A string to use as a plot header.
     png_too : bool, optional (default: False)
         If `png_too` is True (and `outfile` is not ''), then 
-        save the plot in 3 file formats: PDF, PNG, and EPS.
+        save the plot in each of figure_output's formats
+        (by default PDF, PNG, and EPS).
         Do not specify a file extension in `outfile`.
     date_offset : float, optional
         What MJD to use as day "zero". Default 01/01/2000, 
@@ -972,14 +963,7 @@ def jjh (table, sid, season=0, outfile='', name='',
     if outfile == '':
         plt.show()
     else:
-        if png_too:
-            plt.savefig(outfile+".pdf")
-            plt.savefig(outfile+".png")
-            plt.savefig(outfile+".eps")
-            plt.close()
-        else:
-            plt.savefig(outfile)
-            plt.close()
+        save_figure(fig, outfile, add_extensions=png_too)
 
     fig.ax_jjh = ax_jjh
 
@@ -1012,7 +996,8 @@ def lsp_power (table, sid, season=0, upper_frequency=0.5,
         and *not* save to file.
     png_too : bool, optional (default: False)
         If `png_too` is True (and `outfile` is not ''), then 
-        save the plot in 3 file formats: PDF, PNG, and EPS.
+        save the plot in each of figure_output's formats
+        (by default PDF, PNG, and EPS).
         Do not specify a file extension in `outfile`.
         
     Returns
@@ -1124,14 +1109,7 @@ def lsp_power (table, sid, season=0, upper_frequency=0.5,
     if outfile == '':
         plt.show()
     else:
-        if png_too:
-            plt.savefig(outfile+".pdf")
-            plt.savefig(outfile+".png")
-            plt.savefig(outfile+".eps")
-            plt.close()
-        else:
-            plt.savefig(outfile)
-            plt.close()
+        save_figure(fig, outfile, add_extensions=png_too)
 
     fig.ax_k = ax_k
     fig.ax_h = ax_h
@@ -1161,7 +1139,8 @@ def fx2_periodogram (table, sid, season=0,
         and *not* save to file.
     png_too : bool, optional (default: False)
         If `png_too` is True (and `outfile` is not ''), then 
-        save the plot in 3 file formats: PDF, PNG, and EPS.
+        save the plot in each of figure_output's formats
+        (by default PDF, PNG, and EPS).
         Do not specify a file extension in `outfile`.
         
     Returns
@@ -1268,14 +1247,7 @@ def fx2_periodogram (table, sid, season=0,
     if outfile == '':
         plt.show()
     else:
-        if png_too:
-            plt.savefig(outfile+".pdf")
-            plt.savefig(outfile+".png")
-            plt.savefig(outfile+".eps")
-            plt.close()
-        else:
-            plt.savefig(outfile)
-            plt.close()
+        save_figure(fig, outfile, add_extensions=png_too)
 
     fig.ax_k = ax_k
     fig.ax_h = ax_h
@@ -1387,7 +1359,8 @@ def graded_lc (table, sid, season=0, outfile='', name='',
         A string to use as a plot header.
     png_too : bool, optional (default: False)
         If `png_too` is True (and `outfile` is not ''), then 
-        save the plot in 3 file formats: PDF, PNG, and EPS.
+        save the plot in each of figure_output's formats
+        (by default PDF, PNG, and EPS).
         Do not specify a file extension in `outfile`.
     abridged : bool, optional (default: False)
         Create an abridged, panel-like plot?
@@ -1431,8 +1404,10 @@ def graded_lc (table, sid, season=0, outfile='', name='',
         return
 
     if abridged: 
-        date_offset = 54034
-        abridger_stuff = abridger(s_table, 54034, flags=256)
+        orion = get_calendar('orion')
+        date_offset = orion.boundaries[0]
+        abridger_stuff = abridger(s_table, date_offset, flags=256,
+                                  calendar=orion)
 
         ab_s2sub = abridger_stuff[0]
         ab_s3sub = abridger_stuff[1]
@@ -1472,12 +1447,14 @@ def graded_lc (table, sid, season=0, outfile='', name='',
     raw_kdate = np.copy(kdate)
 
     if abridged:
-        jdate[jdate > 54300-date_offset] -= ab_s2sub
-        jdate[jdate > (54600-date_offset) - ab_s2sub] -= ab_s3sub
-        hdate[hdate > 54300-date_offset] -= ab_s2sub 
-        hdate[hdate > (54600-date_offset) - ab_s2sub] -= ab_s3sub
-        kdate[kdate > 54300-date_offset] -= ab_s2sub 
-        kdate[kdate > (54600-date_offset) - ab_s2sub] -= ab_s3sub
+        s1_s2_bound = orion.boundaries[1] - date_offset
+        s2_s3_bound = orion.boundaries[2] - date_offset
+        jdate[jdate > s1_s2_bound] -= ab_s2sub
+        jdate[jdate > s2_s3_bound - ab_s2sub] -= ab_s3sub
+        hdate[hdate > s1_s2_bound] -= ab_s2sub
+        hdate[hdate > s2_s3_bound - ab_s2sub] -= ab_s3sub
+        kdate[kdate > s1_s2_bound] -= ab_s2sub
+        kdate[kdate > s2_s3_bound - ab_s2sub] -= ab_s3sub
 
     
     # get a magnitude (y-axis) for each plot
@@ -1530,12 +1507,12 @@ def graded_lc (table, sid, season=0, outfile='', name='',
     raw_kdate_info = np.copy(kdate_info)
 
     if abridged:
-        jdate_info[jdate_info > 54300-date_offset] -= ab_s2sub
-        jdate_info[jdate_info > (54600-date_offset) - ab_s2sub] -= ab_s3sub
-        hdate_info[hdate_info > 54300-date_offset] -= ab_s2sub 
-        hdate_info[hdate_info > (54600-date_offset) - ab_s2sub] -= ab_s3sub
-        kdate_info[kdate_info > 54300-date_offset] -= ab_s2sub 
-        kdate_info[kdate_info > (54600-date_offset) - ab_s2sub] -= ab_s3sub
+        jdate_info[jdate_info > s1_s2_bound] -= ab_s2sub
+        jdate_info[jdate_info > s2_s3_bound - ab_s2sub] -= ab_s3sub
+        hdate_info[hdate_info > s1_s2_bound] -= ab_s2sub
+        hdate_info[hdate_info > s2_s3_bound - ab_s2sub] -= ab_s3sub
+        kdate_info[kdate_info > s1_s2_bound] -= ab_s2sub
+        kdate_info[kdate_info > s2_s3_bound - ab_s2sub] -= ab_s3sub
     
     # get a magnitude (y-axis) for each plot
     jcol_info = j_table_info.JAPERMAG3
@@ -1786,14 +1763,7 @@ def graded_lc (table, sid, season=0, outfile='', name='',
     if outfile == '':
         plt.show()
     else:
-        if png_too:
-            plt.savefig(outfile+".pdf")
-            plt.savefig(outfile+".png")
-            plt.savefig(outfile+".eps")
-            plt.close()
-        else:
-            plt.savefig(outfile)
-            plt.close()
+        save_figure(fig, outfile, add_extensions=png_too)
 
     fig.ax_k = ax_k
     fig.ax_h = ax_h
@@ -1854,7 +1824,8 @@ def graded_phase (table, sid, period='auto', season=0, offset=0,
         A string to use as a plot header.
     png_too : bool, optional (default: False)
         If `png_too` is True (and `outfile` is not ''), then 
-        save the plot in 3 file formats: PDF, PNG, and EPS.
+        save the plot in each of figure_output's formats
+        (by default PDF, PNG, and EPS).
         Do not specify a file extension in `outfile`.
     timecolor : {False, 'phase', 'time'}, optional (default: False)
         Color lightcurve datapoints by phase or time?
@@ -2252,14 +2223,7 @@ def graded_phase (table, sid, period='auto', season=0, offset=0,
     if outfile == '':
         plt.show()
     else:
-        if png_too:
-            plt.savefig(outfile+".pdf")
-            plt.savefig(outfile+".png")
-            plt.savefig(outfile+".eps")
-            plt.close()
-        else:
-            plt.savefig(outfile)
-            plt.close()
+        save_figure(fig, outfile, add_extensions=png_too)
 
     fig.ax_k = ax_k
     fig.ax_h = ax_h
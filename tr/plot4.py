@@ -7,6 +7,8 @@ from __future__ import division
 
 import numpy as np
 import matplotlib.pyplot as plt
+import matplotlib.ticker as ticker
+import matplotlib.transforms as mtransforms
 
 from helpers3 import data_cut, band_cut
 from plot2 import plot_trajectory_core
@@ -129,7 +131,16 @@ class StarData(object):
         return columns
 
 
-def lightcurve_axes_with_info(stardata, band, axes, colorscale, cmap, vmin, vmax, **kwargs):
+def lightcurve_columns(stardata, band):
+    """
+    The columns a light curve panel plots for one band.
+
+    Returns (date, columns, date_info, columns_info, bridge): the
+    unflagged data, then the flagged ("info") data, with dates squeezed
+    together by stardata.abridger if it has one. `bridge` is the
+    abridger's output, or None.
+
+    """
 
     columns = stardata.get_columns(band, max_flag=0)
     columns_info = stardata.get_columns(band, min_flag=1, max_flag=256)
@@ -137,6 +148,7 @@ def lightcurve_axes_with_info(stardata, band, axes, colorscale, cmap, vmin, vmax
     date = np.copy(columns['date'])
     date_info = np.copy(columns_info['date'])
 
+    bridge = None
     if stardata.abridger:
         bridge = stardata.abridger(stardata, flags=256)
         # this logic should get moved into StarData...
@@ -146,6 +158,13 @@ def lightcurve_axes_with_info(stardata, band, axes, colorscale, cmap, vmin, vmax
         date_info[date_info > bridge['s1_s2_bound']] -= bridge['s2_subtraction_factor']
         date_info[date_info > bridge['s2_s3_bound'] - bridge['s2_subtraction_factor']] -= bridge['s3_subtraction_factor']
 
+    return date, columns, date_info, columns_info, bridge
+
+
+def lightcurve_axes_with_info(stardata, band, axes, colorscale, cmap, vmin, vmax, **kwargs):
+
+    date, columns, date_info, columns_info, bridge = lightcurve_columns(stardata, band)
+
     if len(columns['date']) > 0:
         # First, plot the errorbars, with no markers, in the background:
         axes.errorbar( date, columns['mag'], marker=None,
@@ -190,6 +209,12 @@ def lightcurve_axes_with_info(stardata, band, axes, colorscale, cmap, vmin, vmax
     axes.get_figure().canvas.draw()
 
 
+def fold(date, period, offset=0):
+    """ Phases (0 to 1) of `date` folded on `period`, shifted by `offset`. """
+
+    return ((date % period) / period + offset) % 1
+
+
 def phase_axes_with_info(stardata, band, period, axes, colorscale, cmap, vmin, vmax, offset=0, **kwargs):
 
     columns = stardata.get_columns(band, max_flag=0)
@@ -198,8 +223,8 @@ def phase_axes_with_info(stardata, band, period, axes, colorscale, cmap, vmin, v
     date = np.copy(columns['date'])
     date_info = np.copy(columns_info['date'])
 
-    phase = ((date % period) / period + offset) % 1
-    phase_info = ((date_info % period) / period + offset) % 1
+    phase = fold(date, period, offset)
+    phase_info = fold(date_info, period, offset)
 
     if len(columns['date']) > 0:
         # plot the greyed-out versions on left and right
@@ -312,24 +337,16 @@ def colorcolor_axes(stardata, axes, colorscale, cmap, vmin, vmax, color_slope=Fa
         print "Color-color plot broke: {0}".format(e)
         pass
 
-def basic_lc(stardata, timecolor=True, custom_xlabel=False, time_cmap='jet'):
+def basic_lc_layout():
     """
-    Proof-of-concept reimplementation of plot3.graded_lc.
+    The empty five-panel figure of basic_lc: J, H, K light curves
+    stacked on the left (sharing their time axis), and color-color
+    and color-magnitude panels on the right.
 
-    Fewer bells and whistles, but looks perfect, and is much cleaner.
+    Returns (fig, (ax_j, ax_h, ax_k, ax_jhk, ax_khk)).
 
     """
 
-    # kwargs defaulting over
-    # time_cmap = 'jet'
-    color_slope = False
-    d_cmap={'j':'Blues', 'h': 'Greens', 'k': 'Reds'}
-
-    if timecolor is True:
-        colorscale='date'
-    else:
-        colorscale='grade'
-
     fig = plt.figure(figsize = (10, 6), dpi=80, facecolor='w', edgecolor='k')
 
     bottom = 0.1
@@ -344,6 +361,28 @@ def basic_lc(stardata, timecolor=True, custom_xlabel=False, time_cmap='jet'):
     ax_jhk = fig.add_axes( (.65, bottom, .3, .375) )
     ax_khk = fig.add_axes( (.65, bottom+.475, .3, .375) )
 
+    return fig, (ax_j, ax_h, ax_k, ax_jhk, ax_khk)
+
+def basic_lc(stardata, timecolor=True, custom_xlabel=False, time_cmap='jet'):
+    """
+    Proof-of-concept reimplementation of plot3.graded_lc.
+
+    Fewer bells and whistles, but looks perfect, and is much cleaner.
+
+    """
+
+    # kwargs defaulting over
+    # time_cmap = 'jet'
+    color_slope = False
+    d_cmap={'j':'Blues', 'h': 'Greens', 'k': 'Reds'}
+
+    if timecolor is True:
+        colorscale='date'
+    else:
+        colorscale='grade'
+
+    fig, (ax_j, ax_h, ax_k, ax_jhk, ax_khk) = basic_lc_layout()
+
     d_ax = {'j': ax_j, 'h': ax_h, 'k': ax_k}
     
     if timecolor:
@@ -512,7 +551,7 @@ def multi_lightcurve(stardatas, dimensions, bands, cmap='jet', colorscale='date'
     elif len(stardatas) != len(bands):
         raise ValueError("List of bands should be same length as list of input stars")
 
-    fig = plt.figure(figsize = (1.5+xdim*5, 0.6+ydim*1.8), 
+    fig = plt.figure(figsize = (1.5+xdim*5, 0.6+ydim*1.8),
                      dpi=80, facecolor='w', edgecolor='k')
 
     # single colorscale across all light curves
@@ -761,21 +800,16 @@ def multi_lc_colors(stardatas, bands, cmap='jet', colorscale='date', figscale=1)
     return fig
 
 
-def lc_and_phase_and_colors(stardata, period=None, timecolor=True, custom_xlabel=False, time_cmap='jet', offset=0):
+def lc_and_phase_and_colors_layout():
     """
-    Generates an eight-panel lightcurve: phase-folded, straight, and color info.
+    The empty eight-panel figure of lc_and_phase_and_colors: phased
+    J, H, K on the left, straight J, H, K in the middle, and
+    color-color and color-magnitude panels on the right.
 
-    """
+    Returns (fig, (ax_j_lc, ax_h_lc, ax_k_lc, ax_j_phase, ax_h_phase,
+    ax_k_phase, ax_jhk, ax_khk)).
 
-    # kwargs defaulting over
-    # time_cmap = 'jet'
-    color_slope = False
-    d_cmap={'j':'Blues', 'h': 'Greens', 'k': 'Reds'}
-
-    if timecolor is True:
-        colorscale='date'
-    else:
-        colorscale='grade'
+    """
 
     stretch_factor = 1.575
 
@@ -801,6 +835,28 @@ def lc_and_phase_and_colors(stardata, period=None, timecolor=True, custom_xlabel
     ax_jhk = fig.add_axes( (color_left, bottom, color_width, color_height) )
     ax_khk = fig.add_axes( (color_left, bottom+.475, color_width, color_height) )
 
+    return fig, (ax_j_lc, ax_h_lc, ax_k_lc, ax_j_phase, ax_h_phase, ax_k_phase,
+                 ax_jhk, ax_khk)
+
+def lc_and_phase_and_colors(stardata, period=None, timecolor=True, custom_xlabel=False, time_cmap='jet', offset=0):
+    """
+    Generates an eight-panel lightcurve: phase-folded, straight, and color info.
+
+    """
+
+    # kwargs defaulting over
+    # time_cmap = 'jet'
+    color_slope = False
+    d_cmap={'j':'Blues', 'h': 'Greens', 'k': 'Reds'}
+
+    if timecolor is True:
+        colorscale='date'
+    else:
+        colorscale='grade'
+
+    fig, (ax_j_lc, ax_h_lc, ax_k_lc, ax_j_phase, ax_h_phase, ax_k_phase,
+          ax_jhk, ax_khk) = lc_and_phase_and_colors_layout()
+
     d_ax_lc = {'j': ax_j_lc, 'h': ax_h_lc, 'k': ax_k_lc}
     d_ax_phase = {'j': ax_j_phase, 'h': ax_h_phase, 'k': ax_k_phase}
 
@@ -871,3 +927,594 @@ def lc_and_phase_and_colors(stardata, period=None, timecolor=True, custom_xlabel
     return fig
 
 
+# Templates: each of the figures above, built once and then redrawn for
+# star after star. Making the figure, axes, colorbars and text costs far
+# more than drawing a small light curve, so in bulk runs it's much
+# faster to keep one figure and only move its data.
+#
+# Example use:
+#
+#     >>> from figure_output import save_figure
+#     >>> template = LightcurveTemplate()
+#     >>> for stardata, outfile in zip(stardatas, outfiles):
+#     ...     save_figure(template.draw(stardata), outfile, close=False)
+
+
+def _set_datalim(axes, xy):
+    """ Replaces an axes' data limits with those of points `xy`. """
+
+    axes.dataLim.set_points(mtransforms.Bbox.null().get_points())
+    axes.ignore_existing_data_limits = True
+    if len(xy) > 0:
+        axes.update_datalim(xy)
+
+
+def _reset_xticks(axes):
+    """ Undoes any set_xticks / set_xticklabels on `axes`. """
+
+    axes.xaxis.set_major_locator(ticker.AutoLocator())
+    axes.xaxis.set_major_formatter(ticker.ScalarFormatter())
+
+
+def _set_scatter(collection, x, y, c, vmin, vmax):
+    """ Moves a scatter plot to new points and colors. """
+
+    collection.set_offsets(np.column_stack((x, y)))
+    collection.set_array(np.asarray(c))
+    collection.set_clim(vmin, vmax)
+
+
+class _Errorbars(object):
+    """
+    The artists of one axes.errorbar() call, made once (on a dummy
+    point, so they get errorbar's own styling) and then moved to new
+    data with set_data().
+
+    """
+
+    def __init__(self, axes, **kwargs):
+
+        data_line, caplines, barlinecols = axes.errorbar([0], [0], yerr=[0],
+                                                         **kwargs)
+        self.data_line = data_line
+        self.caplines = list(caplines)
+        self.barlinecols = list(barlinecols)
+
+    def set_data(self, x, y, err):
+
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        err = np.asarray(err, dtype=float)
+        lower = y - err
+        upper = y + err
+
+        if self.data_line is not None:
+            self.data_line.set_data(x, y)
+
+        # errorbar() makes the lower caps first, then the upper ones.
+        for capline, ends in zip(self.caplines, (lower, upper)):
+            capline.set_data(x, ends)
+
+        segments = np.column_stack((x, lower, x, upper)).reshape(-1, 2, 2)
+        for barlinecol in self.barlinecols:
+            barlinecol.set_segments(segments)
+
+
+def _errorbar_limits(x, y, err):
+    """ The points errorbar() + scatter() would add to the data limits. """
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    err = np.asarray(err, dtype=float)
+
+    return np.column_stack((np.concatenate((x, x, x)),
+                            np.concatenate((y - err, y, y + err))))
+
+
+class _LightcurvePanel(object):
+    """ The reusable artists of a lightcurve_axes_with_info() panel. """
+
+    def __init__(self, axes, cmap):
+
+        self.axes = axes
+
+        self.errorbars = _Errorbars(axes, marker=None, fmt=None, ecolor='k',
+                                    zorder=0)
+        self.points = axes.scatter([0], [0], c=[0], cmap=cmap, zorder=100)
+
+        self.errorbars_info = _Errorbars(axes, marker=None, fmt=None,
+                                         ecolor='k', zorder=0)
+        self.points_info = axes.scatter([0], [0], marker='d', c=[0],
+                                        cmap=cmap, zorder=100)
+
+        self.bridge_lines = [axes.plot([0, 0], [0, 30], "k--", scaley=False,
+                                       scalex=False)[0] for i in range(2)]
+
+        # Magnitudes are backwards; autoscaling keeps this flipped.
+        axes.invert_yaxis()
+
+        self.limits = np.zeros((0, 2))
+        self.bridge = None
+
+    def update(self, stardata, band, colorscale, vmin, vmax):
+        """ Moves the panel's artists to `stardata`'s `band` data. """
+
+        date, columns, date_info, columns_info, bridge = (
+            lightcurve_columns(stardata, band))
+
+        self.errorbars.set_data(date, columns['mag'], columns['err'])
+        _set_scatter(self.points, date, columns['mag'], columns[colorscale],
+                     vmin, vmax)
+
+        self.errorbars_info.set_data(date_info, columns_info['mag'],
+                                     columns_info['err'])
+        _set_scatter(self.points_info, date_info, columns_info['mag'],
+                     columns_info[colorscale], vmin, vmax)
+
+        self.limits = np.concatenate(
+            (_errorbar_limits(date, columns['mag'], columns['err']),
+             _errorbar_limits(date_info, columns_info['mag'],
+                              columns_info['err'])))
+        self.bridge = bridge
+
+    def autoscale(self, stardata):
+        """
+        Sets the panel's limits and ticks the way
+        lightcurve_axes_with_info() does.
+
+        Call this after update(), panel by panel in the order the
+        original function plots them (shared axes depend on it).
+
+        """
+
+        axes = self.axes
+        bridge = self.bridge
+
+        _set_datalim(axes, self.limits)
+        axes.set_autoscale_on(True)
+        if len(self.limits) > 0:
+            axes.autoscale_view()
+        else:
+            # Nothing plotted: matplotlib's default limits, flipped.
+            axes.set_ylim(1, 0)
+
+        # don't go negative on the X axis ever
+        if stardata.min_date >= 0:
+            xlims = axes.get_xlim()
+            axes.set_xlim( max(xlims[0], 0), xlims[1] )
+
+        for line in self.bridge_lines:
+            line.set_visible(bridge is not None)
+
+        if bridge is not None:
+            self.bridge_lines[0].set_xdata([bridge['s1_s2_line']]*2)
+            self.bridge_lines[1].set_xdata([bridge['s2_s3_line']]*2)
+
+            axes.set_xticks(bridge['xticks'])
+            axes.set_xticklabels(bridge['xticklabels'])
+            axes.set_xlim(bridge['xlim_bounds'])
+
+
+class _PhasePanel(object):
+    """ The reusable artists of a phase_axes_with_info() panel. """
+
+    def __init__(self, axes, cmap):
+
+        self.axes = axes
+
+        # the greyed-out copies on left and right
+        grey = dict(mfc='0.7', mec='0.7', ecolor='0.7', ms=6, zorder=-5)
+        self.ghosts = [_Errorbars(axes, fmt='o', **grey) for i in range(2)]
+        self.ghosts_info = [_Errorbars(axes, fmt='d', **grey)
+                            for i in range(2)]
+
+        self.errorbars = _Errorbars(axes, marker=None, fmt=None, ecolor='k',
+                                    zorder=0)
+        self.points = axes.scatter([0], [0], c=[0], cmap=cmap, zorder=100)
+
+        self.errorbars_info = _Errorbars(axes, marker=None, fmt=None,
+                                         ecolor='k', zorder=0)
+        self.points_info = axes.scatter([0], [0], marker='d', c=[0],
+                                        cmap=cmap, zorder=100)
+
+        axes.invert_yaxis()
+
+        axes.set_xticks( [0, 0.5, 1] )
+        axes.set_xticks( np.arange(-.5,1.5,.1), minor=True)
+
+        axes.set_xlim(-0.25, 1.25)
+
+    def update(self, stardata, band, period, colorscale, vmin, vmax,
+               offset=0):
+        """ Moves the panel's artists to `stardata`'s folded `band` data. """
+
+        columns = stardata.get_columns(band, max_flag=0)
+        columns_info = stardata.get_columns(band, min_flag=1, max_flag=256)
+
+        phase = fold(np.copy(columns['date']), period, offset)
+        phase_info = fold(np.copy(columns_info['date']), period, offset)
+
+        for ghost, shift in zip(self.ghosts, (-1, 1)):
+            ghost.set_data(phase+shift, columns['mag'], columns['err'])
+        for ghost, shift in zip(self.ghosts_info, (-1, 1)):
+            ghost.set_data(phase_info+shift, columns_info['mag'],
+                           columns_info['err'])
+
+        self.errorbars.set_data(phase, columns['mag'], columns['err'])
+        _set_scatter(self.points, phase, columns['mag'], columns[colorscale],
+                     vmin, vmax)
+
+        self.errorbars_info.set_data(phase_info, columns_info['mag'],
+                                     columns_info['err'])
+        _set_scatter(self.points_info, phase_info, columns_info['mag'],
+                     columns_info[colorscale], vmin, vmax)
+
+        limits = np.concatenate(
+            (_errorbar_limits(phase, columns['mag'], columns['err']),
+             _errorbar_limits(phase_info, columns_info['mag'],
+                              columns_info['err'])))
+
+        axes = self.axes
+        _set_datalim(axes, limits)
+        axes.set_autoscaley_on(True)
+        if len(limits) > 0:
+            axes.autoscale_view(scalex=False)
+        else:
+            axes.set_ylim(1, 0)
+        axes.set_xlim(-0.25, 1.25)
+
+
+class _ColorPanel(object):
+    """
+    The reusable artists of a colorcolor_axes() panel, or with
+    `band`='jjh' or 'khk', of a colormag_axes() panel.
+
+    """
+
+    def __init__(self, axes, cmap, band=None):
+
+        self.axes = axes
+        self.band = band
+
+        if band is None:
+            plot_trajectory_core(axes, [0], [0], [0], cmap=cmap, vmin=0,
+                                 vmax=1, edgecolors='k', linewidths=0.5)
+        else:
+            plot_trajectory_core(axes, [0], [0], [0], ms=False, ctts=False,
+                                 cmap=cmap, vmin=0, vmax=1, edgecolors='k',
+                                 linewidths=0.5)
+
+        self.points = axes.collections[-1]
+        self.colorbar = getattr(self.points, 'colorbar', None)
+
+        # The main sequence / CTTS lines never move, but they count
+        # towards the plot's limits.
+        static = [line.get_xydata() for line in axes.lines]
+        if static:
+            self.static_limits = np.concatenate(static)
+        else:
+            self.static_limits = np.zeros((0, 2))
+
+        if band is not None:
+            axes.invert_yaxis()
+
+    def update(self, stardata, vmin, vmax):
+        """ Moves the panel's points to `stardata`'s colors. """
+
+        if self.band is None:
+            columns = stardata.get_colorcolor_columns(max_flag=256)
+            x, y = columns['hmk'], columns['jmh']
+        else:
+            columns = stardata.get_colormag_columns(self.band, max_flag=256)
+            x, y = columns['color'], columns['mag']
+
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+
+        _set_scatter(self.points, x, y, columns['date'], vmin, vmax)
+        if self.colorbar is not None:
+            self.colorbar.update_normal(self.points)
+
+        axes = self.axes
+        _set_datalim(axes, np.concatenate((self.static_limits,
+                                           np.column_stack((x, y)))))
+        axes.set_autoscale_on(True)
+        _reset_xticks(axes)
+        axes.autoscale_view()
+
+        # plot boundaries are manually set for readability, if necessary
+        if len(x) > 0 and len(axes.get_xticks()) > 7:
+            xmin = np.floor(x.min() * 0.95 * 20)/20.
+            xmax = np.ceil( x.max() * 1.05 * 20)/20.
+
+            xticks = np.linspace(xmin, xmax, 6)
+            axes.set_xticks(xticks)
+
+
+def _color_limits(stardata, timecolor):
+    """ The (vmin, vmax) of basic_lc's color scale for `stardata`. """
+
+    if timecolor:
+        return stardata.min_date, stardata.max_date
+    else:
+        return 0.8, 1
+
+
+class LightcurveTemplate(object):
+    """
+    basic_lc(), built once and redrawn for each star.
+
+    Parameters are those of basic_lc(). draw(stardata) returns the same
+    figure every time, now showing `stardata`; save it before drawing
+    the next star.
+
+    """
+
+    def __init__(self, timecolor=True, custom_xlabel=False, time_cmap='jet'):
+
+        d_cmap={'j':'Blues', 'h': 'Greens', 'k': 'Reds'}
+        if timecolor:
+            d_cmap = {'j': time_cmap, 'h': time_cmap, 'k': time_cmap}
+
+        self.timecolor = timecolor
+        self.custom_xlabel = custom_xlabel
+        if timecolor is True:
+            self.colorscale='date'
+        else:
+            self.colorscale='grade'
+
+        fig, (ax_j, ax_h, ax_k, ax_jhk, ax_khk) = basic_lc_layout()
+
+        self.figure = fig
+        self.bands = ['j', 'h', 'k']
+        self.lc_axes = [ax_j, ax_h, ax_k]
+        self.lc_panels = [_LightcurvePanel(ax, d_cmap[band])
+                          for ax, band in zip(self.lc_axes, self.bands)]
+
+        self.color_panels = [_ColorPanel(ax_jhk, time_cmap),
+                             _ColorPanel(ax_khk, time_cmap, band='khk')]
+
+        ax_j.set_ylabel( "J",{'rotation':'horizontal', 'fontsize':'large'} )
+        ax_h.set_ylabel( "H",{'rotation':'horizontal', 'fontsize':'large'} )
+        ax_k.set_ylabel( "K",{'rotation':'horizontal', 'fontsize':'large'} )
+
+        ax_jhk.set_xlabel( "H-K" )
+        ax_jhk.set_ylabel( "J-H")
+        ax_khk.set_xlabel( "H-K" )
+        ax_khk.set_ylabel( "K")
+
+        fig.ax_k = ax_k
+        fig.ax_h = ax_h
+        fig.ax_j = ax_j
+        fig.ax_jhk = ax_jhk
+        fig.ax_khk = ax_khk
+
+    def draw(self, stardata):
+        """ Shows `stardata` in the template figure, and returns it. """
+
+        vmin, vmax = _color_limits(stardata, self.timecolor)
+
+        for ax in self.lc_axes:
+            _reset_xticks(ax)
+        for panel, band in zip(self.lc_panels, self.bands):
+            panel.update(stardata, band, self.colorscale, vmin, vmax)
+        for panel in self.lc_panels:
+            panel.autoscale(stardata)
+
+        for panel in self.color_panels:
+            panel.update(stardata, vmin, vmax)
+
+        # Hide the bad labels...
+        plt.setp(self.figure.ax_j.get_xticklabels(), visible=False)
+        plt.setp(self.figure.ax_h.get_xticklabels(), visible=False)
+
+        if self.custom_xlabel:
+            self.figure.ax_k.set_xlabel( self.custom_xlabel )
+        else:
+            self.figure.ax_k.set_xlabel( "Time (MJD - %.1f)" %
+                                         stardata.date_offset )
+
+        return self.figure
+
+
+class LcPhaseColorsTemplate(object):
+    """
+    lc_and_phase_and_colors(), built once and redrawn for each star.
+
+    Parameters are those of lc_and_phase_and_colors() except `period`
+    and `offset`, which go to draw(stardata, period, offset=0) since
+    they change from star to star.
+
+    """
+
+    def __init__(self, timecolor=True, custom_xlabel=False, time_cmap='jet'):
+
+        d_cmap={'j':'Blues', 'h': 'Greens', 'k': 'Reds'}
+        if timecolor:
+            d_cmap = {'j': time_cmap, 'h': time_cmap, 'k': time_cmap}
+
+        self.timecolor = timecolor
+        self.custom_xlabel = custom_xlabel
+        if timecolor is True:
+            self.colorscale='date'
+        else:
+            self.colorscale='grade'
+
+        fig, (ax_j_lc, ax_h_lc, ax_k_lc, ax_j_phase, ax_h_phase, ax_k_phase,
+              ax_jhk, ax_khk) = lc_and_phase_and_colors_layout()
+
+        self.figure = fig
+        self.bands = ['j', 'h', 'k']
+        self.lc_axes = [ax_j_lc, ax_h_lc, ax_k_lc]
+        self.lc_panels = [_LightcurvePanel(ax, d_cmap[band])
+                          for ax, band in zip(self.lc_axes, self.bands)]
+        self.phase_panels = [
+            _PhasePanel(ax, d_cmap[band])
+            for ax, band in zip([ax_j_phase, ax_h_phase, ax_k_phase],
+                                self.bands)]
+
+        self.color_panels = [_ColorPanel(ax_jhk, time_cmap),
+                             _ColorPanel(ax_khk, time_cmap, band='khk')]
+
+        plt.setp(ax_j_phase.get_xticklabels(), visible=False)
+        plt.setp(ax_h_phase.get_xticklabels(), visible=False)
+
+        ax_j_phase.set_ylabel( "J",{'rotation':'horizontal', 'fontsize':'large'} )
+        ax_h_phase.set_ylabel( "H",{'rotation':'horizontal', 'fontsize':'large'} )
+        ax_k_phase.set_ylabel( "K",{'rotation':'horizontal', 'fontsize':'large'} )
+
+        ax_jhk.set_xlabel( "H-K" )
+        ax_jhk.set_ylabel( "J-H")
+        ax_khk.set_xlabel( "H-K" )
+        ax_khk.set_ylabel( "K")
+
+        fig.ax_k_lc = ax_k_lc
+        fig.ax_h_lc = ax_h_lc
+        fig.ax_j_lc = ax_j_lc
+
+        fig.ax_k_phase = ax_k_phase
+        fig.ax_h_phase = ax_h_phase
+        fig.ax_j_phase = ax_j_phase
+
+        fig.ax_jhk = ax_jhk
+        fig.ax_khk = ax_khk
+
+    def draw(self, stardata, period, offset=0):
+        """ Shows `stardata` in the template figure, and returns it. """
+
+        vmin, vmax = _color_limits(stardata, self.timecolor)
+
+        for ax in self.lc_axes:
+            _reset_xticks(ax)
+        for panel, band in zip(self.lc_panels, self.bands):
+            panel.update(stardata, band, self.colorscale, vmin, vmax)
+        for panel in self.lc_panels:
+            panel.autoscale(stardata)
+
+        for panel, band in zip(self.phase_panels, self.bands):
+            panel.update(stardata, band, period, self.colorscale, vmin, vmax,
+                         offset=offset)
+
+        for panel in self.color_panels:
+            panel.update(stardata, vmin, vmax)
+
+        fig = self.figure
+
+        # Hide the bad labels...
+        plt.setp(fig.ax_j_lc.get_xticklabels(), visible=False)
+        plt.setp(fig.ax_h_lc.get_xticklabels(), visible=False)
+
+        if self.custom_xlabel:
+            fig.ax_k_lc.set_xlabel( self.custom_xlabel )
+        else:
+            fig.ax_k_lc.set_xlabel( "Time (MJD - %.1f)" % stardata.date_offset )
+
+        fig.ax_k_phase.set_xlabel("Phase (Period = {0:.4} days)".format(period))
+
+        return fig
+
+
+class MultiLightcurveTemplate(object):
+    """
+    multi_lightcurve(), built once and redrawn for each set of stars.
+
+    Parameters
+    ----------
+    dimensions : (int, int) tuple
+    n_panels : int
+        How many stars each draw() will show (at most the product of
+        `dimensions`).
+    cmap : str, optional
+    colorscale : {'date' | 'grade'}, optional
+
+    draw(stardatas, bands) takes the other two arguments of
+    multi_lightcurve() and returns the same figure every time.
+
+    """
+
+    def __init__(self, dimensions, n_panels, cmap='jet', colorscale='date'):
+
+        xdim, ydim = dimensions
+
+        if n_panels > (xdim * ydim):
+            raise ValueError("Number of input stars should be less than or equal to product of dimensions")
+
+        self.xdim = xdim
+        self.n_panels = n_panels
+        self.colorscale = colorscale
+
+        fig = plt.figure(figsize = (1.5+xdim*5, 0.6+ydim*1.8),
+                         dpi=80, facecolor='w', edgecolor='k')
+        self.figure = fig
+
+        self.panels = []
+        self.labels = []
+        for i in range(1, 1+n_panels):
+
+            if i == 1: sharex = None
+            else: sharex = fig.ax1
+
+            ax = fig.add_subplot(ydim, xdim, i, sharex=sharex)
+            fig.__setattr__('ax{0}'.format(i), ax)
+
+            self.panels.append(_LightcurvePanel(ax, cmap))
+            self.labels.append(ax.text(0.7, 0.1, '', transform=ax.transAxes,
+                                       fontsize='small'))
+
+    def draw(self, stardatas, bands):
+        """ Shows `stardatas` in the template figure, and returns it. """
+
+        if len(stardatas) != self.n_panels:
+            raise ValueError("This template shows exactly {0} stars".format(self.n_panels))
+        elif len(stardatas) != len(bands):
+            raise ValueError("List of bands should be same length as list of input stars")
+
+        fig = self.figure
+
+        # single colorscale across all light curves
+        if self.colorscale == 'date':
+            vmin = min([stardata.min_date for stardata in stardatas])
+            vmax = max([stardata.max_date for stardata in stardatas])
+        elif self.colorscale == 'grade':
+            vmin = 0.8
+            vmax = 1.0
+
+        # Panels share their time axis, so clear everybody's limits
+        # before rebuilding them panel by panel.
+        for panel in self.panels:
+            _set_datalim(panel.axes, np.zeros((0, 2)))
+            _reset_xticks(panel.axes)
+
+        fig.xlim = (0,0)
+        fig.xticks = []
+        fig.xticklabels = []
+
+        for stardata, band, panel, label, i in zip(stardatas, bands,
+                                                   self.panels, self.labels,
+                                                   range(1, 1+len(stardatas))):
+            ax = panel.axes
+
+            panel.update(stardata, band, 'date', vmin, vmax)
+            panel.autoscale(stardata)
+
+            ax.set_ylabel( band.upper(),{'rotation':'horizontal', 'fontsize':'large'} )
+
+            fig.xlim = (min(fig.xlim[0], ax.get_xlim()[0]), max(fig.xlim[1], ax.get_xlim()[1]))
+            if len(ax.get_xticks()) > len(fig.xticks):
+                fig.xticks = ax.get_xticks()
+                # Tick label text only exists once the figure is drawn.
+                fig.canvas.draw()
+                fig.xticklabels = [x.get_text() for x in ax.get_xticklabels()]
+
+            ax.set_xlim(fig.xlim)
+            ax.set_xticks(fig.xticks)
+            ax.set_xticklabels(fig.xticklabels)
+
+            label.set_text(stardata.name)
+
+        for i, panel in enumerate(self.panels, 1):
+            if i <= len(bands) - self.xdim:
+                plt.setp(panel.axes.get_xticklabels(), visible=False)
+
+        return fig
+
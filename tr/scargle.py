@@ -28,9 +28,19 @@ Reference:
   bib code: 1989ApJ...338..277P
 
 """
+import hashlib
+from collections import OrderedDict
+
 from numpy import *
 from numpy.fft import *
 
+# An LRU cache of fasper "windows", keyed by a hash of the timestamps plus
+# (ofac, hifac, MACC). Stars observed on the same chip set share their
+# timestamps, and so do the bands of one star, so this saves a lot.
+window_cache_size = 256
+__window_cache__ = OrderedDict()
+__window_cache_stats__ = {'hits':0, 'misses':0}
+
 def __spread__(y, yy, n, x, m):
   """
   Given an array yy(0:n-1), extirpolate (spread) a value y into
@@ -66,7 +76,133 @@ def __spread__(y, yy, n, x, m):
       nden=(nden/(j+1-ilo))*(j-ihi)
       yy[j] = yy[j] + y*fac/(nden*(x-j))
 
-def fasper(x,y,ofac,hifac, MACC=4):
+def __spread_weights__(y, n, x, m):
+  """
+  Computes where, and how much of, each value y[j] gets extirpolated
+  into the m array elements around the "fictional" element number x[j].
+  Arguments:
+    y : value(s) to spread; an array like x, or a scalar.
+    n : length of the array being spread into.
+    x : array of (possibly noninteger) array element numbers.
+    m : number of array elements to spread each value into.
+  Returns:
+    idx, val : (len(x), m) arrays of target elements and contributions,
+      with each row in the same order that __spread__ adds them.
+  """
+  nfac=[0,1,1,2,6,24,120,720,5040,40320,362880]
+  if m > 10. :
+    print 'factorial table too small in spread'
+    return
+
+  x = asarray(x, dtype='float')
+  y = asarray(y, dtype='float') * ones_like(x)
+
+  ix = x.astype(int)
+  exact = (x == ix)
+
+  ilo = (x-0.5*float(m)+1.0).astype(int)
+  ilo = minimum( maximum( ilo , 1 ), n-m+1 )
+  ihi = ilo+m-1
+
+  fac = x-ilo
+  for j in range(1, m): fac = fac*(x-(ilo+j))
+
+  # The Lagrange denominators don't depend on x, only on how far 
+  # below ihi we are, so work them out once (they're exact integers).
+  ndens = [nfac[m]]
+  for d in range(1, m): ndens.append( (ndens[-1]//(m-d))*(-d) )
+
+  # Column d holds each point's contribution to element ihi-d.
+  idx = zeros((x.size, m), dtype=int)
+  val = zeros((x.size, m), dtype='float')
+
+  olderr = seterr(divide='ignore', invalid='ignore')
+  for d in range(m):
+    j = ihi-d
+    idx[:,d] = j
+    val[:,d] = y*fac/(ndens[d]*(x-j))
+  seterr(**olderr)
+
+  # Points that land exactly on an element just get added there.
+  idx[exact,:] = ix[exact][:,newaxis]
+  val[exact,0] = y[exact]
+  val[exact,1:] = 0.
+
+  if idx.size and idx.max() >= n:
+    raise IndexError('extirpolation index out of range')
+
+  return idx, val
+
+def __spread_array__(y, n, x, m):
+  """
+  Vectorized __spread__: extirpolates every value y[j] into the m
+  array elements that best approximate the "fictional" array element 
+  number x[j], all at once.
+
+  Gives, bit for bit, the array that calling __spread__ once per point 
+  on a zeroed array would: the Lagrange weights are computed in the 
+  same floating-point order, and bincount accumulates them in the same 
+  order the loop would.
+  Arguments:
+    y, n, x, m : as in __spread_weights__.
+  Returns:
+    yy : array of length n with all the values spread into it.
+  """
+  idx, val = __spread_weights__(y, n, x, m)
+
+  return bincount(idx.ravel(), weights=val.ravel(), minlength=n)
+
+def __window__(ck, n, ndim, nout, MACC, vectorize=True):
+  """
+  Computes the data-independent ("window") half of fasper: spreads 1.0
+  at twice each scaled timestamp, FFTs it, and derives the per-frequency
+  weights that the Lomb value needs.
+  Arguments:
+    ck : scaled timestamps, ((x-xmin)*fac) % ndim, as in fasper.
+    n, ndim, nout, MACC : as in fasper.
+    vectorize : use __spread_array__ rather than looping over __spread__.
+  Returns:
+    (cwt, swt, den) : arrays of length nout.
+  """
+  wk2 = zeros(ndim, dtype='complex')
+  ckk  = (2.0*ck) % ndim
+
+  if vectorize:
+    wk2 = __spread_array__(1.0,ndim,ckk,MACC).astype('complex')
+  else:
+    for j in range(0L, n):
+      __spread__(1.0,wk2,ndim,ckk[j],MACC)
+
+  wk2 = ifft( wk2 )*ndim
+
+  wk2 = wk2[1:nout+1]
+  rwk2 = wk2.real
+  iwk2 = wk2.imag
+
+  hypo2 = 2.0 * abs( wk2 )
+  hc2wt = rwk2/hypo2
+  hs2wt = iwk2/hypo2
+
+  cwt  = sqrt(0.5+hc2wt)
+  swt  = sign(hs2wt)*(sqrt(0.5-hc2wt))
+  den  = 0.5*n+hc2wt*rwk2+hs2wt*iwk2
+
+  return cwt, swt, den
+
+def clear_window_cache():
+  """ Empties fasper's window cache and resets its hit/miss counts. """
+  __window_cache__.clear()
+  __window_cache_stats__['hits'] = 0
+  __window_cache_stats__['misses'] = 0
+
+def window_cache_info():
+  """ Returns a dict of the window cache's hits, misses and size. """
+  info = dict(__window_cache_stats__)
+  info['size'] = len(__window_cache__)
+  info['maxsize'] = window_cache_size
+  return info
+
+def fasper(x,y,ofac,hifac, MACC=4, vectorize=True, cache=True):
   """ function fasper
     Given abscissas x (which need not be equally spaced) and ordinates
     y, and given a desired oversampling factor ofac (a typical value
@@ -102,10 +238,21 @@ def fasper(x,y,ofac,hifac, MACC=4):
       Prob : False Alarm Probability of the largest Periodogram value
       MACC : Number of interpolation points per 1/4 cycle
             of highest frequency
+      Vectorize : Extirpolate all the data at once with 
+            __spread_array__ (default), rather than looping over 
+            __spread__. Both give identical periodograms; the loop 
+            is kept for verification.
+      Cache : Look up (and store) the window half of the computation,
+            which depends only on X, Ofac, Hifac and MACC, in an LRU 
+            cache shared by all calls (default True). Holds up to
+            `window_cache_size` windows; set that to 0 to disable.
 
   History:
     02/23/2009, v1.0, MF
       Translation of IDL code (orig. Numerical recipies)
+    Vectorized extirpolation (__spread_array__) added; the 
+      original per-point loop stays available with vectorize=False.
+    The window half is cached across calls with identical timestamps.
   """
   #Check dimensions of input arrays
   n = long(len(x))
@@ -131,40 +278,48 @@ def fasper(x,y,ofac,hifac, MACC=4):
   xmax = x.max()
   xdif = xmax-xmin
 
-  #extirpolate the data into the workspaces
+  #extirpolate the data into the workspace
   wk1 = zeros(ndim, dtype='complex')
-  wk2 = zeros(ndim, dtype='complex')
 
   fac  = ndim/(xdif*ofac)
   fndim = ndim
   ck  = ((x-xmin)*fac) % fndim
-  ckk  = (2.0*ck) % fndim
 
-  for j in range(0L, n):
-    __spread__(y[j]-ave,wk1,ndim,ck[j],MACC)
-    __spread__(1.0,wk2,ndim,ckk[j],MACC)
+  if vectorize:
+    wk1 = __spread_array__(y-ave,ndim,ck,MACC).astype('complex')
+  else:
+    for j in range(0L, n):
+      __spread__(y[j]-ave,wk1,ndim,ck[j],MACC)
 
-  #Take the Fast Fourier Transforms
+  #The other workspace (the window) depends only on the timestamps,
+  #so it may already be cached from a star with the same sampling.
+  if cache and window_cache_size > 0:
+    key = (hashlib.sha1(ascontiguousarray(x, dtype='float')).hexdigest(),
+           float(ofac), float(hifac), MACC)
+    window = __window_cache__.pop(key, None)
+    if window is None:
+      __window_cache_stats__['misses'] += 1
+      window = __window__(ck,n,ndim,nout,MACC,vectorize)
+    else:
+      __window_cache_stats__['hits'] += 1
+    __window_cache__[key] = window   # (re)insert as most recently used
+    while len(__window_cache__) > window_cache_size:
+      __window_cache__.popitem(last=False)
+  else:
+    window = __window__(ck,n,ndim,nout,MACC,vectorize)
+
+  cwt, swt, den = window
+
+  #Take the Fast Fourier Transform
   wk1 = ifft( wk1 )*len(wk1)
-  wk2 = ifft( wk2 )*len(wk1)
 
   wk1 = wk1[1:nout+1]
-  wk2 = wk2[1:nout+1]
   rwk1 = wk1.real
   iwk1 = wk1.imag
-  rwk2 = wk2.real
-  iwk2 = wk2.imag
   
   df  = 1.0/(xdif*ofac)
   
   #Compute the Lomb value for each frequency
-  hypo2 = 2.0 * abs( wk2 )
-  hc2wt = rwk2/hypo2
-  hs2wt = iwk2/hypo2
-
-  cwt  = sqrt(0.5+hc2wt)
-  swt  = sign(hs2wt)*(sqrt(0.5-hc2wt))
-  den  = 0.5*n+hc2wt*rwk2+hs2wt*iwk2
   cterm = (cwt*rwk1+swt*iwk1)**2./den
   sterm = (cwt*iwk1-swt*rwk1)**2./(n-den)
 
@@ -191,9 +346,182 @@ def fasper(x,y,ofac,hifac, MACC=4):
 
   return wk1,wk2,nout,jmax,prob
 
+def __ragged__(x, y, offsets=None):
+  """
+  Puts a batch of light curves into one flat (x, y) pair plus offsets,
+  such that curve i is x[offsets[i]:offsets[i+1]].
+  Accepts flat arrays plus offsets, sequences of arrays, or 2-D arrays
+  (one curve per row) padded with NaNs.
+  """
+  if offsets is not None:
+    return asarray(x, dtype='float'), asarray(y, dtype='float'), \
+        asarray(offsets, dtype=int)
+
+  if isinstance(x, ndarray) and x.ndim == 2:
+    good = isfinite(x) & isfinite(y)
+    counts = good.sum(axis=1)
+    return x[good].astype('float'), y[good].astype('float'), \
+        concatenate(([0], cumsum(counts)))
+
+  counts = [len(xi) for xi in x]
+  return concatenate(x).astype('float'), concatenate(y).astype('float'), \
+      concatenate(([0], cumsum(counts)))
+
+def fasper_batch(x, y, ofac, hifac, offsets=None, MACC=4, batch_size=256,
+                 trim=None, full=False):
+  """ function fasper_batch
+    Lomb normalized periodograms of many light curves at once, on one
+    shared frequency grid.
+
+    Works like fasper, but instead of one small FFT per star, all the
+    stars in a batch are extirpolated with one bincount call and
+    transformed with one stacked FFT call, which saves a lot of Python
+    overhead for short (~100 point) light curves.
+
+    The shared grid uses the spacing fasper would give the star with the
+    longest time span, and goes up to the highest frequency fasper would
+    reach for any star. So each star's periodogram is sampled somewhat 
+    differently than fasper(x_i, y_i, ofac, hifac_i) would.
+
+  Arguments:
+      X, Y : The light curves. Either flat arrays of every star's 
+           abscissas and ordinates end to end (with `offsets`),
+           sequences of one array per star, or 2-D arrays with one 
+           star per row, padded with NaNs.
+      Ofac : Oversampling factor.
+      Hifac : Hifac * "average" Nyquist frequency = highest frequency,
+           as in fasper. A scalar, or one value per star.
+      Offsets : Star i is X[offsets[i]:offsets[i+1]]; only used with
+           flat arrays.
+      MACC : Number of interpolation points per 1/4 cycle
+            of highest frequency
+      Batch_size : How many stars to FFT together. Memory goes as
+            batch_size * (FFT length), so keep this moderate.
+      Trim : Optional function of Wk1 that returns which frequencies
+            to look for peaks at (e.g. timing.lsp_trim); default all.
+            Raises ValueError if it leaves none.
+      Full : Whether to return every star's whole periodogram. By
+            default only each star's peak is kept, batch by batch, so
+            memory doesn't grow as (number of stars) * nout.
+
+   Returns:
+      Wk1 : An array of Lomb periodogram frequencies (shared).
+      Wk2 : With full=True, a (number of stars, nout) array of
+           periodogram values; otherwise each star's peak value,
+           Wk2[Jmax].
+      Nout : Number of calculated frequencies.
+      Jmax : The index of each star's maximum periodogram value
+           (among the `trim` frequencies).
+      Prob : False Alarm Probability of each star's peak value.
+  """
+  x, y, offsets = __ragged__(x, y, offsets)
+
+  nstar = len(offsets)-1
+  n = diff(offsets).astype('float')
+  if nstar == 0 or n.min() < 2:
+    print 'Every light curve needs at least 2 points.'
+    return
+
+  star = repeat(arange(nstar), diff(offsets))
+
+  #Compute each star's mean, (sample) variance and range.
+  ave = bincount(star, weights=y) / n
+  var = bincount(star, weights=(y-ave[star])**2) / (n-1)
+  xmin = minimum.reduceat(x, offsets[:-1])
+  xmax = maximum.reduceat(x, offsets[:-1])
+  xdif = xmax-xmin
+
+  #Size the shared frequency grid and FFT.
+  hifac = asarray(hifac, dtype='float') * ones(nstar)
+  df = 1.0/(xdif.max()*ofac)
+  fmax = (0.5*hifac*n/xdif).max()
+  nout = long(ceil(fmax/df))
+  nfreqt = long(2*nout*MACC)
+  nfreq = 64L
+  while nfreq < nfreqt:
+    nfreq = 2*nfreq
+  ndim = long(2*nfreq)
+
+  fac = ndim*df
+  ck = ((x-xmin[star])*fac) % ndim
+  ckk = (2.0*ck) % ndim
+
+  wk1 = df*(arange(nout, dtype='float')+1.)
+  if trim is None:
+    keep = ones(nout, dtype='bool')
+  else:
+    keep = asarray(trim(wk1), dtype='bool')
+    #Like lsp_mask: no frequencies left means no peak to find (argmax
+    #would quietly give the first frequency).
+    if not keep.any():
+      raise ValueError('trim excludes every frequency of the periodogram')
+
+  jmax = zeros(nstar, dtype='int')
+  pmax = zeros(nstar)
+  if full:
+    wk2_all = zeros((nstar, nout))
+
+  for first in range(0, nstar, batch_size):
+    last = min(first+batch_size, nstar)
+    nrow = last-first
+    sl = slice(offsets[first], offsets[last])
+    row = star[sl]-first
+
+    idx1, val1 = __spread_weights__(y[sl]-ave[star[sl]], ndim, ck[sl], MACC)
+    idx2, val2 = __spread_weights__(1.0, ndim, ckk[sl], MACC)
+
+    #Data workspaces go in rows [0, nrow), windows in [nrow, 2*nrow).
+    base = (row*ndim)[:,newaxis]
+    idx = concatenate(( (idx1+base).ravel(), (idx2+base+nrow*ndim).ravel() ))
+    val = concatenate(( val1.ravel(), val2.ravel() ))
+
+    wk = bincount(idx, weights=val, minlength=2*nrow*ndim)
+    wk = wk.reshape(2*nrow, ndim).astype('complex')
+
+    #One FFT call for the whole batch.
+    wk = ifft( wk, axis=1 )*ndim
+    wk = wk[:,1:nout+1]
+
+    rwk1 = wk[:nrow].real
+    iwk1 = wk[:nrow].imag
+    rwk2 = wk[nrow:].real
+    iwk2 = wk[nrow:].imag
+
+    hypo2 = 2.0 * abs( wk[nrow:] )
+    hc2wt = rwk2/hypo2
+    hs2wt = iwk2/hypo2
+
+    nn = n[first:last,newaxis]
+    cwt  = sqrt(0.5+hc2wt)
+    swt  = sign(hs2wt)*(sqrt(0.5-hc2wt))
+    den  = 0.5*nn+hc2wt*rwk2+hs2wt*iwk2
+    cterm = (cwt*rwk1+swt*iwk1)**2./den
+    sterm = (cwt*iwk1-swt*rwk1)**2./(nn-den)
+
+    wk2 = (cterm+sterm)/(2.0*var[first:last,newaxis])
+
+    #Keep only each star's peak, unless asked for everything.
+    jmax[first:last] = where(keep, wk2, -inf).argmax(axis=1)
+    pmax[first:last] = wk2[arange(nrow), jmax[first:last]]
+    if full:
+      wk2_all[first:last] = wk2
+
+  #Estimate significance of each star's largest peak value
+  expy = exp(-pmax)
+  effm = 2.0*(nout)/ofac
+  prob = effm*expy
+  ind = (prob > 0.01)
+  prob[ind] = 1.0-(1.0-expy[ind])**effm
+
+  if full:
+    return wk1,wk2_all,nout,jmax,prob
+  return wk1,pmax,nout,jmax,prob
+
 def getSignificance(wk1, wk2, nout, ofac):
   """ returns the peak false alarm probabilities
   Hence the lower is the probability and the more significant is the peak
+  Works on a single periodogram or, elementwise, on the 2-D output
+  of fasper_batch.
   """
   expy = exp(-wk2)          
   effm = 2.0*(nout)/ofac       
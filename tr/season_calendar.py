@@ -0,0 +1,242 @@
+"""
+season_calendar.py : which MJDs make up each observing season of a field.
+
+The Cyg OB7 season boundaries (MJD 54579, then +100, +300, +600 days)
+used to be typed out again in every function that cut data by season,
+and the Orion boundaries (54034, 54300, 54600) in every abridged plot.
+A SeasonCalendar holds one field's boundaries; everything that needs
+season dates asks for the calendar by field name.
+
+Seasons are numbered 1, 2, 3, ...; the number made of every season's
+digit (123) means all seasons together. Anything else -- including
+partial runs like 12 or 23, non-integers like 1.7 and strings like
+'3' -- means "no season", as it always has. Data in a season satisfy
+low < MEANMJDOBS < high.
+
+It does not import any of my other modules, for dependency reasons
+(helpers3 and tr_helpers both import it).
+
+Useful functions:
+  get_calendar - Returns the SeasonCalendar for a field.
+  set_default_field - Changes which field's calendar is used by default.
+  SeasonCalendar - Maps seasons to MJD ranges, and dates to seasons.
+
+"""
+
+from __future__ import division
+import numpy as np
+
+
+class SeasonCalendar(object):
+    """
+    The observing seasons of one field.
+
+    Parameters
+    ----------
+    name : str
+        The field's name.
+    boundaries : array_like
+        Increasing MJDs: season i runs from boundaries[i-1] to
+        boundaries[i].
+    everything : (float, float), optional
+        The bounds that mean "no season" (every observation).
+        Default (0, 1e6).
+
+    Attributes
+    ----------
+    n_seasons : int
+    all_seasons : int
+        The season number that means every season together (e.g. 123).
+
+    """
+
+    def __init__(self, name, boundaries, everything=(0, 1e6)):
+
+        boundaries = np.asarray(boundaries, dtype=float)
+
+        if boundaries.size < 2 or np.any(np.diff(boundaries) <= 0):
+            raise ValueError("Season boundaries must be at least two "
+                             "increasing MJDs")
+
+        self.name = name
+        self.boundaries = boundaries
+        self.everything = everything
+        self.n_seasons = boundaries.size - 1
+        self.all_seasons = int(''.join(str(i) for i in
+                                       range(1, self.n_seasons+1)))
+
+    @classmethod
+    def from_offset(cls, name, offset, cuts, **kwargs):
+        """ A calendar starting at MJD `offset`, with seasons ending
+        `cuts` days later. """
+
+        return cls(name, [offset] + [offset+cut for cut in cuts], **kwargs)
+
+    def __repr__(self):
+
+        return "<SeasonCalendar %s: %s>" % (self.name, list(self.boundaries))
+
+    def seasons(self):
+        """ The single-season numbers, [1, 2, ..., n_seasons]. """
+
+        return range(1, self.n_seasons+1)
+
+    def _span(self, season):
+        """ (first, last) single seasons in `season`, or None. """
+
+        # Only integral numbers name seasons: not 1.7, and not '3'.
+        if isinstance(season, basestring):
+            return None
+        try:
+            if season != int(season):
+                return None
+            digits = [int(d) for d in str(int(season))]
+        except (TypeError, ValueError, OverflowError):
+            return None
+
+        # One season, or all of them (never just some, e.g. 12).
+        if len(digits) == 1 and 1 <= digits[0] <= self.n_seasons:
+            return digits[0], digits[0]
+        if digits == range(1, self.n_seasons+1):
+            return 1, self.n_seasons
+
+        return None
+
+    def bounds(self, season):
+        """
+        Returns the MJD boundaries of an observing season.
+
+        Parameters
+        ----------
+        season : int
+            A season (1, 2, 3), or all seasons together (123). Any
+            other value, including non-integers, means "no season".
+
+        Returns
+        -------
+        low, high : float
+            The (exclusive) lower and upper MJD bounds.
+
+        """
+
+        span = self._span(season)
+        if span is None:
+            return self.everything
+
+        first, last = span
+        return self.boundaries[first-1], self.boundaries[last]
+
+    def season_ids(self, dates):
+        """
+        Which single season each date falls in.
+
+        Parameters
+        ----------
+        dates : array_like
+            MJDs.
+
+        Returns
+        -------
+        ids : np.ndarray of np.int8
+            1, 2, ... for dates strictly inside that season; -i for 
+            dates exactly on the boundary between seasons i and i+1
+            (in neither season, but in all seasons together); 0 for
+            dates outside every season.
+
+        """
+
+        dates = np.asarray(dates)
+        ids = np.searchsorted(self.boundaries, dates, side='left')
+
+        inside = (ids >= 1) & (ids <= self.n_seasons)
+        # side='left' puts a date equal to a boundary in the season
+        # below it, but seasons exclude their boundaries.
+        on_boundary = np.zeros(ids.shape, dtype=bool)
+        on_boundary[inside] = self.boundaries[ids[inside]] == dates[inside]
+
+        ids = np.where(inside, ids, 0)
+        ids = np.where(on_boundary, -ids, ids)
+        # The last season's upper boundary is outside every season.
+        ids[ids == -self.n_seasons] = 0
+
+        return ids.astype(np.int8)
+
+    def season_mask(self, season_ids, season):
+        """
+        Which rows of a season_ids() array are in `season`.
+
+        Cheaper than comparing dates again: e.g. season 123 is just
+        `season_ids != 0`. Any other `season` selects every row.
+
+        """
+
+        season_ids = np.asarray(season_ids)
+
+        span = self._span(season)
+        if span is None:
+            return np.ones(season_ids.shape, dtype=bool)
+
+        first, last = span
+        # Boundaries between two seasons of the span are in it too.
+        return (((season_ids >= first) & (season_ids <= last)) |
+                ((season_ids <= -first) & (season_ids > -last)))
+
+    def season_slice(self, sorted_dates, season):
+        """
+        The slice of a sorted array of dates that lies in `season`,
+        found with two binary searches.
+
+        """
+
+        low, high = self.bounds(season)
+
+        return slice(np.searchsorted(sorted_dates, low, side='right'),
+                     np.searchsorted(sorted_dates, high, side='left'))
+
+
+# Known fields. Orion's last season has no recorded end.
+calendars = {
+    'cygob7': SeasonCalendar.from_offset('Cyg OB7', 54579, [100, 300, 600]),
+    'orion': SeasonCalendar('Orion', [54034, 54300, 54600, 1e6]),
+    }
+
+default_field = 'cygob7'
+
+
+def get_calendar(field=None):
+    """
+    Returns the SeasonCalendar for a field.
+
+    Parameters
+    ----------
+    field : str, SeasonCalendar or None, optional
+        A field name in `calendars` (case and spaces don't matter, so
+        "Cyg OB7" works), or a calendar, which is returned as-is.
+        Default: the calendar of `default_field`.
+
+    """
+
+    if isinstance(field, SeasonCalendar):
+        return field
+
+    if field is None:
+        field = default_field
+
+    key = field.lower().replace(' ', '').replace('_', '')
+    try:
+        return calendars[key]
+    except KeyError:
+        raise ValueError("No season calendar for field %r (known: %s)" %
+                         (field, ", ".join(sorted(calendars))))
+
+
+def set_default_field(field):
+    """ Makes `field`'s calendar the default one; returns the old field. """
+
+    get_calendar(field)
+
+    global default_field
+    old = default_field
+    default_field = field
+
+    return old
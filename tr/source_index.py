@@ -0,0 +1,428 @@
+"""
+source_index.py : a sorted SOURCEID index for fast per-star table cuts.
+
+Finding one star's rows with `table.SOURCEID == sid` (or worse, a
+`sid in sid_list` list comprehension) walks every row of the table,
+so any function that loops over stars ends up quadratic in table size.
+This module builds, once per table, a stable argsort of the SOURCEID
+column plus start/stop offsets for each unique source, so that one
+star's rows can be found with a binary search.
+
+It does not import any of my other modules, for dependency reasons
+(helpers3 and tr_helpers both import it).
+
+Useful functions:
+  get_source_index - Returns a (cached) SourceIndex for a table.
+  invalidate_indexes - Forgets a table's cached indexes.
+  source_rows - Row numbers in a table belonging to some source(s).
+  season_rows - The same, but only between two dates.
+  source_mask - Vectorized `[sid in sid_list for sid in sourceid]`.
+
+"""
+
+from __future__ import division
+import numpy as np
+
+
+class SourceIndex(object):
+    """
+    A SOURCEID-sorted index into a table of time-series photometry.
+
+    Attributes
+    ----------
+    order : np.ndarray of int
+        Stable argsort of the SOURCEID column: `sourceid[order]` is
+        sorted, and rows of a given source keep their original order.
+    sids : np.ndarray
+        The unique source IDs, sorted.
+    starts, stops : np.ndarray of int
+        `order[starts[i]:stops[i]]` are the row numbers of source `sids[i]`.
+    size : int
+        Number of rows in the indexed table.
+    dates : np.ndarray or None
+        If the index was built with dates, `dates[order]`: each
+        source's dates, sorted (see date_rows).
+
+    """
+
+    def __init__(self, sourceid, dates=None):
+
+        sourceid = np.asarray(sourceid)
+
+        if dates is None:
+            # mergesort is the stable one, so each star's rows stay in
+            # the same order they had in the table.
+            self.order = np.argsort(sourceid, kind='mergesort')
+            self.dates = None
+        else:
+            # Within each star, sort by date instead (lexsort is
+            # stable too, so simultaneous rows keep table order).
+            dates = np.asarray(dates)
+            self.order = np.lexsort((dates, sourceid))
+            self.dates = dates[self.order]
+        self.size = sourceid.size
+        self.fingerprint = None
+
+        sorted_sid = sourceid[self.order]
+
+        if self.size == 0:
+            self.sids = sorted_sid
+            self.starts = np.zeros(0, dtype=int)
+            self.stops = np.zeros(0, dtype=int)
+            return
+
+        boundaries = np.nonzero(sorted_sid[1:] != sorted_sid[:-1])[0] + 1
+
+        self.starts = np.concatenate(([0], boundaries))
+        self.stops = np.concatenate((boundaries, [self.size]))
+        self.sids = sorted_sid[self.starts]
+
+    @classmethod
+    def from_arrays(cls, order, sids, starts, stops):
+        """
+        Rebuilds an index from its saved attributes, without sorting.
+
+        (See column_store.py, which saves them next to the table.)
+
+        """
+
+        index = cls.__new__(cls)
+
+        index.order = np.asarray(order)
+        index.sids = np.asarray(sids)
+        index.starts = np.asarray(starts)
+        index.stops = np.asarray(stops)
+        index.size = index.order.size
+        index.dates = None
+        index.fingerprint = None
+
+        return index
+
+    def __len__(self):
+        return self.size
+
+    def lookup(self, sid_list):
+        """
+        Finds the positions of some source IDs in `self.sids`.
+
+        Parameters
+        ----------
+        sid_list : int or array_like
+            One or more 13-digit WFCAM source IDs.
+
+        Returns
+        -------
+        pos : np.ndarray of int
+            Position in `self.sids` of each input source ID, or -1
+            where the source is not in the table.
+
+        """
+
+        sid_arr = np.atleast_1d(np.asarray(sid_list)).ravel()
+
+        if self.sids.size == 0:
+            return -1 * np.ones(sid_arr.size, dtype=int)
+
+        pos = np.searchsorted(self.sids, sid_arr)
+        pos[pos >= self.sids.size] = 0
+
+        return np.where(self.sids[pos] == sid_arr, pos, -1)
+
+    def rows(self, sid_list):
+        """
+        Returns the table row numbers belonging to some source(s).
+
+        A single source costs one binary search plus a contiguous
+        slice of `self.order`.
+
+        Parameters
+        ----------
+        sid_list : int or array_like
+            One or more 13-digit WFCAM source IDs. IDs not in the
+            table are ignored.
+
+        Returns
+        -------
+        rows : np.ndarray of int
+            Row numbers, in the same order as they appear in the table.
+
+        """
+
+        pos = self.lookup(sid_list)
+
+        if pos.size == 1:
+            if pos[0] < 0:
+                return np.zeros(0, dtype=int)
+            return self.order[self.starts[pos[0]]:self.stops[pos[0]]]
+
+        pos = np.unique(pos[pos >= 0])
+
+        starts = self.starts[pos]
+        lengths = self.stops[pos] - starts
+
+        return np.sort(self.order[_ranges(starts, lengths)])
+
+    def gather(self, sid_list):
+        """
+        Returns every listed source's rows, grouped source by source.
+
+        Unlike rows(), the sources stay in the order of `sid_list`
+        (repeats included), which is what a spreadsheet built from a
+        lookup table needs.
+
+        Parameters
+        ----------
+        sid_list : array_like
+            13-digit WFCAM source IDs. IDs not in the table get an
+            empty group.
+
+        Returns
+        -------
+        rows : np.ndarray of int
+            Row numbers of all the sources, concatenated.
+        offsets : np.ndarray of int
+            Length len(sid_list)+1: the rows of `sid_list[i]` are
+            `rows[offsets[i]:offsets[i+1]]`, in table order.
+
+        """
+
+        pos = self.lookup(sid_list)
+        found = pos >= 0
+
+        starts = np.zeros(pos.size, dtype=int)
+        lengths = np.zeros(pos.size, dtype=int)
+        starts[found] = self.starts[pos[found]]
+        lengths[found] = self.stops[pos[found]] - starts[found]
+
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+
+        return self.order[_ranges(starts, lengths)], offsets
+
+    def date_rows(self, sid, low, high):
+        """
+        Returns the row numbers of one source with low < date < high.
+
+        Only for an index built with dates: the source's dates are a
+        sorted slice of `self.dates`, so this is two binary searches
+        and the result is a view of `self.order`, in date order.
+
+        """
+
+        if self.dates is None:
+            raise ValueError("This SourceIndex was built without dates")
+
+        pos = self.lookup(sid)[0]
+        if pos < 0:
+            return np.zeros(0, dtype=int)
+
+        start, stop = self.starts[pos], self.stops[pos]
+        dates = self.dates[start:stop]
+
+        first = start + np.searchsorted(dates, low, side='right')
+        last = start + np.searchsorted(dates, high, side='left')
+
+        return self.order[first:max(first, last)]
+
+    def contains(self, sid_list):
+        """ Returns a boolean array: is each source ID in the table? """
+
+        return self.lookup(sid_list) >= 0
+
+
+def _ranges(starts, lengths):
+    """
+    Concatenates the ranges [start, start+length) without a Python loop.
+
+    Each output element is its range's start plus its rank within
+    that range.
+
+    """
+
+    total = lengths.sum()
+
+    if total == 0:
+        return np.zeros(0, dtype=int)
+
+    range_offsets = np.cumsum(lengths) - lengths
+
+    return np.repeat(starts - range_offsets, lengths) + np.arange(total)
+
+
+def _fingerprint(column, n_samples=1024):
+    """
+    A cheap summary of a column that changes when the column does:
+    its length, where its data live, and a hash of ~n_samples evenly
+    spaced values (and the last one).
+
+    Replacing the column (e.g. atpy's Table.sort) moves its data, so
+    that's always caught; editing values in place is caught if any
+    sampled value changes.
+
+    """
+
+    column = np.asarray(column)
+
+    if column.size == 0:
+        return (0,)
+
+    step = max(column.size // n_samples, 1)
+    sample = np.ascontiguousarray(np.concatenate((column[::step],
+                                                  column[-1:])))
+
+    return (column.size, column.__array_interface__['data'][0],
+            column.strides, hash(sample.tostring()))
+
+
+def _cached_index(table, attribute, fingerprint, build):
+    """ The index cached as `table.<attribute>`, unless stale. """
+
+    # atpy's __getattr__ looks up columns, so go through __dict__ here.
+    index = table.__dict__.get(attribute)
+
+    if index is not None and index.fingerprint is None:
+        # Attached when the table was opened (see column_store.py).
+        index.fingerprint = fingerprint
+    elif index is None or index.fingerprint != fingerprint:
+        index = build()
+        index.fingerprint = fingerprint
+        setattr(table, attribute, index)
+
+    return index
+
+
+def get_source_index(table):
+    """
+    Returns a SourceIndex for `table`, building it only once.
+
+    The index is cached on the table itself (as `table._source_index`),
+    and is rebuilt if the SOURCEID column has since changed: if it's
+    been replaced (as by atpy's Table.sort) or resized, or if a sample
+    of its values has changed. Edits that the sample could miss (a few
+    rows rewritten in place) should be followed by
+    invalidate_indexes(table).
+
+    Parameters
+    ----------
+    table : atpy.Table
+        Any table with a SOURCEID column.
+
+    Returns
+    -------
+    index : SourceIndex
+
+    """
+
+    sourceid = table.SOURCEID
+
+    return _cached_index(table, '_source_index', _fingerprint(sourceid),
+                         lambda: SourceIndex(sourceid))
+
+
+def get_date_index(table, date_column='MEANMJDOBS'):
+    """
+    Returns a SourceIndex of `table` built with dates, building it
+    only once (cached as `table._date_index`, and rebuilt when the
+    SOURCEID or date column changes, like get_source_index).
+
+    """
+
+    sourceid = table.SOURCEID
+    dates = table.data[date_column]
+
+    return _cached_index(table, '_date_index',
+                         (_fingerprint(sourceid), _fingerprint(dates)),
+                         lambda: SourceIndex(sourceid, dates=dates))
+
+
+def invalidate_indexes(table):
+    """
+    Forgets the indexes (and band validity masks and season ids) cached
+    on `table`, so they're rebuilt the next time they're needed. Call it
+    after editing SOURCEID, MEANMJDOBS or photometry values in place.
+
+    """
+
+    # (helpers3.get_band_validity and get_season_ids cache on the table
+    # the same way.)
+    for attribute in ['_source_index', '_date_index', '_band_validity',
+                      '_season_ids']:
+        if attribute in table.__dict__:
+            del table.__dict__[attribute]
+
+
+def source_rows(table, sid_list):
+    """
+    Returns the row numbers of `table` belonging to source(s) `sid_list`.
+
+    Parameters
+    ----------
+    table : atpy.Table
+        Table with a SOURCEID column.
+    sid_list : int or array_like
+        One or more 13-digit WFCAM source IDs.
+
+    Returns
+    -------
+    rows : np.ndarray of int
+        Row numbers, in table order. Use with `table.rows(rows)`.
+
+    """
+
+    return get_source_index(table).rows(sid_list)
+
+
+def season_rows(table, sid_list, low, high):
+    """
+    Returns the row numbers of `table` belonging to source(s)
+    `sid_list` with low < MEANMJDOBS < high.
+
+    For a single source this is a binary search for the source and two
+    more for the dates (see get_date_index), instead of comparing every
+    one of the source's dates against the bounds.
+
+    Returns
+    -------
+    rows : np.ndarray of int
+        Row numbers, in table order. Use with `table.rows(rows)`.
+
+    """
+
+    if np.size(sid_list) == 1:
+        rows = get_date_index(table).date_rows(np.ravel(sid_list)[0],
+                                               low, high)
+        return np.sort(rows)
+
+    rows = source_rows(table, sid_list)
+    dates = table.MEANMJDOBS[rows]
+
+    return rows[(dates > low) & (dates < high)]
+
+
+def source_mask(sourceid, sid_list):
+    """
+    Vectorized version of `[sid in sid_list for sid in sourceid]`.
+
+    Parameters
+    ----------
+    sourceid : array_like
+        A column of source IDs (e.g. `table.SOURCEID`).
+    sid_list : array_like
+        The source IDs to select.
+
+    Returns
+    -------
+    mask : np.ndarray of bool
+        True wherever `sourceid` is in `sid_list`.
+
+    """
+
+    sourceid = np.asarray(sourceid)
+    wanted = np.unique(np.atleast_1d(np.asarray(sid_list)).ravel())
+
+    if wanted.size == 0:
+        return np.zeros(sourceid.shape, dtype=bool)
+
+    pos = np.searchsorted(wanted, sourceid)
+    pos[pos >= wanted.size] = 0
+
+    return wanted[pos] == sourceid
@@ -0,0 +1,207 @@
+"""
+source_stream.py : stream a SOURCEID-sorted catalog one source at a time.
+
+Analyses like statcruncher() and the plotting functions only ever look
+at one star's photometry at a time, so there's no need to hold the whole
+catalog in memory. A SourceStream reads a SOURCEID-sorted table (e.g. a
+column_store.py directory, which is sorted that way on disk) in chunks
+of a fixed number of rows and yields each source's rows as a small
+in-memory table. A source whose rows straddle two chunks is carried
+over and yielded once it's complete, so memory use depends on the
+chunk size (and the largest source), not on the size of the catalog.
+
+spread3.spreadsheet_write and super.do_it_all accept a SourceStream
+wherever they accept a table.
+
+Useful functions:
+  SourceStream - An iterable of (SOURCEID, table) pairs.
+  per_source - Pairs each source in a list with a table to analyze it in.
+
+"""
+
+from __future__ import division
+
+import numpy as np
+import atpy
+
+from column_store import ColumnTable, column_names, open_store
+
+
+class SourceStream(object):
+    """
+    Iterates over a SOURCEID-sorted table, one source at a time.
+
+    Can be iterated over as many times as you like; each pass
+    re-reads the input chunk by chunk.
+
+    Parameters
+    ----------
+    source : str or table
+        A column store directory (see column_store.write_store), or any
+        atpy.Table / ColumnTable whose rows are sorted by SOURCEID.
+    chunk_size : int, optional
+        How many rows to read at once. Default 100000.
+    sid_list : array_like, optional
+        Only yield these sources (the rest are skipped). Default: all.
+
+    Yields
+    ------
+    sid : int
+        A 13-digit WFCAM source ID.
+    s_table : column_store.ColumnTable
+        All of that source's rows, in file order.
+
+    """
+
+    def __init__(self, source, chunk_size=100000, sid_list=None):
+
+        if isinstance(source, basestring):
+            source = open_store(source)
+
+        self.table = source
+        self.chunk_size = int(chunk_size)
+        self.names = column_names(source)
+
+        if sid_list is None:
+            self.wanted = None
+        else:
+            self.wanted = np.unique(np.atleast_1d(sid_list))
+
+    def __len__(self):
+        return len(self.table.SOURCEID)
+
+    def source_ids(self):
+        """ The (sorted, unique) source IDs in the stream. """
+
+        # A column store carries its SOURCEID index, so use it.
+        index = self.table.__dict__.get('_source_index')
+        if index is not None:
+            sids = index.sids
+        else:
+            sids = np.unique(self.table.SOURCEID)
+
+        if self.wanted is not None:
+            sids = sids[np.in1d(sids, self.wanted)]
+
+        return sids
+
+    def lookup(self):
+        """ A lookup table (SOURCEID, Designation) of the stream's sources. """
+
+        sids = self.source_ids()
+
+        lookup = atpy.Table()
+        lookup.add_column("SOURCEID", sids)
+        lookup.add_column("Designation", np.array([str(s) for s in sids]))
+
+        return lookup
+
+    def _read(self, start, stop):
+        """ Rows start:stop of every column, copied into memory. """
+
+        return dict((name, np.array(self.table.data[name][start:stop]))
+                    for name in self.names)
+
+    def _split(self, chunk):
+        """ Yields (sid, ColumnTable) for each source in a chunk. """
+
+        sourceid = chunk['SOURCEID']
+        boundaries = np.nonzero(sourceid[1:] != sourceid[:-1])[0] + 1
+        starts = np.concatenate(([0], boundaries))
+        stops = np.concatenate((boundaries, [sourceid.size]))
+
+        for start, stop in zip(starts, stops):
+            sid = sourceid[start]
+            if self.wanted is not None and not _contains(self.wanted, sid):
+                continue
+
+            yield sid, ColumnTable(dict((name, chunk[name][start:stop])
+                                        for name in self.names), self.names)
+
+    def __iter__(self):
+
+        n_rows = len(self)
+        carry = None
+        last_sid = None
+
+        for start in range(0, n_rows, self.chunk_size):
+            chunk = self._read(start, min(start+self.chunk_size, n_rows))
+            sourceid = chunk['SOURCEID']
+
+            if (np.any(sourceid[1:] < sourceid[:-1]) or
+                (last_sid is not None and sourceid[0] < last_sid)):
+                raise ValueError("SourceStream input is not sorted by "
+                                 "SOURCEID (see column_store.write_store)")
+            last_sid = sourceid[-1]
+
+            if carry is not None:
+                chunk = dict((name, np.concatenate((carry[name],
+                                                    chunk[name])))
+                             for name in self.names)
+                sourceid = chunk['SOURCEID']
+
+            # The last source in this chunk may continue into the next
+            # one, so hold on to it.
+            tail = np.searchsorted(sourceid, sourceid[-1])
+            carry = dict((name, chunk[name][tail:]) for name in self.names)
+            complete = dict((name, chunk[name][:tail]) for name in self.names)
+
+            if tail > 0:
+                for pair in self._split(complete):
+                    yield pair
+
+        if carry is not None and carry['SOURCEID'].size > 0:
+            for pair in self._split(carry):
+                yield pair
+
+
+def _contains(sorted_array, value):
+    """ Is `value` in the sorted array? (one binary search) """
+
+    pos = np.searchsorted(sorted_array, value)
+    return pos < sorted_array.size and sorted_array[pos] == value
+
+
+def per_source(table, sid_list):
+    """
+    Pairs each source in `sid_list` with a table to analyze it in.
+
+    For an ordinary table this is just the whole table every time (the
+    analysis functions cut out each source themselves). For a
+    SourceStream, the stream is read once, and each source comes with
+    only its own rows; sources in `sid_list` that aren't in the stream
+    are skipped.
+
+    Parameters
+    ----------
+    table : atpy.Table, ColumnTable or SourceStream
+        Time-series photometry.
+    sid_list : array_like
+        13-digit WFCAM source IDs (repeats allowed).
+
+    Yields
+    ------
+    i : int
+        Position in `sid_list`.
+    sid : int
+        The source ID, `sid_list[i]`.
+    s_table : table
+        A table containing (at least) that source's photometry.
+
+    """
+
+    if not isinstance(table, SourceStream):
+        for i, sid in enumerate(sid_list):
+            yield i, sid, table
+        return
+
+    positions = {}
+    for i, sid in enumerate(sid_list):
+        positions.setdefault(sid, []).append(i)
+
+    stream = SourceStream(table.table, table.chunk_size,
+                          sid_list=np.array(sorted(positions)))
+
+    for sid, s_table in stream:
+        for i in positions[sid]:
+            yield i, sid, s_table
@@ -14,6 +14,10 @@ and to bundle all of these values up into a spreadsheet. It's really useful!
 
 Useful functions:
   spreadsheet_write - 
+  (see also spread_columnar.spreadsheet_write_columnar, which makes
+   the same spreadsheet a column at a time, and much faster)
+  Any of these accept a column_store.open_store() table in place of
+  an atpy.Table.
   
 
 Helper functions:
@@ -46,13 +50,20 @@ import atpy
 import stetson
 import stetson_graded
 import robust as rb
-from helpers3 import data_cut, band_cut
-from scargle import fasper as lsp
+from helpers3 import data_cut, band_cut, band_validity, band_mask
+from scargle import fasper, fasper_batch
 from scargle import getSignificance
-from timing import lsp_mask, lsp_tuning
-from chi2 import test_analyze
+from timing import lsp_mask, lsp_trim, lsp_tuning
+from chi2 import test_analyze, batch_analyze
 from network2 import get_chip
 from color_slope import slope, star_slope
+from column_store import write_store, open_store
+from source_stream import SourceStream, per_source
+
+
+class Empty:
+    """ A blank object for statcruncher to hang its results on. """
+    pass
 
 
 def reduced_chisq ( m, sigma_m ):
@@ -75,7 +86,7 @@ def reduced_chisq ( m, sigma_m ):
     return (1./nu) * np.sum( (m - m.mean())**2 / sigma_m**2 )
 
 
-def Stetson_machine ( s_table, flags=0) :
+def Stetson_machine ( s_table, flags=0, validity=None) :
     """
     Computes the Stetson index on the best combination of bands.
 
@@ -88,6 +99,9 @@ def Stetson_machine ( s_table, flags=0) :
         Table with time-series photometry of one star
     flags : int, optional 
         Maximum ppErrBit quality flags to use (default 0)    
+    validity : np.ndarray, optional
+        The star's helpers3.band_validity(s_table, max_flag=flags) bitmasks,
+        if they've already been computed (e.g. for a whole table at once).
     
     Returns
     -------
@@ -103,25 +117,31 @@ def Stetson_machine ( s_table, flags=0) :
 
     """
     
-    # First, slice the data to find how many nights have
-    # a given combination of bands.
+    # First, find which nights have a given combination of bands
+    # (the same rows that chained band_cut calls would select).
 
-    j_table = band_cut( s_table, 'j', max_flag=flags)
-    h_table = band_cut( s_table, 'h', max_flag=flags)
-    k_table = band_cut( s_table, 'k', max_flag=flags)
-    
-    jh_table = band_cut( j_table, 'h', max_flag=flags)
-    hk_table = band_cut( h_table, 'k', max_flag=flags)
-    jk_table = band_cut( j_table, 'k', max_flag=flags)
+    if validity is None:
+        validity = band_validity( s_table, max_flag=flags )
+
+    j_rows = band_mask( validity, 'j' )
+    h_rows = band_mask( validity, 'h' )
+    k_rows = band_mask( validity, 'k' )
 
-    jhk_table = band_cut( jh_table, 'k', max_flag=flags)
+    jh_rows = band_mask( validity, 'jh' )
+    hk_rows = band_mask( validity, 'hk' )
+    jk_rows = band_mask( validity, 'jk' )
+
+    jhk_rows = band_mask( validity, 'jhk' )
+
+    def col (name, rows):
+        return s_table.data[name][rows]
 
     # Then we'll measure how many nights are in each combination.
 
-    jh_len = len(jh_table)
-    hk_len = len(hk_table)
-    jk_len = len(jk_table)
-    jhk_len = len(jhk_table)
+    jh_len = jh_rows.sum()
+    hk_len = hk_rows.sum()
+    jk_len = jk_rows.sum()
+    jhk_len = jhk_rows.sum()
 
     # The combination with the most nights (weighted by value^{1})
     # will win. Ties are determined in order: JHK, HK, JH, JK
@@ -134,23 +154,23 @@ def Stetson_machine ( s_table, flags=0) :
     # and do a singleband 'Stetson'.
 
     if max_len == 0:
-        j_len = len(j_table)
-        h_len = len(h_table)
-        k_len = len(k_table)
+        j_len = j_rows.sum()
+        h_len = h_rows.sum()
+        k_len = k_rows.sum()
         max_len_single = max(j_len, h_len, k_len)
         
         if k_len == max_len_single:
             choice = 'k'
-            vcol = k_table.KAPERMAG3
-            verr = k_table.KAPERMAG3ERR
+            vcol = col('KAPERMAG3', k_rows)
+            verr = col('KAPERMAG3ERR', k_rows)
         elif h_len == max_len_single:
             choice = 'h'
-            vcol = h_table.HAPERMAG3
-            verr = h_table.HAPERMAG3ERR
+            vcol = col('HAPERMAG3', h_rows)
+            verr = col('HAPERMAG3ERR', h_rows)
         else:
             choice = 'j'
-            vcol = j_table.JAPERMAG3
-            verr = j_table.JAPERMAG3ERR
+            vcol = col('JAPERMAG3', j_rows)
+            verr = col('JAPERMAG3ERR', j_rows)
 
         Stetson = stetson.S_singleton(vcol, verr)
         stetson_nights = max_len_single
@@ -158,9 +178,9 @@ def Stetson_machine ( s_table, flags=0) :
     elif 2*jhk_len == max_len:
         choice = 'jhk'
         
-        jcol = jhk_table.JAPERMAG3; jerr = jhk_table.JAPERMAG3ERR
-        hcol = jhk_table.HAPERMAG3; herr = jhk_table.HAPERMAG3ERR
-        kcol = jhk_table.KAPERMAG3; kerr = jhk_table.KAPERMAG3ERR
+        jcol = col('JAPERMAG3', jhk_rows); jerr = col('JAPERMAG3ERR', jhk_rows)
+        hcol = col('HAPERMAG3', jhk_rows); herr = col('HAPERMAG3ERR', jhk_rows)
+        kcol = col('KAPERMAG3', jhk_rows); kerr = col('KAPERMAG3ERR', jhk_rows)
 
         Stetson = stetson.S(jcol, jerr, hcol, herr, kcol, kerr)
 
@@ -169,20 +189,26 @@ def Stetson_machine ( s_table, flags=0) :
         if hk_len == max_len:
             choice = 'hk'
             
-            bcol = hk_table.HAPERMAG3; berr = hk_table.HAPERMAG3ERR
-            vcol = hk_table.KAPERMAG3; verr = hk_table.KAPERMAG3ERR
+            bcol = col('HAPERMAG3', hk_rows)
+            berr = col('HAPERMAG3ERR', hk_rows)
+            vcol = col('KAPERMAG3', hk_rows)
+            verr = col('KAPERMAG3ERR', hk_rows)
 
         elif jh_len == max_len:
             choice = 'jh'
 
-            bcol = jh_table.JAPERMAG3; berr = jh_table.JAPERMAG3ERR
-            vcol = jh_table.HAPERMAG3; verr = jh_table.HAPERMAG3ERR
+            bcol = col('JAPERMAG3', jh_rows)
+            berr = col('JAPERMAG3ERR', jh_rows)
+            vcol = col('HAPERMAG3', jh_rows)
+            verr = col('HAPERMAG3ERR', jh_rows)
 
         elif jk_len == max_len:
             choice = 'jk'
 
-            bcol = jk_table.JAPERMAG3; berr = jk_table.JAPERMAG3ERR
-            vcol = jk_table.KAPERMAG3; verr = jk_table.KAPERMAG3ERR
+            bcol = col('JAPERMAG3', jk_rows)
+            berr = col('JAPERMAG3ERR', jk_rows)
+            vcol = col('KAPERMAG3', jk_rows)
+            verr = col('KAPERMAG3ERR', jk_rows)
 
         Stetson = stetson.I(bcol, berr, vcol, verr)
 
@@ -208,7 +234,8 @@ def Stetson_machine ( s_table, flags=0) :
 
 
 # I'm going to software hell for copying the following from above...
-def graded_Stetson_machine ( s_table, flags=0, min_grade=0.8) :
+def graded_Stetson_machine ( s_table, flags=0, min_grade=0.8,
+                             validity=None) :
     """
     Computes the graded Stetson index on the best combination of bands.
 
@@ -224,6 +251,9 @@ def graded_Stetson_machine ( s_table, flags=0, min_grade=0.8) :
         Table with time-series photometry of one star
     flags : int, optional 
         Maximum ppErrBit quality flags to use (default 0)    
+    validity : np.ndarray, optional
+        The star's helpers3.band_validity(s_table, max_flag=flags) bitmasks,
+        if they've already been computed (e.g. for a whole table at once).
     
     Returns
     -------
@@ -242,25 +272,31 @@ def graded_Stetson_machine ( s_table, flags=0, min_grade=0.8) :
 
     """
     
-    # First, slice the data to find how many nights have
-    # a given combination of bands.
+    # First, find which nights have a given combination of bands
+    # (the same rows that chained band_cut calls would select).
 
-    j_table = band_cut( s_table, 'j', max_flag=flags)
-    h_table = band_cut( s_table, 'h', max_flag=flags)
-    k_table = band_cut( s_table, 'k', max_flag=flags)
-    
-    jh_table = band_cut( j_table, 'h', max_flag=flags)
-    hk_table = band_cut( h_table, 'k', max_flag=flags)
-    jk_table = band_cut( j_table, 'k', max_flag=flags)
+    if validity is None:
+        validity = band_validity( s_table, max_flag=flags )
 
-    jhk_table = band_cut( jh_table, 'k', max_flag=flags)
+    j_rows = band_mask( validity, 'j' )
+    h_rows = band_mask( validity, 'h' )
+    k_rows = band_mask( validity, 'k' )
+
+    jh_rows = band_mask( validity, 'jh' )
+    hk_rows = band_mask( validity, 'hk' )
+    jk_rows = band_mask( validity, 'jk' )
+
+    jhk_rows = band_mask( validity, 'jhk' )
+
+    def col (name, rows):
+        return s_table.data[name][rows]
 
     # Then we'll measure how many nights are in each combination.
 
-    jh_len = len(jh_table)
-    hk_len = len(hk_table)
-    jk_len = len(jk_table)
-    jhk_len = len(jhk_table)
+    jh_len = jh_rows.sum()
+    hk_len = hk_rows.sum()
+    jk_len = jk_rows.sum()
+    jhk_len = jhk_rows.sum()
 
     # The combination with the most nights (weighted by value^{1})
     # will win. Ties are determined in order: JHK, HK, JH, JK
@@ -273,26 +309,26 @@ def graded_Stetson_machine ( s_table, flags=0, min_grade=0.8) :
     # and do a singleband 'Stetson'.
 
     if max_len == 0:
-        j_len = len(j_table)
-        h_len = len(h_table)
-        k_len = len(k_table)
+        j_len = j_rows.sum()
+        h_len = h_rows.sum()
+        k_len = k_rows.sum()
         max_len_single = max(j_len, h_len, k_len)
         
         if k_len == max_len_single:
             choice = 'k'
-            vcol = k_table.KAPERMAG3
-            verr = k_table.KAPERMAG3ERR
-            vgrade = k_table.KGRADE
+            vcol = col('KAPERMAG3', k_rows)
+            verr = col('KAPERMAG3ERR', k_rows)
+            vgrade = col('KGRADE', k_rows)
         elif h_len == max_len_single:
             choice = 'h'
-            vcol = h_table.HAPERMAG3
-            verr = h_table.HAPERMAG3ERR
-            vgrade = h_table.HGRADE
+            vcol = col('HAPERMAG3', h_rows)
+            verr = col('HAPERMAG3ERR', h_rows)
+            vgrade = col('HGRADE', h_rows)
         else:
             choice = 'j'
-            vcol = j_table.JAPERMAG3
-            verr = j_table.JAPERMAG3ERR
-            vgrade = j_table.JGRADE
+            vcol = col('JAPERMAG3', j_rows)
+            verr = col('JAPERMAG3ERR', j_rows)
+            vgrade = col('JGRADE', j_rows)
 
         Stetson = stetson_graded.S_singleton(vcol, verr, vgrade)
         stetson_nights = max_len_single
@@ -300,13 +336,13 @@ def graded_Stetson_machine ( s_table, flags=0, min_grade=0.8) :
     elif 2*jhk_len == max_len:
         choice = 'jhk'
         
-        jcol = jhk_table.JAPERMAG3; jerr = jhk_table.JAPERMAG3ERR
-        hcol = jhk_table.HAPERMAG3; herr = jhk_table.HAPERMAG3ERR
-        kcol = jhk_table.KAPERMAG3; kerr = jhk_table.KAPERMAG3ERR
+        jcol = col('JAPERMAG3', jhk_rows); jerr = col('JAPERMAG3ERR', jhk_rows)
+        hcol = col('HAPERMAG3', jhk_rows); herr = col('HAPERMAG3ERR', jhk_rows)
+        kcol = col('KAPERMAG3', jhk_rows); kerr = col('KAPERMAG3ERR', jhk_rows)
         
-        jgrade = jhk_table.JGRADE
-        hgrade = jhk_table.HGRADE 
-        kgrade = jhk_table.KGRADE
+        jgrade = col('JGRADE', jhk_rows)
+        hgrade = col('HGRADE', jhk_rows) 
+        kgrade = col('KGRADE', jhk_rows)
 
         Stetson = stetson_graded.S(jcol, jerr, jgrade, 
                                    hcol, herr, hgrade,
@@ -317,23 +353,29 @@ def graded_Stetson_machine ( s_table, flags=0, min_grade=0.8) :
         if hk_len == max_len:
             choice = 'hk'
             
-            bcol = hk_table.HAPERMAG3; berr = hk_table.HAPERMAG3ERR
-            vcol = hk_table.KAPERMAG3; verr = hk_table.KAPERMAG3ERR
-            bgrade = hk_table.HGRADE ; vgrade = hk_table.KGRADE
+            bcol = col('HAPERMAG3', hk_rows)
+            berr = col('HAPERMAG3ERR', hk_rows)
+            vcol = col('KAPERMAG3', hk_rows)
+            verr = col('KAPERMAG3ERR', hk_rows)
+            bgrade = col('HGRADE', hk_rows) ; vgrade = col('KGRADE', hk_rows)
 
         elif jh_len == max_len:
             choice = 'jh'
 
-            bcol = jh_table.JAPERMAG3; berr = jh_table.JAPERMAG3ERR
-            vcol = jh_table.HAPERMAG3; verr = jh_table.HAPERMAG3ERR
-            bgrade = jh_table.JGRADE ; vgrade = jh_table.HGRADE
+            bcol = col('JAPERMAG3', jh_rows)
+            berr = col('JAPERMAG3ERR', jh_rows)
+            vcol = col('HAPERMAG3', jh_rows)
+            verr = col('HAPERMAG3ERR', jh_rows)
+            bgrade = col('JGRADE', jh_rows) ; vgrade = col('HGRADE', jh_rows)
 
         elif jk_len == max_len:
             choice = 'jk'
 
-            bcol = jk_table.JAPERMAG3; berr = jk_table.JAPERMAG3ERR
-            vcol = jk_table.KAPERMAG3; verr = jk_table.KAPERMAG3ERR
-            bgrade = jk_table.JGRADE ; vgrade = jk_table.KGRADE
+            bcol = col('JAPERMAG3', jk_rows)
+            berr = col('JAPERMAG3ERR', jk_rows)
+            vcol = col('KAPERMAG3', jk_rows)
+            verr = col('KAPERMAG3ERR', jk_rows)
+            bgrade = col('JGRADE', jk_rows) ; vgrade = col('KGRADE', jk_rows)
 
         Stetson = stetson_graded.I(bcol, berr, bgrade, 
                                    vcol, verr, vgrade)
@@ -360,7 +402,8 @@ def graded_Stetson_machine ( s_table, flags=0, min_grade=0.8) :
 
 
 def statcruncher (table, sid, season=0, rob=True, per=True, 
-                  graded=False, colorslope=False, flags=0) :
+                  graded=False, colorslope=False, flags=0, fx2=True,
+                  lsp=True) :
     """ 
     Calculates several statistical properties for a given star.
 
@@ -393,6 +436,14 @@ def statcruncher (table, sid, season=0, rob=True, per=True,
         Make sure your data has been color-error-corrected! Default False.
     flags : int, optional 
         Maximum ppErrBit quality flags to use (default 0)
+    fx2 : bool, optional
+        With `per`, also run the fast chi-squared period search 
+        (default True). spreadsheet_write(fx2_batch=True) turns it off
+        and runs every star's search in one chi2.batch_analyze() call.
+    lsp : bool, optional
+        With `per`, also compute the Lomb-Scargle periodogram (default
+        True). spreadsheet_write(batch_lsp=True) turns it off and 
+        computes every star's in scargle.fasper_batch() calls.
 
     Returns
     -------
@@ -412,19 +463,24 @@ def statcruncher (table, sid, season=0, rob=True, per=True,
     # First, let's compute single-band statistics. This will require
     # separate data_cuts on each band.
 
-    full_jtable = band_cut(s_table, 'j')
-    full_htable = band_cut(s_table, 'h')
-    full_ktable = band_cut(s_table, 'k')
+    # (Which bands are good in each row is worked out just once, with
+    # and without the flag cut, rather than in a chain of band_cuts.)
+    full_validity = band_validity(s_table)
+    validity = band_validity(s_table, max_flag=flags)
 
-    j_table = band_cut(s_table, 'j', max_flag=flags)
-    h_table = band_cut(s_table, 'h', max_flag=flags)
-    k_table = band_cut(s_table, 'k', max_flag=flags)
+    full_jtable = s_table.where( band_mask(full_validity, 'j') )
+    full_htable = s_table.where( band_mask(full_validity, 'h') )
+    full_ktable = s_table.where( band_mask(full_validity, 'k') )
 
-    jmh_table = band_cut(j_table, 'h', max_flag=flags)
-    hmk_table = band_cut(h_table, 'k', max_flag=flags)
+    j_table = s_table.where( band_mask(validity, 'j') )
+    h_table = s_table.where( band_mask(validity, 'h') )
+    k_table = s_table.where( band_mask(validity, 'k') )
+
+    jmh_table = s_table.where( band_mask(validity, 'jh') )
+    hmk_table = s_table.where( band_mask(validity, 'hk') )
     
     # jhk_table used only for colorslope
-    jhk_table = band_cut( jmh_table, 'k', max_flag=flags)
+    jhk_table = s_table.where( band_mask(validity, 'jhk') )
 
     # get a date (x-axis) for each 
     jdate = j_table.MEANMJDOBS
@@ -455,9 +511,7 @@ def statcruncher (table, sid, season=0, rob=True, per=True,
 
     # make an empty data structure and just assign it information, then return 
     # the object itself! then there's no more worrying about indices.
-    class Empty():
-        pass
-
+    # (Empty lives at module level so that stat_cache can pickle it.)
     ret = Empty()
     
     # How many nights have observations in each band?
@@ -488,7 +542,7 @@ def statcruncher (table, sid, season=0, rob=True, per=True,
     ret.DEC = decol.mean()
     
     # Calculate the Stetson index...
-    S, choice, stetson_nights = Stetson_machine (s_table, flags)
+    S, choice, stetson_nights = Stetson_machine (s_table, flags, validity)
     
     ret.Stetson = S
     ret.Stetson_choice = choice
@@ -497,7 +551,7 @@ def statcruncher (table, sid, season=0, rob=True, per=True,
     if graded:
         # Calculate the graded Stetson index...
         g_S, g_choice, g_stetson_nights = (
-            graded_Stetson_machine (s_table, flags) )
+            graded_Stetson_machine (s_table, flags, validity=validity) )
     
         ret.graded_Stetson = g_S
         ret.graded_Stetson_choice = g_choice
@@ -547,12 +601,15 @@ def statcruncher (table, sid, season=0, rob=True, per=True,
 
         # Robust quantifiers simply have an "r" at the end of their names
         if rob:
-            b.datar, b.indr = rb.removeoutliers(b.data, 3, niter=2, retind=True)
+            # One clipping pass for meanr/medianr/stdr (until converged)
+            # and one for everything else (niter=2), rather than four.
+            one_segment = [0, b.data.size]
+            b.meanr, b.medianr, b.rmsr = [ 
+                v[0] for v in rb.robust_stats_grouped(b.data, one_segment)[:3] ]
+            b.indr = rb.robust_stats_grouped(b.data, one_segment, niter=2)[5]
+            b.datar = b.data[b.indr]
             b.errr = b.err[b.indr]
             
-            b.meanr = rb.meanr(b.data)
-            b.medianr = rb.medianr(b.data) # dao
-            b.rmsr = rb.stdr(b.data)
             b.minr = b.datar.min()
             b.maxr = b.datar.max()
             b.ranger = b.maxr - b.minr
@@ -567,18 +624,21 @@ def statcruncher (table, sid, season=0, rob=True, per=True,
         # Period finding... is a little dodgy still, and might take forever
         if per==True and b.N > 2:
 
-            hifac = lsp_tuning(b.date)
+            if lsp:
+                hifac = lsp_tuning(b.date)
             
-            b.lsp = lsp(b.date, b.data, 6., hifac) 
-            Jmax = lsp_mask(b.lsp[0], b.lsp[1])
-            b.lsp_per = 1./ b.lsp[0][Jmax]
-            b.lsp_pow = b.lsp[1][Jmax]
-            b.lsp_sig = getSignificance(b.lsp[0], b.lsp[1], b.lsp[2], 6.)[Jmax]
-
-            best_freq, chimin = test_analyze( b.date, b.data, b.err, 
-                                              ret_chimin=True )
-
-            b.fx2_per, b.fx2_chimin = 1./best_freq, chimin
+                b.lsp = fasper(b.date, b.data, 6., hifac) 
+                Jmax = lsp_mask(b.lsp[0], b.lsp[1])
+                b.lsp_per = 1./ b.lsp[0][Jmax]
+                b.lsp_pow = b.lsp[1][Jmax]
+                b.lsp_sig = getSignificance(b.lsp[0], b.lsp[1], b.lsp[2], 
+                                            6.)[Jmax]
+
+            if fx2:
+                best_freq, chimin = test_analyze( b.date, b.data, b.err, 
+                                                  ret_chimin=True )
+
+                b.fx2_per, b.fx2_chimin = 1./best_freq, chimin
             
 
     if colorslope:
@@ -627,7 +687,9 @@ def base_lookup (table, sourceid_offset=44027700000000):
 
 def spreadsheet_write (table, lookup, season, outfile, flags=0,
                        nowrite=False, Test=False,
-                       rob=False, per=False, graded=False, colorslope=False):
+                       rob=False, per=False, graded=False, colorslope=False,
+                       cache=None, fx2_batch=False, max_procs=None,
+                       batch_lsp=False):
     """ 
     Makes my spreadsheet! Basically with a big forloop.
 
@@ -635,11 +697,14 @@ def spreadsheet_write (table, lookup, season, outfile, flags=0,
 
     Parameters
     ----------
-    table : atpy.Table
-        Table with time-series photometry
-    lookup : atpy.Table
+    table : atpy.Table or source_stream.SourceStream
+        Table with time-series photometry. A SourceStream is read 
+        one source at a time, so the whole table is never in memory.
+    lookup : atpy.Table or None
         Table of interesting sources and their names
-        (must contain columns "SOURCEID" and "Designation")
+        (must contain columns "SOURCEID" and "Designation").
+        May be None if `table` is a SourceStream: then every source
+        in the stream is used, named by its SOURCEID.
     season : int
         Which observing season of our dataset (1, 2, 3, or all).
         Any value that is not the integers (1, 2, or 3) will be 
@@ -668,6 +733,23 @@ def spreadsheet_write (table, lookup, season, outfile, flags=0,
     colorslope : bool, optional
         Calculate color slopes? Runs them over (JvJ-H, KvH-K, J-HvH-K).
         Make sure your data has been color-error-corrected! Default False.
+    cache : stat_cache.StatCache, optional
+        Get each star's statcruncher results from this cache (and 
+        save them to it), so unchanged stars aren't recomputed.
+    fx2_batch : bool, optional
+        With `per`, collect every star's light curves and run the fast
+        chi-squared searches together through chi2.batch_analyze(), 
+        which keeps up to `max_procs` runchi2 processes busy, instead
+        of one search at a time. Needs runchi2. Default False.
+    max_procs : int, optional
+        How many runchi2 processes fx2_batch may run at once
+        (default: one per core).
+    batch_lsp : bool, optional
+        With `per`, collect every star's light curves and compute 
+        their Lomb-Scargle periodograms in one scargle.fasper_batch() 
+        call per band, instead of one fasper() call per light curve.
+        Much faster, but the stars share one frequency grid, so the
+        lsp columns differ slightly. Default False.
       
     Returns
     -------
@@ -682,6 +764,9 @@ def spreadsheet_write (table, lookup, season, outfile, flags=0,
 
     null=np.double(-9.99999488e+08)
 
+    if lookup is None and isinstance(table, SourceStream):
+        lookup = table.lookup()
+
     sidarr = lookup.SOURCEID
     names = lookup.Designation
     l = sidarr.size
@@ -789,11 +874,26 @@ def spreadsheet_write (table, lookup, season, outfile, flags=0,
     # kpp_max = np.ones_like(sidarr)
         
 
-    for sid, i in zip(sidarr, range(len(sidarr)) ):
+    # With fx2_batch: (band, star index, date, mag, err) of every light
+    # curve that still needs a fast chi-squared search.
+    fx2_jobs = []
+    fx2 = not (per and fx2_batch)
+    # With batch_lsp: (star index, date, mag) per band, likewise.
+    lsp_jobs = dict( (bn, []) for bn in band_names )
+    do_lsp = not (per and batch_lsp)
+
+    for i, sid, s_table in per_source(table, sidarr):
 
         # v for values
-        v = statcruncher (table, sid, season, rob, per, graded=graded,
-                          flags=flags, colorslope=colorslope)
+        if cache is None:
+            v = statcruncher (s_table, sid, season, rob, per, graded=graded,
+                              flags=flags, colorslope=colorslope, fx2=fx2,
+                              lsp=do_lsp)
+        else:
+            v = cache.statcruncher (s_table, sid, season, rob, per,
+                                    graded=graded, flags=flags,
+                                    colorslope=colorslope, fx2=fx2,
+                                    lsp=do_lsp)
         if v == None:
             #skip assigning anything!
             continue
@@ -878,11 +978,17 @@ def spreadsheet_write (table, lookup, season, outfile, flags=0,
                 b.err_ranger[i] = vb.err_ranger
 
             if per and vb.N > 2:
-                b.lsp_per[i] = vb.lsp_per
-                b.lsp_pow[i] = vb.lsp_pow
-                b.lsp_sig[i] = vb.lsp_sig
-                b.fx2_per[i] = vb.fx2_per
-                b.fx2_chimin[i] = vb.fx2_chimin
+                if do_lsp:
+                    b.lsp_per[i] = vb.lsp_per
+                    b.lsp_pow[i] = vb.lsp_pow
+                    b.lsp_sig[i] = vb.lsp_sig
+                else:
+                    lsp_jobs[bn].append( (i, vb.date, vb.data) )
+                if fx2:
+                    b.fx2_per[i] = vb.fx2_per
+                    b.fx2_chimin[i] = vb.fx2_chimin
+                else:
+                    fx2_jobs.append( (b, i, vb.date, vb.data, vb.err) )
 
         if colorslope:
             jjh_slope[i] = v.jjh_slope
@@ -903,6 +1009,28 @@ def spreadsheet_write (table, lookup, season, outfile, flags=0,
             print "End of test"
             break
 
+    for b, bn in zip(bands, band_names):
+        if not lsp_jobs[bn]:
+            continue
+
+        stars = np.array([job[0] for job in lsp_jobs[bn]])
+        dates = [job[1] for job in lsp_jobs[bn]]
+        freq, power, nout, Jmax, prob = fasper_batch(
+            dates, [job[2] for job in lsp_jobs[bn]], 6.,
+            [lsp_tuning(date) for date in dates], trim=lsp_trim)
+
+        b.lsp_per[stars] = 1./ freq[Jmax]
+        b.lsp_pow[stars] = power
+        b.lsp_sig[stars] = prob
+
+    if fx2_jobs:
+        fbest, chimin = batch_analyze( [job[2] for job in fx2_jobs],
+                                       [job[3] for job in fx2_jobs],
+                                       [job[4] for job in fx2_jobs],
+                                       max_procs=max_procs )
+        for (b, i, date, data, err), f, c in zip(fx2_jobs, fbest, chimin):
+            b.fx2_per[i], b.fx2_chimin[i] = 1./f, c
+
     Output.add_column('SOURCEID',sidarr)
     Output.add_column('Name',names)
     Output.add_column('RA', RA, unit='RADIANS')
@@ -1012,11 +1140,46 @@ def spread_write_test (table, lookup, flags=0) :
     test_path = os.path.expanduser('~/Dropbox/Bo_Tom/NGC1333/WSERV7/DATA/spreadsheet/test.fits')
     spreadsheet_write (table, lookup, -1, test_path, flags=flags, Test=True)
 
+def _shard_worker (job):
+    """
+    Runs spreadsheet_write on one shard, inside a pool worker process.
+
+    The shard's photometry is read from a memory-mapped column store
+    (written by spreadsheet_write_efficient), so the big table never
+    has to be pickled; the partial spreadsheet goes back the same way,
+    as a FITS file in the shard's directory.
+
+    """
+
+    shard_dir, sids, designations, args, kwargs = job
+
+    start = datetime.datetime.now()
+
+    table_i = open_store(shard_dir)
+
+    lookup_i = atpy.Table()
+    lookup_i.add_column("SOURCEID", sids)
+    lookup_i.add_column("Designation", designations)
+
+    spreadsheet_i = spreadsheet_write(table_i, lookup_i, nowrite=True,
+                                      *args, **kwargs)
+
+    outfile = os.path.join(shard_dir, 'spreadsheet.fits')
+    spreadsheet_i.write(outfile, overwrite=True)
+
+    return outfile, (datetime.datetime.now() - start)
+
+
 def spreadsheet_write_efficient(n_splits, table, lookup, 
                                 *args, **kwargs):
     """
     Speeds up spreadsheet_write by splitting into subtables.
 
+    With `n_workers` other than 1, the subtables are run concurrently 
+    in a pool of worker processes. Each subtable is handed to its 
+    worker as a directory of memory-mapped column files rather than 
+    pickled, so workers only ever hold their own shard.
+
     Parameters
     ----------
     n_splits : int
@@ -1026,29 +1189,92 @@ def spreadsheet_write_efficient(n_splits, table, lookup,
     lookup : atpy.Table
         Table of interesting sources and their names
         (must contain columns "SOURCEID" and "Designation")
+    n_workers : int or None, optional (keyword only)
+        How many processes to run at once. Default 1 (no pool; 
+        sub-tables run one after another). None uses every core.
+    chunksize : int, optional (keyword only)
+        How many sub-tables to hand a worker at a time. Default 1.
+    tmpdir : str, optional (keyword only)
+        Where to put the shards' column files (default: the system
+        temporary directory). They are removed afterwards.
+
+    All other arguments are passed on to spreadsheet_write().
+
+    Returns
+    -------
+    agglomerated_spreadsheet : atpy.Table
+        The sub-spreadsheets joined together, in the same row order
+        as `lookup`.
 
     """
 
+    n_workers = kwargs.pop('n_workers', 1)
+    chunksize = kwargs.pop('chunksize', 1)
+    tmpdir = kwargs.pop('tmpdir', None)
+
     if n_splits > len(lookup):
         raise ValueError("Too many subsplits!")
     
+    table_shard = table.SOURCEID % n_splits
+    lookup_shard = lookup.SOURCEID % n_splits
+
     sub_spreadsheets = []
     
-    for i in range(n_splits):
+    if n_workers == 1:
+
+        for i in range(n_splits):
 
-        table_i = table.where((table.SOURCEID % n_splits) == i)
-        lookup_i = lookup.where((lookup.SOURCEID % n_splits) == i)
+            table_i = table.where(table_shard == i)
+            lookup_i = lookup.where(lookup_shard == i)
 
-        spreadsheet_i = spreadsheet_write(table_i, lookup_i, nowrite=True, 
-                                          *args, **kwargs)
-        now = datetime.datetime.strftime(datetime.datetime.now(),
-                                         "%m-%d %H:%M:%S")
-        print "part %d: %s. " % (i, now)
+            spreadsheet_i = spreadsheet_write(table_i, lookup_i, 
+                                              nowrite=True, *args, **kwargs)
+            now = datetime.datetime.strftime(datetime.datetime.now(),
+                                             "%m-%d %H:%M:%S")
+            print "part %d: %s. " % (i, now)
 
-        sub_spreadsheets.append(spreadsheet_i)
+            sub_spreadsheets.append(spreadsheet_i)
+
+    else:
+        import multiprocessing
+        import shutil
+        import tempfile
+
+        work_dir = tempfile.mkdtemp(prefix='spread3_', dir=tmpdir)
+
+        try:
+            jobs = []
+            for i in range(n_splits):
+                shard_dir = os.path.join(work_dir, 'shard%d' % i)
+                write_store(table.where(table_shard == i), shard_dir)
+
+                in_lookup = lookup_shard == i
+                jobs.append( (shard_dir, 
+                              lookup.SOURCEID[in_lookup],
+                              lookup.Designation[in_lookup],
+                              args, kwargs) )
+
+            pool = multiprocessing.Pool(n_workers)
+            try:
+                results = pool.map(_shard_worker, jobs, chunksize)
+            finally:
+                pool.close()
+                pool.join()
+
+            for i, (outfile, elapsed) in enumerate(results):
+                print "part %d: %s. " % (i, elapsed)
+                sub_spreadsheets.append( atpy.Table(outfile, verbose=False) )
+
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
 
     agglomerated_spreadsheet = sub_spreadsheets[0]
     for sub_spreadsheet in sub_spreadsheets[1:]:
         agglomerated_spreadsheet.append(sub_spreadsheet)
 
-    return agglomerated_spreadsheet
+    # The shards came back one after another; put the rows back 
+    # into lookup order.
+    shard_order = np.concatenate( [np.nonzero(lookup_shard == i)[0] 
+                                   for i in range(n_splits)] )
+
+    return agglomerated_spreadsheet.rows( np.argsort(shard_order) )
@@ -0,0 +1,539 @@
+"""
+spread_columnar.py
+
+A columnar (whole-catalog) engine for spread3-style spreadsheets.
+
+spread3.spreadsheet_write() calls statcruncher() once per star, and each
+call cuts the big table several times and then copies ~30 numbers per
+band into preallocated arrays. Here we instead group the table by SOURCEID
+once (with source_index.SourceIndex.gather), and compute each column for
+every star at once with the segmented reductions in grouped.py.
+
+Robust columns come from robust.robust_stats_grouped, which clips
+every star at once, and the Stetson index (band choice included) from
+the batched functions in stetson.py. Columns that depend on per-star
+logic that doesn't vectorize (yet) -- the graded Stetson index, period
+finding and color slopes -- are computed by looping over each star's slice of arrays that
+have already been cut, which is still much cheaper than re-cutting
+the whole table per star.
+
+Useful functions:
+  spreadsheet_write_columnar - drop-in replacement for
+                               spread3.spreadsheet_write.
+
+"""
+
+from __future__ import division
+
+import numpy as np
+import atpy
+
+import robust as rb
+from helpers3 import get_season_ids, band_validity, band_mask
+from season_calendar import get_calendar
+from source_index import get_source_index
+from grouped import (group_count, group_offsets, group_mean, group_std,
+                     group_min, group_max, group_median, group_sum)
+from spread3 import graded_Stetson_machine
+from stetson import I_batch, S_batch, S_singleton_batch
+from scargle import fasper as lsp
+from scargle import fasper_batch as lsp_batch
+from scargle import getSignificance
+from timing import lsp_mask, lsp_trim, lsp_tuning, lsp_tuning_batch
+from chi2 import test_analyze, batch_analyze
+from color_slope import slope
+
+null = np.double(-9.99999488e+08)
+
+band_names = ['j', 'h', 'k', 'jmh', 'hmk']
+
+
+class Band:
+    pass
+
+
+def _fill (values, has, fill=null):
+    """ Returns `values` where `has` is True, and `fill` elsewhere. """
+
+    return np.where(has, values, fill)
+
+
+def _Stetson_batch (validity, column, group, l):
+    """
+    spread3.Stetson_machine for every star at once.
+
+    Each star's band choice comes from how many of its rows have each
+    combination of bands (with Stetson_machine's tie-breaking), and then
+    every star with the same choice gets its index from one call to
+    stetson.I_batch, S_batch or S_singleton_batch.
+
+    Parameters
+    ----------
+    validity : np.ndarray
+        band_validity bitmasks of the rows, grouped by star.
+    column : function
+        Returns a photometry column, cut down to the same rows.
+    group : np.ndarray
+        Which star (0 to l-1) each row belongs to; sorted.
+    l : int
+        Number of stars.
+
+    Returns
+    -------
+    Stetson, choice, stetson_nights : np.ndarray
+        As Stetson_machine returns for each star.
+
+    """
+
+    combos = ['j', 'h', 'k', 'jh', 'hk', 'jk', 'jhk']
+    masks = dict( (c, band_mask(validity, c)) for c in combos )
+    count = dict( (c, group_count(group[masks[c]], l)) for c in combos )
+
+    max_len = np.max([count['jh'], count['hk'], count['jk'],
+                      2*count['jhk']], axis=0)
+    max_single = np.max([count['j'], count['h'], count['k']], axis=0)
+    single = max_len == 0
+
+    # The same order of preference as Stetson_machine's if/elif chain.
+    preference = np.array(['k', 'h', 'j', 'jhk', 'hk', 'jh', 'jk'],
+                          dtype='|S4')
+    choice = preference[np.select(
+        [single & (count['k'] == max_single),
+         single & (count['h'] == max_single),
+         single,
+         2*count['jhk'] == max_len,
+         count['hk'] == max_len,
+         count['jh'] == max_len],
+        range(6), 6)]
+
+    stetson_nights = np.where(single, max_single,
+                              np.where(choice == 'jhk', count['jhk'],
+                                       max_len))
+
+    Stetson = np.zeros(l)
+
+    for c in combos:
+        chosen = choice == c
+        if not chosen.any():
+            continue
+
+        use = masks[c] & chosen[group]
+        offsets = group_offsets(group[use], l)
+
+        def col (band, suffix=''):
+            return column(band.upper()+'APERMAG3'+suffix)[use]
+
+        if len(c) == 1:
+            index = S_singleton_batch(col(c), col(c, 'ERR'), offsets)
+        elif len(c) == 2:
+            index = I_batch(col(c[0]), col(c[0], 'ERR'),
+                            col(c[1]), col(c[1], 'ERR'), offsets)
+        else:
+            index = S_batch(col('j'), col('j', 'ERR'), col('h'), 
+                            col('h', 'ERR'), col('k'), col('k', 'ERR'),
+                            offsets)
+
+        Stetson[chosen] = index[chosen]
+
+    return Stetson, choice, stetson_nights
+
+
+def spreadsheet_write_columnar (table, lookup, season, outfile, flags=0,
+                                nowrite=False, rob=False, per=False,
+                                graded=False, colorslope=False,
+                                batch_lsp=False, fx2_batch=False,
+                                max_procs=None):
+    """
+    Makes my spreadsheet, but one column at a time instead of one star
+    at a time.
+
+    Takes the same arguments as spread3.spreadsheet_write (minus `Test`)
+    and produces a table with the same columns and values.
+
+    Parameters
+    ----------
+    table : atpy.Table
+        Table with time-series photometry
+    lookup : atpy.Table
+        Table of interesting sources and their names
+        (must contain columns "SOURCEID" and "Designation")
+    season : int
+        Which observing season of our dataset (1, 2, 3, or all).
+        Any value that is not the integers (1, 2, or 3) will be
+        treated as "no season", and no time-cut will be made.
+    outfile : str
+        What filename to save spreadsheet to.
+    flags : int, optional
+        Maximum ppErrBit quality flags to use (default 0)
+    nowrite : bool, optional
+        Return the output table instead of writing it?
+        (default False).
+    rob : bool, optional
+        Use robust statistics, in addition to normal ones?
+        (takes longer, default False)
+    per : bool, optional
+        Run period-finding? Uses fast chi-squared and lomb-scargle.
+        (takes longer, default False)
+    graded : bool, optional
+        Also calculate Stetson indices using quality grades as weights?
+    colorslope : bool, optional
+        Calculate color slopes? Runs them over (JvJ-H, KvH-K, J-HvH-K).
+    batch_lsp : bool, optional
+        With `per`, compute every star's Lomb-Scargle periodogram in one
+        scargle.fasper_batch() call per band. Much faster, but the stars
+        share one frequency grid, so the lsp columns differ slightly 
+        from spreadsheet_write's. Default False.
+    fx2_batch, max_procs : optional
+        As in spread3.spreadsheet_write: run every star's fast 
+        chi-squared search, in every band, through one 
+        chi2.batch_analyze() call (needs runchi2). Default False.
+
+    Returns
+    -------
+    Output : atpy.Table, or None
+        Either returns the output table (if nowrite==True) or
+        writes the output table to `outfile` and returns None.
+
+    """
+
+    sidarr = lookup.SOURCEID
+    names = lookup.Designation
+    l = sidarr.size
+
+    # Group the table by lookup star (once!), and then trim each
+    # star's rows down to the requested season.
+    rows, offsets = get_source_index(table).gather(sidarr)
+    group = np.repeat(np.arange(l), np.diff(offsets))
+
+    calendar = get_calendar()
+    low, high = calendar.bounds(season)
+    if (low, high) == calendar.everything:
+        date = table.MEANMJDOBS[rows]
+        in_season = (date < high) & (date > low)
+    else:
+        # Each row's season id is worked out once per table, so a loop
+        # over seasons (see super.do_it_all) doesn't redo the dates.
+        in_season = calendar.season_mask(get_season_ids(table)[rows], season)
+
+    rows = rows[in_season]
+    group = group[in_season]
+
+    # Stars with no data at all keep spreadsheet_write's default values.
+    has_data = group_count(group, l) > 0
+    star_offsets = group_offsets(group, l)
+
+    columns = {}
+    def column (name):
+        """ Each needed column, cut down to `rows`, computed only once. """
+        if name not in columns:
+            columns[name] = table.data[name][rows]
+        return columns[name]
+
+    # Which bands are good in each row (the rows helpers3.band_cut would
+    # select), worked out once per table and flag threshold.
+    # Only these rows' photometry is read, not the whole table's.
+    validity = band_validity(table, max_flag=flags, rows=rows)
+    full_validity = band_validity(table, rows=rows)
+
+    j_ok = band_mask(validity, 'j')
+    h_ok = band_mask(validity, 'h')
+    k_ok = band_mask(validity, 'k')
+
+    band_masks = [j_ok, h_ok, k_ok, j_ok & h_ok, h_ok & k_ok]
+    band_cols = ['JAPERMAG3', 'HAPERMAG3', 'KAPERMAG3', 'JMHPNT', 'HMKPNT']
+
+    Output = atpy.Table()
+
+    # How many nights have observations in each band?
+    ones = np.ones_like(sidarr)
+
+    N = {}
+    for b, mask in zip(['j', 'h', 'k'], band_masks):
+        N[b] = _fill(group_count(group[mask], l), has_data, ones)
+
+    # What's the distribution of flags and nights?
+    flag_counts = {}
+    for b in ['j', 'h', 'k']:
+        full = band_mask(full_validity, b)
+        pp = column(b.upper()+'PPERRBITS')
+
+        noflag = full & (pp == 0)
+        info = full & (pp < 256) & (pp > 0)
+        warn = full & (pp >= 256)
+
+        flag_counts[b] = [_fill(group_count(group[m], l), has_data, ones)
+                          for m in (noflag, info, warn)]
+
+    # Mean position, checking for sensible values
+    ra = column('RA')
+    dec = column('DEC')
+    ra_ok = (ra > 0) & (ra < 7)
+    dec_ok = (dec > -4) & (dec < 4)
+
+    RA = _fill(group_mean(ra[ra_ok], group[ra_ok], l), has_data, 1.)
+    DEC = _fill(group_mean(dec[dec_ok], group[dec_ok], l), has_data, 1.)
+
+    # PSTAR parameters
+    pstar = column('PSTAR')
+    pstar_mean = _fill(group_mean(pstar, group, l), has_data, 1.)
+    pstar_median = _fill(group_median(pstar, group, l), has_data, 1.)
+    pstar_rms = _fill(group_std(pstar, group, l), has_data, 1.)
+
+    # The Stetson index, band choice and all, for every star at once.
+    Stetson = np.ones(l)
+    Stetson_choice = np.zeros(l, dtype='|S4')
+    Stetson_N = np.ones(l, dtype='int')
+
+    batch_S, batch_choice, batch_N = _Stetson_batch(validity, column,
+                                                    group, l)
+    Stetson[has_data] = batch_S[has_data]
+    Stetson_choice[has_data] = batch_choice[has_data]
+    Stetson_N[has_data] = batch_N[has_data]
+
+    if graded:
+        graded_Stetson = np.ones(l)
+        graded_Stetson_choice = np.zeros(l, dtype='|S4')
+        graded_Stetson_N = np.ones(l, dtype='int')
+
+    if graded:
+        # (The graded index still goes star by star.)
+        for i in np.nonzero(has_data)[0]:
+            star = slice(star_offsets[i], star_offsets[i+1])
+            s_table = table.rows( rows[star] )
+
+            (graded_Stetson[i], graded_Stetson_choice[i],
+             graded_Stetson_N[i]) = graded_Stetson_machine(
+                s_table, flags, validity=validity[star])
+
+    # Now the per-band statistics.
+    bands = []
+    # With fx2_batch: (band, star index, date, mag, err) to search.
+    fx2_jobs = []
+
+    for bn, mask, colname in zip(band_names, band_masks, band_cols):
+        b = Band()
+        bands.append(b)
+
+        x = column(colname)[mask]
+        e = column(colname+'ERR')[mask]
+        g = group[mask]
+
+        b.N = group_count(g, l)
+        has = b.N > 0
+
+        b.mean = _fill(group_mean(x, g, l), has)
+        b.median = _fill(group_median(x, g, l), has)
+        b.rms = _fill(group_std(x, g, l), has)
+        b.min = _fill(group_min(x, g, l), has)
+        b.max = _fill(group_max(x, g, l), has)
+        b.range = _fill(b.max - b.min, has)
+
+        # reduced chi-squared, which is 0 for a single observation
+        mean = group_mean(x, g, l)
+        chisq = group_sum((x - mean[g])**2 / e**2, g, l)
+        b.rchi2 = _fill(np.where(b.N > 1, chisq / np.maximum(b.N - 1, 1),
+                                 0), has)
+
+        b.err_mean = _fill(group_mean(e, g, l), has)
+        b.err_median = _fill(group_median(e, g, l), has)
+        b.err_rms = _fill(group_std(e, g, l), has)
+        b.err_min = _fill(group_min(e, g, l), has)
+        b.err_max = _fill(group_max(e, g, l), has)
+        b.err_range = _fill(b.err_max - b.err_min, has)
+
+        band_offsets = group_offsets(g, l)
+
+        if rob:
+            # meanr, medianr and stdr clip until converged, but the
+            # other robust columns have always used niter=2.
+            meanr, medianr, rmsr = rb.robust_stats_grouped(
+                x, band_offsets, 3)[:3]
+            minr, maxr, indr = rb.robust_stats_grouped(
+                x, band_offsets, 3, niter=2)[3:]
+
+            er = e[indr]
+            gr = g[indr]
+
+            b.meanr = _fill(meanr, has)
+            b.medianr = _fill(medianr, has)
+            b.rmsr = _fill(rmsr, has)
+            b.minr = _fill(minr, has)
+            b.maxr = _fill(maxr, has)
+            b.ranger = _fill(maxr - minr, has)
+
+            b.err_meanr = _fill(group_mean(er, gr, l), has)
+            b.err_medianr = _fill(group_median(er, gr, l), has)
+            b.err_rmsr = _fill(group_std(er, gr, l), has)
+            b.err_minr = _fill(group_min(er, gr, l), has)
+            b.err_maxr = _fill(group_max(er, gr, l), has)
+            b.err_ranger = _fill(b.err_maxr - b.err_minr, has)
+
+        if per:
+            t = column('MEANMJDOBS')[mask]
+
+            period_names = ['lsp_per', 'lsp_pow', 'lsp_sig',
+                            'fx2_per', 'fx2_chimin']
+            for pn in period_names:
+                setattr(b, pn, np.ones(l) * null)
+
+            periodic = np.nonzero(b.N > 2)[0]
+
+            if batch_lsp and periodic.size > 0:
+                # Every star's periodogram at once, on a shared grid,
+                # keeping only each star's (lsp_mask-trimmed) peak.
+                use = (b.N > 2)[g]
+                use_offsets = group_offsets(g[use], l)[np.r_[periodic,
+                                                             periodic[-1]+1]]
+                hifac = lsp_tuning_batch(t[use], use_offsets)
+
+                freq, power, nout, Jmax, prob = lsp_batch(
+                    t[use], x[use], 6., hifac, offsets=use_offsets,
+                    trim=lsp_trim)
+
+                b.lsp_per[periodic] = 1./ freq[Jmax]
+                b.lsp_pow[periodic] = power
+                b.lsp_sig[periodic] = prob
+
+            for i in periodic:
+                ti = t[band_offsets[i]:band_offsets[i+1]]
+                xi = x[band_offsets[i]:band_offsets[i+1]]
+                ei = e[band_offsets[i]:band_offsets[i+1]]
+
+                if not batch_lsp:
+                    hifac = lsp_tuning(ti)
+
+                    lsp_i = lsp(ti, xi, 6., hifac)
+                    Jmax = lsp_mask(lsp_i[0], lsp_i[1])
+                    b.lsp_per[i] = 1./ lsp_i[0][Jmax]
+                    b.lsp_pow[i] = lsp_i[1][Jmax]
+                    b.lsp_sig[i] = getSignificance(lsp_i[0], lsp_i[1],
+                                                   lsp_i[2], 6.)[Jmax]
+
+                if fx2_batch:
+                    fx2_jobs.append( (b, i, ti, xi, ei) )
+                    continue
+
+                best_freq, chimin = test_analyze( ti, xi, ei,
+                                                  ret_chimin=True )
+
+                b.fx2_per[i], b.fx2_chimin[i] = 1./best_freq, chimin
+
+    if fx2_jobs:
+        fbest, chimin = batch_analyze( [job[2] for job in fx2_jobs],
+                                       [job[3] for job in fx2_jobs],
+                                       [job[4] for job in fx2_jobs],
+                                       max_procs=max_procs )
+        for (b, i, ti, xi, ei), f, c in zip(fx2_jobs, fbest, chimin):
+            b.fx2_per[i], b.fx2_chimin[i] = 1./f, c
+
+    if colorslope:
+        jjh_slope =  np.ones(l) * null
+        jjh_slope_err =  np.ones(l) * null
+        khk_slope =  np.ones(l) * null
+        khk_slope_err =  np.ones(l) * null
+        jhk_slope =  np.ones(l) * null
+        jhk_slope_err =  np.ones(l) * null
+
+        # (x, y) column pairs, in the same order as statcruncher.
+        slope_specs = [ (j_ok & h_ok, 'JMHPNT', 'JAPERMAG3',
+                         jjh_slope, jjh_slope_err),
+                        (h_ok & k_ok, 'HMKPNT', 'KAPERMAG3',
+                         khk_slope, khk_slope_err),
+                        (j_ok & h_ok & k_ok, 'HMKPNT', 'JMHPNT',
+                         jhk_slope, jhk_slope_err) ]
+
+        for mask, xname, yname, slope_arr, slope_err_arr in slope_specs:
+            xs = column(xname)[mask]; xerrs = column(xname+'ERR')[mask]
+            ys = column(yname)[mask]; yerrs = column(yname+'ERR')[mask]
+            so = group_offsets(group[mask], l)
+
+            for i in np.nonzero(has_data)[0]:
+                sl = slice(so[i], so[i+1])
+                (slope_arr[i], a, slope_err_arr[i]) = (
+                    slope( xs[sl], ys[sl], xerrs[sl], yerrs[sl],
+                           verbose=False) )
+
+    Output.add_column('SOURCEID',sidarr)
+    Output.add_column('Name',names)
+    Output.add_column('RA', RA, unit='RADIANS')
+    Output.add_column('DEC', DEC, unit='RADIANS')
+    Output.add_column('N_j', N['j'])
+    Output.add_column('N_h', N['h'])
+    Output.add_column('N_k', N['k'])
+
+    Output.add_column('pstar_mean', pstar_mean)
+    Output.add_column('pstar_median', pstar_median)
+    Output.add_column('pstar_rms', pstar_rms)
+
+    Output.add_column('Stetson', Stetson)
+    Output.add_column('Stetson_choice', Stetson_choice)
+    Output.add_column('Stetson_N', Stetson_N)
+
+    if graded:
+        Output.add_column('graded_Stetson', graded_Stetson)
+        Output.add_column('graded_Stetson_choice', graded_Stetson_choice)
+        Output.add_column('graded_Stetson_N', graded_Stetson_N)
+
+    for b, band_name in zip(bands, band_names):
+        bn = band_name + '_'
+        Output.add_column(bn+'mean', b.mean)
+        Output.add_column(bn+'median', b.median)
+        Output.add_column(bn+'rms', b.rms)
+        Output.add_column(bn+'min', b.min)
+        Output.add_column(bn+'max', b.max)
+        Output.add_column(bn+'range', b.range)
+
+        Output.add_column(bn+'rchi2', b.rchi2)
+
+        Output.add_column(bn+'err_mean', b.err_mean)
+        Output.add_column(bn+'err_median', b.err_median)
+        Output.add_column(bn+'err_rms', b.err_rms)
+        Output.add_column(bn+'err_min', b.err_min)
+        Output.add_column(bn+'err_max', b.err_max)
+        Output.add_column(bn+'err_range', b.err_range)
+
+        if rob:
+            Output.add_column(bn+'meanr', b.meanr)
+            Output.add_column(bn+'medianr', b.medianr)
+            Output.add_column(bn+'rmsr', b.rmsr)
+            Output.add_column(bn+'minr', b.minr)
+            Output.add_column(bn+'maxr', b.maxr)
+            Output.add_column(bn+'ranger', b.ranger)
+
+            Output.add_column(bn+'err_meanr', b.err_meanr)
+            Output.add_column(bn+'err_medianr', b.err_medianr)
+            Output.add_column(bn+'err_rmsr', b.err_rmsr)
+            Output.add_column(bn+'err_minr', b.err_minr)
+            Output.add_column(bn+'err_maxr', b.err_maxr)
+            Output.add_column(bn+'err_ranger', b.err_ranger)
+
+        if per:
+            Output.add_column(bn+'lsp_per', b.lsp_per)
+            Output.add_column(bn+'lsp_pow', b.lsp_pow)
+            Output.add_column(bn+'lsp_sig', b.lsp_sig)
+            Output.add_column(bn+'fx2_per', b.fx2_per)
+            Output.add_column(bn+'fx2_chimin', b.fx2_chimin)
+
+    for flag_name, index in zip(['noflag', 'info', 'warn'], range(3)):
+        for b in ['j', 'h', 'k']:
+            Output.add_column('N_%s_%s' % (b, flag_name),
+                              flag_counts[b][index])
+
+    if colorslope:
+        Output.add_column('jjh_slope', jjh_slope)
+        Output.add_column('jjh_slope_err', jjh_slope_err)
+        Output.add_column('khk_slope', khk_slope)
+        Output.add_column('khk_slope_err', khk_slope_err)
+        Output.add_column('jhk_slope', jhk_slope)
+        Output.add_column('jhk_slope_err', jhk_slope_err)
+
+    if Output.table_name is None:
+        Output.table_name = 'spreadsheet'
+
+    if nowrite:
+        return Output
+    else:
+        Output.write(outfile, overwrite=True)
+        print "Wrote output to %s" % outfile
+
+        return
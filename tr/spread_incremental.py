@@ -0,0 +1,497 @@
+"""
+spread_incremental.py
+
+Keeps a spread3-style spreadsheet up to date as new nights arrive,
+without recomputing it from scratch.
+
+Most spreadsheet columns (counts, means, standard deviations, minima,
+maxima, reduced chi-squared, flag-class counts) can be computed from a
+handful of running sums per star and band, and those sums from two
+batches of nights can simply be merged (Chan et al.'s parallel version
+of Welford's algorithm). So we save those "accumulators" next to the
+spreadsheet, and when new nights come in we only ever read the new
+photometry to update those columns.
+
+The remaining columns -- medians, Stetson indices, robust statistics,
+periods and color slopes -- can't be merged. They are recomputed
+(with spread_columnar) only for the stars that gained data, which does
+mean reading those stars' old photometry too.
+
+Useful functions:
+  update_spreadsheet - Folds new nights into a spreadsheet (or makes
+                       the first one).
+
+Helper classes:
+  Accumulator - mergeable count/mean/variance/min/max of one quantity
+                for many stars.
+  SpreadsheetState - every Accumulator behind one spreadsheet.
+
+"""
+
+from __future__ import division
+import os
+
+import numpy as np
+import atpy
+
+from helpers3 import season_bounds, band_validity, band_mask
+from source_index import get_source_index
+from grouped import group_count, group_mean, group_sum, group_min, group_max
+from spread_columnar import spreadsheet_write_columnar, null
+
+band_names = ['j', 'h', 'k', 'jmh', 'hmk']
+band_cols = ['JAPERMAG3', 'HAPERMAG3', 'KAPERMAG3', 'JMHPNT', 'HMKPNT']
+band_combos = ['j', 'h', 'k', 'jh', 'hk']
+
+flag_classes = ['noflag', 'info', 'warn']
+
+# Spreadsheet columns that can't be built from accumulators.
+_exact_columns = ['pstar_median', 'Stetson', 'Stetson_choice', 'Stetson_N',
+                  'graded_Stetson', 'graded_Stetson_choice',
+                  'graded_Stetson_N', 'jjh_slope', 'jjh_slope_err',
+                  'khk_slope', 'khk_slope_err', 'jhk_slope', 'jhk_slope_err']
+_exact_band_columns = ['median', 'err_median',
+                       'meanr', 'medianr', 'rmsr', 'minr', 'maxr', 'ranger',
+                       'err_meanr', 'err_medianr', 'err_rmsr', 'err_minr',
+                       'err_maxr', 'err_ranger',
+                       'lsp_per', 'lsp_pow', 'lsp_sig', 'fx2_per',
+                       'fx2_chimin']
+
+
+class Accumulator(object):
+    """
+    Mergeable running statistics of one quantity, for many stars.
+
+    Attributes
+    ----------
+    n : np.ndarray of int
+        How many values each star has.
+    mean, m2 : np.ndarray
+        Running mean and sum of squared deviations from it (Welford).
+    min, max : np.ndarray
+        Extremes (+inf / -inf for stars with no values).
+    sw, swx, swxx : np.ndarray
+        Sums of w, w*x and w*x**2 for weights w = 1/err**2, which is
+        all the reduced chi-squared needs (zero if no errors given).
+
+    """
+
+    fields = ['n', 'mean', 'm2', 'min', 'max', 'sw', 'swx', 'swxx']
+
+    def __init__(self, n_stars):
+
+        self.n = np.zeros(n_stars, dtype=int)
+        self.mean = np.zeros(n_stars)
+        self.m2 = np.zeros(n_stars)
+        self.min = np.inf * np.ones(n_stars)
+        self.max = -np.inf * np.ones(n_stars)
+        self.sw = np.zeros(n_stars)
+        self.swx = np.zeros(n_stars)
+        self.swxx = np.zeros(n_stars)
+
+    @classmethod
+    def from_groups(cls, x, g, n_stars, err=None):
+        """ Accumulates values `x` belonging to stars `g` (sorted). """
+
+        acc = cls(n_stars)
+        acc.n = group_count(g, n_stars)
+        has = acc.n > 0
+
+        mean = group_mean(x, g, n_stars)
+        acc.mean = np.where(has, mean, 0.)
+        acc.m2 = group_sum((x - acc.mean[g])**2, g, n_stars)
+        acc.min = np.where(has, group_min(x, g, n_stars), np.inf)
+        acc.max = np.where(has, group_max(x, g, n_stars), -np.inf)
+
+        if err is not None:
+            w = 1. / err**2
+            acc.sw = group_sum(w, g, n_stars)
+            acc.swx = group_sum(w * x, g, n_stars)
+            acc.swxx = group_sum(w * x**2, g, n_stars)
+
+        return acc
+
+    def merge(self, other):
+        """ Returns the accumulator of both batches' values together. """
+
+        merged = Accumulator(self.n.size)
+        merged.n = self.n + other.n
+        n = np.maximum(merged.n, 1)
+
+        delta = other.mean - self.mean
+        merged.mean = self.mean + delta * other.n / n
+        merged.m2 = self.m2 + other.m2 + delta**2 * self.n * other.n / n
+
+        merged.min = np.minimum(self.min, other.min)
+        merged.max = np.maximum(self.max, other.max)
+
+        merged.sw = self.sw + other.sw
+        merged.swx = self.swx + other.swx
+        merged.swxx = self.swxx + other.swxx
+
+        return merged
+
+    def std(self):
+        """ Standard deviation (like np.std: divides by n). """
+
+        return np.sqrt(self.m2 / np.maximum(self.n, 1))
+
+    def rchi2(self):
+        """ Reduced chi-squared about the mean; 0 for fewer than 2 values. """
+
+        chisq = (self.swxx - 2 * self.mean * self.swx +
+                 self.mean**2 * self.sw)
+        return np.where(self.n > 1, chisq / np.maximum(self.n - 1, 1), 0)
+
+
+class SpreadsheetState(object):
+    """
+    All the accumulators behind one spreadsheet (one season and flag
+    threshold, one lookup table).
+
+    Attributes
+    ----------
+    sids : np.ndarray
+        The lookup table's SOURCEIDs, in its order.
+    season, flags : int
+        What the spreadsheet was made with.
+    accumulators : dict
+        Accumulator per quantity: 'date', 'ra', 'dec', 'pstar', and
+        for each band both e.g. 'j' and 'j_err'.
+    counts : dict
+        Flag-class counts, e.g. counts['N_j_noflag'].
+    nights : np.ndarray
+        Every distinct MEANMJDOBS folded in so far, sorted.
+    seen_through : float
+        Dates at or before this count as folded in too (only set for
+        states saved before `nights` was kept; otherwise -inf).
+
+    """
+
+    def __init__(self, sids, season, flags, nights=None):
+
+        self.sids = np.asarray(sids)
+        self.season = season
+        self.flags = flags
+        self.accumulators = {}
+        self.counts = {}
+        if nights is None:
+            nights = np.zeros(0)
+        self.nights = np.unique(nights)
+        self.seen_through = -np.inf
+
+    def seen(self, dates):
+        """ Which of `dates` (MEANMJDOBS) were already folded in. """
+
+        dates = np.asarray(dates)
+        if self.nights.size == 0:
+            return dates <= self.seen_through
+
+        i = np.minimum(np.searchsorted(self.nights, dates),
+                       self.nights.size - 1)
+        return (self.nights[i] == dates) | (dates <= self.seen_through)
+
+    def merge(self, other):
+        """ Returns the state of both batches of nights together. """
+
+        merged = SpreadsheetState(self.sids, self.season, self.flags,
+                                  np.union1d(self.nights, other.nights))
+        merged.seen_through = max(self.seen_through, other.seen_through)
+
+        for name, acc in self.accumulators.items():
+            merged.accumulators[name] = acc.merge(other.accumulators[name])
+        for name, count in self.counts.items():
+            merged.counts[name] = count + other.counts[name]
+
+        return merged
+
+    def save(self, filename):
+        """ Saves the state as a .npz file. """
+
+        arrays = {'sids': self.sids,
+                  'season': np.array(self.season),
+                  'flags': np.array(self.flags),
+                  'nights': self.nights,
+                  'seen_through': np.array(self.seen_through)}
+
+        for name, acc in self.accumulators.items():
+            for field in Accumulator.fields:
+                arrays['acc:%s:%s' % (name, field)] = getattr(acc, field)
+        for name, count in self.counts.items():
+            arrays['count:'+name] = count
+
+        # Write, then rename, so a crash never leaves half a state behind.
+        tmp_name = filename + '.tmp.npz'
+        np.savez(tmp_name, **arrays)
+        os.rename(tmp_name, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """ Loads a state saved by save(). """
+
+        f = np.load(filename)
+
+        legacy = 'nights' not in f.files
+        if not legacy:
+            state = cls(f['sids'], int(f['season']), int(f['flags']),
+                        f['nights'])
+            state.seen_through = float(f['seen_through'])
+        else:
+            # An older state, which only knew its latest date.
+            state = cls(f['sids'], int(f['season']), int(f['flags']))
+
+        for key in f.files:
+            if key.startswith('acc:'):
+                kind, name, field = key.split(':')
+                if name not in state.accumulators:
+                    state.accumulators[name] = Accumulator(state.sids.size)
+                setattr(state.accumulators[name], field, f[key])
+            elif key.startswith('count:'):
+                state.counts[key[len('count:'):]] = f[key]
+
+        f.close()
+
+        if legacy:
+            date = state.accumulators['date']
+            if date.n.sum() > 0:
+                state.seen_through = date.max.max()
+
+        return state
+
+
+def accumulate (table, sidarr, season, flags=0, skip=None):
+    """
+    Builds the accumulators for some photometry.
+
+    Parameters
+    ----------
+    table : atpy.Table
+        Table with time-series photometry (e.g. only the new nights).
+    sidarr : np.ndarray
+        The lookup table's SOURCEIDs.
+    season : int
+        Which observing season of our dataset (1, 2, 3, or all).
+    flags : int, optional
+        Maximum ppErrBit quality flags to use (default 0)
+    skip : SpreadsheetState, optional
+        Ignore observations from nights this state has already folded
+        in (so they aren't counted twice), with a warning if there are
+        any. Older nights it hasn't seen are still counted.
+
+    Returns
+    -------
+    state : SpreadsheetState
+        Its `nights` are the nights counted here.
+
+    """
+
+    l = sidarr.size
+
+    rows, offsets = get_source_index(table).gather(sidarr)
+    group = np.repeat(np.arange(l), np.diff(offsets))
+
+    low, high = season_bounds(season)
+    date = table.MEANMJDOBS[rows]
+    keep = (date < high) & (date > low)
+
+    if skip is not None:
+        seen = keep & skip.seen(date)
+        if seen.any():
+            print ("WARNING: ignoring %d rows from %d nights that were "
+                   "already folded in" % (seen.sum(),
+                                          np.unique(date[seen]).size))
+        keep &= ~seen
+
+    rows = rows[keep]
+    group = group[keep]
+
+    def column (name):
+        return table.data[name][rows]
+
+    state = SpreadsheetState(sidarr, season, flags, date[keep])
+    acc = state.accumulators
+
+    acc['date'] = Accumulator.from_groups(column('MEANMJDOBS'), group, l)
+
+    # Positions, checking for sensible values (as statcruncher does)
+    ra = column('RA')
+    dec = column('DEC')
+    ra_ok = (ra > 0) & (ra < 7)
+    dec_ok = (dec > -4) & (dec < 4)
+    acc['ra'] = Accumulator.from_groups(ra[ra_ok], group[ra_ok], l)
+    acc['dec'] = Accumulator.from_groups(dec[dec_ok], group[dec_ok], l)
+
+    acc['pstar'] = Accumulator.from_groups(column('PSTAR'), group, l)
+
+    # Only these rows' photometry is read, not the whole table's.
+    validity = band_validity(table, max_flag=flags, rows=rows)
+    full_validity = band_validity(table, rows=rows)
+
+    for bn, colname, combo in zip(band_names, band_cols, band_combos):
+        mask = band_mask(validity, combo)
+        x = column(colname)[mask]
+        e = column(colname+'ERR')[mask]
+        g = group[mask]
+
+        acc[bn] = Accumulator.from_groups(x, g, l, err=e)
+        acc[bn+'_err'] = Accumulator.from_groups(e, g, l)
+
+    for b in ['j', 'h', 'k']:
+        full = band_mask(full_validity, b)
+        pp = column(b.upper()+'PPERRBITS')
+
+        classes = [ full & (pp == 0),
+                    full & (pp < 256) & (pp > 0),
+                    full & (pp >= 256) ]
+
+        for flag_class, m in zip(flag_classes, classes):
+            state.counts['N_%s_%s' % (b, flag_class)] = (
+                group_count(group[m], l) )
+
+    return state
+
+
+def _mergeable_columns (state):
+    """ The spreadsheet columns that come straight from a state. """
+
+    acc = state.accumulators
+    columns = {}
+
+    columns['RA'] = np.where(acc['ra'].n > 0, acc['ra'].mean, np.nan)
+    columns['DEC'] = np.where(acc['dec'].n > 0, acc['dec'].mean, np.nan)
+
+    columns['pstar_mean'] = acc['pstar'].mean
+    columns['pstar_rms'] = acc['pstar'].std()
+
+    for b in ['j', 'h', 'k']:
+        columns['N_'+b] = acc[b].n
+
+    for bn in band_names:
+        a = acc[bn]
+        ae = acc[bn+'_err']
+        has = a.n > 0
+
+        def fill (values):
+            return np.where(has, values, null)
+
+        bn = bn + '_'
+        columns[bn+'mean'] = fill(a.mean)
+        columns[bn+'rms'] = fill(a.std())
+        columns[bn+'min'] = fill(a.min)
+        columns[bn+'max'] = fill(a.max)
+        columns[bn+'range'] = fill(a.max - a.min)
+        columns[bn+'rchi2'] = fill(a.rchi2())
+
+        columns[bn+'err_mean'] = fill(ae.mean)
+        columns[bn+'err_rms'] = fill(ae.std())
+        columns[bn+'err_min'] = fill(ae.min)
+        columns[bn+'err_max'] = fill(ae.max)
+        columns[bn+'err_range'] = fill(ae.max - ae.min)
+
+    columns.update(state.counts)
+
+    return columns
+
+
+def update_spreadsheet (new_table, lookup, season, outfile, state_file,
+                        table=None, flags=0, rob=False, per=False,
+                        graded=False, colorslope=False):
+    """
+    Folds new nights of photometry into a spreadsheet.
+
+    The first time (when `state_file` doesn't exist yet), this just
+    makes the spreadsheet with spread_columnar and saves the
+    accumulators; pass the whole dataset as `new_table`. After that,
+    pass only the new nights as `new_table`: the count, mean, rms,
+    min/max, rchi2 and flag-count columns are updated from them alone,
+    and the other columns are recomputed from `table` (all of the
+    photometry), but only for the stars that gained data.
+
+    Parameters
+    ----------
+    new_table : atpy.Table
+        Photometry of the new nights (which may be older than nights
+        already folded in). Observations from nights that were already
+        folded in are ignored, with a warning.
+    lookup : atpy.Table
+        Table of interesting sources and their names
+        (must contain columns "SOURCEID" and "Designation").
+        Must be the same every time for a given `state_file`.
+    season : int
+        Which observing season of our dataset (1, 2, 3, or all).
+    outfile : str
+        The spreadsheet's filename (read, then overwritten).
+    state_file : str
+        Where the accumulators are kept (a .npz file).
+    table : atpy.Table, optional
+        All of the photometry, old and new (e.g. a column store, so
+        only the stars that gained data are actually read). If None,
+        the columns that can't be merged are left as they were, and
+        a warning is printed.
+    flags : int, optional
+        Maximum ppErrBit quality flags to use (default 0)
+    rob, per, graded, colorslope : bool, optional
+        As in spread3.spreadsheet_write; must be the same every time.
+
+    Returns
+    -------
+    gained : np.ndarray of bool
+        Which lookup stars gained data this time.
+
+    """
+
+    sidarr = lookup.SOURCEID
+    l = sidarr.size
+
+    options = dict(flags=flags, nowrite=True, rob=rob, per=per,
+                   graded=graded, colorslope=colorslope)
+
+    if not os.path.exists(state_file):
+        state = accumulate(new_table, sidarr, season, flags)
+        spreadsheet = spreadsheet_write_columnar(new_table, lookup, season,
+                                                 None, **options)
+        spreadsheet.write(outfile, overwrite=True)
+        state.save(state_file)
+
+        return state.accumulators['date'].n > 0
+
+    old_state = SpreadsheetState.load(state_file)
+
+    if (old_state.season != season or old_state.flags != flags or
+        old_state.sids.size != l or np.any(old_state.sids != sidarr)):
+        raise Exception("%s was made with a different lookup table, "
+                        "season or flags" % state_file)
+
+    new_state = accumulate(new_table, sidarr, season, flags,
+                           skip=old_state)
+    state = old_state.merge(new_state)
+
+    gained = new_state.accumulators['date'].n > 0
+
+    print "%d of %d stars gained data" % (gained.sum(), l)
+
+    spreadsheet = atpy.Table(outfile, verbose=False)
+
+    for name, values in _mergeable_columns(state).items():
+        spreadsheet.data[name][gained] = values[gained]
+
+    if gained.any():
+        exact_names = _exact_columns + [bn+'_'+c for bn in band_names
+                                        for c in _exact_band_columns]
+        exact_names = [n for n in exact_names
+                       if n in spreadsheet.data.dtype.names]
+
+        if table is None:
+            print ("WARNING: no `table` given, so %s are now stale for "
+                   "the stars that gained data." % ', '.join(exact_names))
+        else:
+            refreshed = spreadsheet_write_columnar(table,
+                                                   lookup.where(gained),
+                                                   season, None, **options)
+            for name in exact_names:
+                spreadsheet.data[name][gained] = refreshed.data[name]
+
+    spreadsheet.write(outfile, overwrite=True)
+    state.save(state_file)
+
+    return gained
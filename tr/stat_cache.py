@@ -0,0 +1,241 @@
+"""
+stat_cache.py : a persistent cache of statcruncher() results.
+
+super.do_it_all makes spreadsheets for seasons 1, 2, 3 and 123, and
+the same stars get crunched again in interactive sessions and on every
+rerun, even when their data haven't changed. A StatCache remembers
+each result, keyed by
+
+  (SOURCEID, season, flags, rob, per, graded, colorslope,
+   a hash of that source's rows in the table),
+
+in memory (a least-recently-used dict) and on disk (one pickle file
+per result), so repeated runs over unchanged data are nearly free.
+If a source's photometry changes, its hash does too, so stale results
+are never returned; invalidate() throws results away explicitly.
+
+Useful functions:
+  StatCache - the cache; use its statcruncher() method in place of
+              spread3.statcruncher(), or pass it to spreadsheet_write
+              as `cache`.
+
+"""
+
+from __future__ import division
+import os
+import glob
+import hashlib
+import cPickle as pickle
+from collections import OrderedDict
+
+import numpy as np
+
+from source_index import source_rows
+from column_store import column_names
+import spread3
+
+
+class StatCache(object):
+    """
+    An in-memory LRU cache in front of an on-disk cache of
+    statcruncher() results.
+
+    Parameters
+    ----------
+    directory : str or None, optional
+        Where to keep the on-disk cache (created if needed).
+        None keeps results in memory only.
+    memory_size : int, optional
+        How many results to keep in memory. Default 1024.
+    disk_bytes : int, optional
+        Size cap for the on-disk cache; when it's exceeded, the least
+        recently used files are deleted. Default 1 GB.
+
+    Attributes
+    ----------
+    hits, misses : int
+        How many lookups were (or weren't) answered from the cache.
+    disk_used : int
+        Bytes in the on-disk cache, kept up to date as files are written
+        and removed (so the directory is only listed when it's too full).
+
+    """
+
+    def __init__(self, directory=None, memory_size=1024, disk_bytes=2**30):
+
+        self.directory = directory
+        self.memory_size = memory_size
+        self.disk_bytes = disk_bytes
+
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        self.disk_used = 0
+        if directory is not None:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.disk_used = sum(size for mtime, size, p in self._files())
+
+    def fingerprint(self, table, sid):
+        """ A hash of every column of the rows of `table` for `sid`. """
+
+        rows = source_rows(table, sid)
+
+        h = hashlib.sha1()
+        for name in column_names(table):
+            h.update(name)
+            h.update(np.ascontiguousarray(table.data[name][rows]).tostring())
+
+        return h.hexdigest()
+
+    def key(self, table, sid, season, flags, rob, per, graded, colorslope,
+            fx2=True, lsp=True):
+        """ The cache key (a string) for one statcruncher call. """
+
+        options = (int(sid), season, flags, bool(rob), bool(per),
+                   bool(graded), bool(colorslope))
+        # (results with every period search keep their old keys)
+        if not fx2:
+            options += (('fx2', False),)
+        if not lsp:
+            options += (('lsp', False),)
+
+        return "%d_%s" % (int(sid), hashlib.sha1(
+            repr(options) + self.fingerprint(table, sid)).hexdigest())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key):
+        """ Returns the cached result for `key`, or raises KeyError. """
+
+        if key in self.memory:
+            value = self.memory.pop(key)
+            self.memory[key] = value
+            return value
+
+        if self.directory is not None and os.path.exists(self._path(key)):
+            f = open(self._path(key), 'rb')
+            value = pickle.load(f)
+            f.close()
+            # mark it as recently used
+            os.utime(self._path(key), None)
+            self._remember(key, value)
+            return value
+
+        raise KeyError(key)
+
+    def put(self, key, value):
+        """ Saves `value` under `key`, in memory and on disk. """
+
+        self._remember(key, value)
+
+        if self.directory is None:
+            return
+
+        # Write, then rename, so readers never see half a pickle.
+        path = self._path(key)
+        tmp_path = path + '.tmp'
+        f = open(tmp_path, 'wb')
+        pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        f.close()
+
+        if os.path.exists(path):
+            self.disk_used -= os.path.getsize(path)
+        os.rename(tmp_path, path)
+        self.disk_used += os.path.getsize(path)
+
+        if self.disk_used > self.disk_bytes:
+            self._enforce_disk_cap()
+
+    def _remember(self, key, value):
+
+        self.memory[key] = value
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def _files(self, prefix=''):
+        """ (mtime, bytes, path) of each cache file starting with `prefix`. """
+
+        paths = glob.glob(os.path.join(self.directory, prefix+'*.pkl'))
+        return [(os.path.getmtime(p), os.path.getsize(p), p) for p in paths]
+
+    def _enforce_disk_cap(self, low_water=0.9):
+        """
+        Deletes least-recently-used files until under `low_water` times
+        disk_bytes (leaving room, so a full cache isn't listed again on
+        the very next put).
+
+        Lists the directory, so only call it once disk_used says the
+        cache is over its cap; it also resynchronizes disk_used with
+        what's really on disk (e.g. if another process wrote files).
+
+        """
+
+        stats = self._files()
+
+        total = sum(size for mtime, size, p in stats)
+        if total <= self.disk_bytes:
+            self.disk_used = total
+            return
+
+        for mtime, size, p in sorted(stats):
+            if total <= low_water * self.disk_bytes:
+                break
+            os.remove(p)
+            total -= size
+
+        self.disk_used = total
+
+    def invalidate(self, sid=None):
+        """
+        Throws away cached results.
+
+        Parameters
+        ----------
+        sid : int or None, optional
+            Only throw away results for this source. Default: everything.
+
+        """
+
+        if sid is None:
+            prefix = ''
+        else:
+            prefix = "%d_" % int(sid)
+
+        for key in list(self.memory):
+            if key.startswith(prefix):
+                del self.memory[key]
+
+        if self.directory is not None:
+            for mtime, size, p in self._files(prefix):
+                os.remove(p)
+                self.disk_used -= size
+
+    def statcruncher(self, table, sid, season=0, rob=True, per=True,
+                     graded=False, colorslope=False, flags=0, fx2=True,
+                     lsp=True):
+        """
+        spread3.statcruncher(), but answered from the cache if possible.
+
+        Takes the same arguments and returns the same thing.
+
+        """
+
+        key = self.key(table, sid, season, flags, rob, per, graded,
+                       colorslope, fx2, lsp)
+
+        try:
+            value = self.get(key)
+            self.hits += 1
+            return value
+        except KeyError:
+            self.misses += 1
+
+        value = spread3.statcruncher(table, sid, season, rob, per,
+                                     graded=graded, colorslope=colorslope,
+                                     flags=flags, fx2=fx2, lsp=lsp)
+        self.put(key, value)
+
+        return value
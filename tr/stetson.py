@@ -2,6 +2,9 @@
 'On the Automatic Determination of Light-Curve Parameters for Cepheid
 Variables', Stetson 1996, PASP..108..851S
 
+I_batch, S_batch and S_singleton_batch do the same for every star of a
+catalog at once, given concatenated arrays plus per-star offsets.
+
 """
 
 import numpy as np
@@ -146,3 +149,163 @@ def S_sid (table, sid, season=123, flags=0) :
 
 
     return S (jcol, jerr, hcol, herr, kcol, kerr)
+
+
+# Batched versions: every star at once.
+#
+# These take the photometry of many stars laid end to end in flat
+# arrays, plus an `offsets` array (length n_stars+1) such that star i
+# is x[offsets[i]:offsets[i+1]] -- e.g. from SourceIndex.gather().
+# They give the same numbers as calling the one-star functions above
+# on each slice, including 0 for stars with fewer than 2 observations.
+
+def _segments (offsets):
+    """ Group number of each element, per-star counts, number of stars. """
+
+    offsets = np.asarray(offsets, dtype=int)
+    counts = np.diff(offsets)
+    n_stars = counts.size
+    g = np.repeat(np.arange(n_stars), counts)
+
+    return g, counts, n_stars
+
+
+def _delta_batch (m, sigma_m, g, counts, n_stars):
+    """ delta() for every observation of every star at once. """
+    from grouped import group_mean
+
+    # delta() computes n / (n-1) on Python ints, which floors under
+    # Python 2 (so the factor is 1 except when n == 2). Keep it that way
+    # so the batched and one-star indices agree.
+    factor = np.sqrt( counts // np.maximum(counts - 1, 1) )
+
+    mean_m = group_mean(m, g, n_stars)
+
+    return factor[g] * (m - mean_m[g]) / sigma_m
+
+
+def I_batch (b, sigma_b, v, sigma_v, offsets):
+    """The Welch/Stetson variability index I for many stars at once.
+
+    Parameters
+    ----------
+    b, v : array_like
+        Two arrays of magnitude values, all stars concatenated.
+    sigma_b, sigma_v : array_like
+        Two corresponding arrays of uncertainty values.
+    offsets : array_like
+        Star i is b[offsets[i]:offsets[i+1]] (same for v, sigmas).
+
+    Returns
+    -------
+    I : np.ndarray
+        The Stetson index "I" of each star (0 where n < 2).
+
+    """
+    from grouped import group_mean, group_sum
+
+    b, sigma_b = np.asarray(b), np.asarray(sigma_b)
+    v, sigma_v = np.asarray(v), np.asarray(sigma_v)
+
+    if not (b.size == sigma_b.size == v.size == sigma_v.size):
+        raise Exception("Array dimensions mismatch")
+
+    g, n, n_stars = _segments(offsets)
+
+    b_mean = group_mean(b, g, n_stars)
+    v_mean = group_mean(v, g, n_stars)
+
+    s = group_sum( (b - b_mean[g])/sigma_b * (v - v_mean[g])/sigma_v,
+                   g, n_stars )
+
+    I = np.sqrt(1. / np.maximum(n*(n-1), 1)) * s
+
+    return np.where(n < 2, 0., I)
+
+
+def S_batch (j, sigma_j, h, sigma_h, k, sigma_k, offsets):
+    """
+    Computes the Stetson variability index S (Stetson's J) for many 
+    stars at once, each with 3 observations on each night.
+
+    INPUTS:
+        j, h, k: arrays of J, H, K magnitudes, all stars concatenated
+        sigma_j, sigma_h, sigma_k: arrays of corresponding uncertainties
+        offsets: star i is j[offsets[i]:offsets[i+1]] (same for h, k...)
+
+    OUTPUTS:
+        s: array of Stetson variability indices, one per star
+           (0 where n < 2)
+
+    """
+    from grouped import group_sum
+
+    g, n, n_stars = _segments(offsets)
+
+    d_j = _delta_batch(np.asarray(j), np.asarray(sigma_j), g, n, n_stars)
+    d_h = _delta_batch(np.asarray(h), np.asarray(sigma_h), g, n, n_stars)
+    d_k = _delta_batch(np.asarray(k), np.asarray(sigma_k), g, n, n_stars)
+
+    P = 0.
+    for P_i in (d_j * d_h, d_h * d_k, d_j * d_k):
+        P = P + np.sign( P_i ) * np.sqrt( np.abs( P_i ))
+
+    s = group_sum(P, g, n_stars) / np.maximum(n, 1)
+
+    return np.where(n < 2, 0., s)
+
+
+def S_singleton_batch (v, sigma_v, offsets):
+    """
+    Computes the 'Stetson' index for many stars at once, each observed
+    in a single color (see S_singleton).
+
+    INPUTS:
+        v: array of magnitudes, all stars concatenated
+        sigma_v: array of corresponding uncertainties
+        offsets: star i is v[offsets[i]:offsets[i+1]]
+
+    OUTPUTS:
+        s: array of indices, one per star (0 where n < 2)
+
+    """
+    from grouped import group_sum
+
+    g, n, n_stars = _segments(offsets)
+
+    d_v = _delta_batch(np.asarray(v), np.asarray(sigma_v), g, n, n_stars)
+
+    P_i = d_v**2 - 1
+
+    s = group_sum(np.sign( P_i ) * np.sqrt( np.abs( P_i )), g, n_stars
+                  ) / np.maximum(n, 1)
+
+    return np.where(n < 2, 0., s)
+
+
+def S_sid_batch (table, sid_list, season=123, flags=0) :
+    """ Calculates the Stetson J index for many sources at once.
+
+    Like [S_sid(table, sid, season, flags) for sid in sid_list], 
+    but with one cut of the table and one batched S computation.
+
+    Inputs:
+      table -- an atpy table with time-series photometry
+      sid_list -- a list of Source IDs from WFCAM (13 digits each)
+      season -- Which observing season of our dataset (1,2, 3, or all)
+
+    Returns:
+      s -- array of Stetson indices, in the same order as sid_list
+    """
+    from tr_helpers import data_cut
+    from source_index import get_source_index
+
+    s_table = data_cut(table, sid_list, season, flags=flags)
+    rows, offsets = get_source_index(s_table).gather(sid_list)
+
+    def col(name):
+        return s_table.data[name][rows]
+
+    return S_batch (col('JAPERMAG3'), col('JAPERMAG3ERR'),
+                    col('HAPERMAG3'), col('HAPERMAG3ERR'),
+                    col('KAPERMAG3'), col('KAPERMAG3ERR'), offsets)
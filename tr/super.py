@@ -14,6 +14,9 @@ import numpy as np
 import matplotlib.pyplot as plt
 import spread3
 import plot3 as tplot
+from spread_columnar import spreadsheet_write_columnar
+from source_stream import SourceStream
+from figure_factory import render_figures
 
 import os, errno
 
@@ -30,7 +33,8 @@ def mkdir_p(path):
 
 
 def do_it_all( table, sid_list, name_list, path='', 
-               option=['lc','tables','phase'] ):
+               option=['lc','tables','phase'], cache=None, n_workers=1,
+               output_policy=None ):
     """ 
     Does some stuff. Not sure exactly what yet, but I'll 
     want it to make tons of plots and tables for a list of 
@@ -38,8 +42,9 @@ def do_it_all( table, sid_list, name_list, path='',
     
     Parameters
     ----------
-    table : atpy.Table 
-        The WFCAM time-series data to be extracted
+    table : atpy.Table or source_stream.SourceStream
+        The WFCAM time-series data to be extracted. A SourceStream
+        is read one star at a time instead of being held in memory.
     sid_list : (list or array) of int
         SOURCEIDs of stars to be analyzed
     name_list : list of str
@@ -51,6 +56,16 @@ def do_it_all( table, sid_list, name_list, path='',
     option : list of str, optional
         Which sub-components of this function you'd like to actually
         call. Default is all (lc, tables, phase).
+    cache : stat_cache.StatCache, optional
+        Reuse (and save) each star's statistics across runs, so 
+        re-running over unchanged data skips the number crunching.
+    n_workers : int or None, optional
+        How many processes to draw the figures with (see 
+        figure_factory.py). Default 1, i.e. all in this process;
+        None uses every core.
+    output_policy : dict, optional
+        How to save the figures: formats, dpi, whether to rasterize
+        dense scatter plots, etc. (see figure_output.set_policy).
 
     Returns
     -------
@@ -114,12 +129,23 @@ def do_it_all( table, sid_list, name_list, path='',
         lookup.add_column("SOURCEID", sid_list)
         lookup.add_column("Designation", name_list)
         
+        # Without a cache, the columnar engine makes the same 
+        # spreadsheets; it groups the table by star and works out each
+        # row's season (helpers3.get_season_ids) once for all four.
+        columnar = cache is None and not isinstance(table, SourceStream)
+
         for season, s in zip([1,2,3,123], ss):
             
             # Write the spreadsheet and save it to the relevant directory.
-            spread3.spreadsheet_write(table, lookup, season, 
+            if columnar:
+                spreadsheet_write_columnar(table, lookup, season,
+                                           tables+s+'/spreadsheet.fits',
+                                           flags=256, per=True)
+            else:
+                spread3.spreadsheet_write(table, lookup, season, 
                                           tables+s+'/spreadsheet.fits', 
-                                          flags=256, per=True)
+                                          flags=256, per=True, 
+                                          cache=cache)
             
 
     # What command do we want to make plots?
@@ -130,50 +156,11 @@ def do_it_all( table, sid_list, name_list, path='',
     ## Third, make lightcurves.
     # And put the gorram Stetson index in the title!
 
-        
-    for season, s in zip([1,2,3,123], ss):
-
-        s_stats = atpy.Table(tables+s+'/spreadsheet.fits')
-
-        for name, sid in zip(name_list, sid_list):
-            # The specific plot command we use here depends a lot
-            # on what functions are available.
-            tplot.lc(table, sid, season=season, name=name, #flags=16,
-                     outfile=path+"lc/"+s+"/"+name, png_too=True) #png, eps, pdf
-
-
-
-
-        # A bunch of the following code will be substantially rewritten
-        # once "spread3" is functional.
-
-        # Well... spread3 is now functional!
-            for t in types:
-                if t == 'lsp_power':
-                    tplot.lsp_power(table, sid, season=season, name=name,
-                                    outfile=path+"phase/"+s+"/lsp_power/"+name, 
-                                    png_too=True) 
-
-                else:
-                    per = s_stats.data[t+"_per"][s_stats.SOURCEID == sid]
-                    tplot.phase(table, sid, period=per, season=season, 
-                                name=name,
-                                outfile=path+"phase/"+s+"/"+t+"/"+name, 
-                                png_too=True) 
-
-                # elif t == 'k_fx2':
-                #     tplot.phase(table, sid, season=season, name=name,
-                #                 outfile=path+"phase/"+s+"/k_fx2/"+name, 
-                #                 png_too=True) 
-                # elif t == 'k_lsp':
-                #     tplot.phase(table, sid, season=season, name=name,
-                #                 period='lsp',
-                #                 outfile=path+"phase/"+s+"/k_lsp/"+name, 
-                #                 png_too=True) 
-
-                # else:
-                #     pass
-
+    # Each star's data are cut once per season and shared by its light
+    # curve and all of its phase plots (which fold on the periods in 
+    # the spreadsheets made above).
+    render_figures(table, sid_list, name_list, path, n_workers=n_workers,
+                   output_policy=output_policy)
 
     return
 
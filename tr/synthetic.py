@@ -0,0 +1,278 @@
+"""
+synthetic.py : fake WFCAM Science Archive photometry, for testing and
+benchmarking without the (private) Cyg OB7 and Orion data.
+
+synthetic_catalog() makes a table shaped like a WSA time-series
+download: one row per source per night, with the columns this package
+uses (SOURCEID, MEANMJDOBS, RA, DEC in radians, J/H/K APERMAG3 and
+APERMAG3ERR, J/H/K PPERRBITS, JMHPNT/HMKPNT and their errors, PSTAR,
+and optionally J/H/K GRADE). Nights fall inside the seasons of a
+field's season_calendar. Most stars are constant to within their
+photometric errors; some are periodic (sinusoids) and some are
+irregularly variable (random walks). Some detections are missing
+(the WSA null value) or flagged.
+
+Everything is drawn from a seeded random number generator, so the
+same arguments give the same table.
+
+Useful functions:
+  synthetic_catalog - Makes a photometry table and a table of the truth.
+  synthetic_constants - Picks constant stars per chip, for
+                        network2.make_corrections_table.
+  write_synthetic - Writes a synthetic catalog (and truth) to FITS.
+
+"""
+
+from __future__ import division
+
+import numpy as np
+import atpy
+
+from season_calendar import get_calendar
+
+null = np.double(-9.99999488e+08)
+
+# Field centers (degrees), for positions.
+field_centers = {'cygob7': (316.5, 52.3),
+                 'orion': (83.8, -5.4)}
+
+# ppErrBits values that turn up in real data, from harmless to bad.
+flag_values = np.array([16, 64, 256, 4096, 65536, 4194304, 2147483648])
+
+first_sid = 44199508400000
+
+
+def _nights(calendar, n_epochs, rng, max_season=300):
+    """
+    `n_epochs` observing times spread over a calendar's seasons
+    (in proportion to each season's length), sorted.
+
+    """
+
+    lows = calendar.boundaries[:-1]
+    # An open-ended last season (e.g. Orion's) gets max_season days.
+    highs = np.minimum(calendar.boundaries[1:], lows + max_season)
+    lengths = highs - lows
+
+    season = rng.choice(lows.size, size=n_epochs, p=lengths/lengths.sum())
+
+    # Whole nights, observed some time in the night.
+    night = np.floor(lows[season] + 1 + rng.uniform(size=n_epochs) *
+                     (lengths[season] - 2))
+    dates = night + rng.uniform(0.25, 0.75, size=n_epochs)
+
+    return np.sort(dates)
+
+
+def _errors(mag, rng):
+    """ Photometric errors that grow towards faint magnitudes. """
+
+    err = 0.004 + 10**(0.4*(mag - 19.5))
+    return err * rng.uniform(0.8, 1.2, size=mag.shape)
+
+
+def synthetic_catalog(n_sources=1000, n_epochs=100, field='cygob7',
+                      periodic_fraction=0.05, variable_fraction=0.05,
+                      null_fraction=0.02, flag_fraction=0.05, grade=False,
+                      seed=0):
+    """
+    Makes a WSA-shaped time-series photometry table.
+
+    Parameters
+    ----------
+    n_sources : int, optional
+        How many stars. Default 1000.
+    n_epochs : int, optional
+        How many nights every star is observed on. Default 100.
+    field : str or SeasonCalendar, optional
+        Whose seasons (and sky position) to use: 'cygob7' or 'orion'.
+    periodic_fraction, variable_fraction : float, optional
+        Fractions of stars that are periodic / irregularly variable.
+        Default 0.05 each.
+    null_fraction : float, optional
+        Fraction of detections, per band, that are missing (null).
+    flag_fraction : float, optional
+        Fraction of detections, per band, with nonzero ppErrBits.
+    grade : bool, optional
+        Also make JGRADE, HGRADE, KGRADE columns (quality grades
+        between 0.8 and 1, as from night_cleanser). Default False.
+    seed : int, optional
+        Random seed. Default 0.
+
+    Returns
+    -------
+    table : atpy.Table
+        The photometry, one row per star per night, sorted by
+        SOURCEID and then date.
+    truth : atpy.Table
+        One row per star: SOURCEID, kind (0 constant, 1 periodic,
+        2 variable), period (days; 0 unless periodic), amplitude
+        (K mag), chip (1-16), and the mean J, H, K magnitudes.
+
+    """
+
+    rng = np.random.RandomState(seed)
+    calendar = get_calendar(field)
+    if isinstance(field, basestring):
+        ra0, dec0 = field_centers[field.lower().replace(' ', '')]
+    else:
+        ra0, dec0 = field_centers['cygob7']
+
+    sids = first_sid + np.arange(n_sources)
+    dates = _nights(calendar, n_epochs, rng)
+
+    # The stars: K magnitude, colors, positions within a ~0.9 deg field.
+    k_mean = rng.uniform(11, 17.5, size=n_sources)
+    hmk_mean = rng.uniform(0.1, 1.2, size=n_sources)
+    jmh_mean = rng.uniform(0.4, 1.6, size=n_sources)
+    h_mean = k_mean + hmk_mean
+    j_mean = h_mean + jmh_mean
+
+    ra = ra0 + (rng.uniform(-0.45, 0.45, size=n_sources) /
+                np.cos(np.radians(dec0)))
+    dec = dec0 + rng.uniform(-0.45, 0.45, size=n_sources)
+    chip = 1 + rng.randint(16, size=n_sources)
+
+    kind = np.zeros(n_sources, dtype=int)
+    draw = rng.uniform(size=n_sources)
+    kind[draw < periodic_fraction + variable_fraction] = 2
+    kind[draw < periodic_fraction] = 1
+
+    period = np.where(kind == 1,
+                      10**rng.uniform(-0.5, 1.3, size=n_sources), 0)
+    amplitude = np.where(kind > 0, rng.uniform(0.05, 0.6, size=n_sources), 0)
+
+    # (star, night) matrices of the K-band signal.
+    t = dates[np.newaxis, :] - dates[0]
+    signal = np.zeros((n_sources, n_epochs))
+
+    periodic = kind == 1
+    phase0 = rng.uniform(0, 2*np.pi, size=periodic.sum())
+    signal[periodic] = (amplitude[periodic, np.newaxis] *
+                        np.sin(2*np.pi * t / period[periodic, np.newaxis] +
+                               phase0[:, np.newaxis]))
+
+    variable = kind == 2
+    if variable.any():
+        walk = np.cumsum(rng.normal(size=(variable.sum(), n_epochs)), axis=1)
+        walk -= walk.mean(axis=1)[:, np.newaxis]
+        scale = np.abs(walk).max(axis=1)
+        scale[scale == 0] = 1
+        signal[variable] = (amplitude[variable, np.newaxis] *
+                            walk / scale[:, np.newaxis])
+
+    # Variability is stronger at shorter wavelengths (as for spots and
+    # extinction), so the colors change too.
+    columns = {}
+    for band, mean, strength in [('J', j_mean, 1.3), ('H', h_mean, 1.1),
+                                 ('K', k_mean, 1.0)]:
+        true = mean[:, np.newaxis] + strength * signal
+        err = _errors(true, rng)
+        columns[band] = (true + err * rng.normal(size=true.shape), err)
+
+    n_rows = n_sources * n_epochs
+
+    table = atpy.Table(name="Synthetic WFCAM photometry")
+    table.add_column('SOURCEID', np.repeat(sids, n_epochs))
+    table.add_column('MEANMJDOBS', np.tile(dates, n_sources))
+    table.add_column('RA', np.radians(np.repeat(ra, n_epochs)),
+                     unit='RADIANS')
+    table.add_column('DEC', np.radians(np.repeat(dec, n_epochs)),
+                     unit='RADIANS')
+
+    good = {}
+    for band in ['J', 'H', 'K']:
+        mag, err = [c.ravel() for c in columns[band]]
+
+        missing = rng.uniform(size=n_rows) < null_fraction
+        good[band] = ~missing
+
+        flags = np.zeros(n_rows, dtype=np.int64)
+        flagged = (rng.uniform(size=n_rows) < flag_fraction) & ~missing
+        flags[flagged] = rng.choice(flag_values, size=flagged.sum())
+
+        table.add_column(band+'APERMAG3', np.where(missing, null, mag))
+        table.add_column(band+'APERMAG3ERR', np.where(missing, null, err))
+        table.add_column(band+'PPERRBITS', flags)
+
+    for color, blue, red in [('JMH', 'J', 'H'), ('HMK', 'H', 'K')]:
+        both = good[blue] & good[red]
+        value = table.data[blue+'APERMAG3'] - table.data[red+'APERMAG3']
+        error = np.hypot(table.data[blue+'APERMAG3ERR'],
+                         table.data[red+'APERMAG3ERR'])
+        table.add_column(color+'PNT', np.where(both, value, null))
+        table.add_column(color+'PNTERR', np.where(both, error, null))
+
+    pstar = np.repeat(rng.uniform(0.9, 1.0, size=n_sources), n_epochs)
+    unsure = rng.uniform(size=n_rows) < 0.05
+    pstar[unsure] = rng.uniform(0.05, 0.9, size=unsure.sum())
+    table.add_column('PSTAR', pstar)
+
+    if grade:
+        for band in ['J', 'H', 'K']:
+            table.add_column(band+'GRADE', rng.uniform(0.8, 1.0, size=n_rows))
+
+    truth = atpy.Table(name="Synthetic WFCAM truth")
+    truth.add_column('SOURCEID', sids)
+    truth.add_column('kind', kind)
+    truth.add_column('period', period)
+    truth.add_column('amplitude', amplitude)
+    truth.add_column('chip', chip)
+    truth.add_column('j_mean', j_mean)
+    truth.add_column('h_mean', h_mean)
+    truth.add_column('k_mean', k_mean)
+
+    return table, truth
+
+
+def synthetic_constants(truth, per_chip=10):
+    """
+    Picks the brightest constant stars on each chip, the way the real
+    corrections network picks its reference stars.
+
+    Parameters
+    ----------
+    truth : atpy.Table
+        The truth table from synthetic_catalog().
+    per_chip : int, optional
+        How many stars per chip. Default 10.
+
+    Returns
+    -------
+    constants : atpy.Table
+        Columns "SOURCEID" and "chip", as network2.make_corrections_table
+        expects.
+
+    """
+
+    constant = truth.where(truth.kind == 0)
+
+    sids = []
+    chips = []
+    for chip in np.unique(constant.chip):
+        on_chip = constant.where(constant.chip == chip)
+        brightest = np.argsort(on_chip.k_mean, kind='mergesort')[:per_chip]
+        sids.append(on_chip.SOURCEID[brightest])
+        chips.append(on_chip.chip[brightest])
+
+    constants = atpy.Table(name="Synthetic constant stars")
+    constants.add_column('SOURCEID', np.concatenate(sids))
+    constants.add_column('chip', np.concatenate(chips))
+
+    return constants
+
+
+def write_synthetic(outfile, truth_file=None, **kwargs):
+    """
+    Writes synthetic_catalog(**kwargs) to a FITS file (and its truth
+    table to `truth_file`, if given).
+
+    """
+
+    table, truth = synthetic_catalog(**kwargs)
+
+    table.write(outfile, overwrite=True)
+    if truth_file is not None:
+        truth.write(truth_file, overwrite=True)
+
+    return table, truth
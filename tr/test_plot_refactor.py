@@ -4,7 +4,25 @@ plot3.py refactoring.
 
 """
 
-from variables_data_filterer import variables_photometry, ukvar_spread
+try:
+    from variables_data_filterer import variables_photometry, ukvar_spread
+except ImportError:
+    # The Orion data (and the script that filters them) aren't public,
+    # so draw the same plots for synthetic Orion-like variables instead.
+    # Every star is made variable, and there are enough of them for the
+    # indices used below (up to "ONCvar 287").
+    from synthetic import synthetic_catalog, null
+    variables_photometry, truth = synthetic_catalog(
+        n_sources=300, n_epochs=150, field='orion', periodic_fraction=0.5,
+        variable_fraction=0.5, grade=True)
+    ukvar_spread = truth.where(truth.kind > 0)
+
+    # ONCvar 287 is the "missing J band" star.
+    no_j = variables_photometry.SOURCEID == ukvar_spread.SOURCEID[286]
+    for column in ['JAPERMAG3', 'JAPERMAG3ERR', 'JMHPNT', 'JMHPNTERR']:
+        variables_photometry.data[column][no_j] = null
+    variables_photometry.data['JPPERRBITS'][no_j] = 0
+
 import plot3
 
 def test_1():
@@ -4,7 +4,10 @@ analysis, and to return the best filtered period.
 
 Useful functions:
   lsp_mask - Trims unreliable frequencies from a periodogram
+  lsp_mask_batch - lsp_mask for many periodograms on a shared grid
+  lsp_trim - Which frequencies lsp_mask considers reliable
   lsp_tuning - Selects the proper `hifac` value for a desired highest frequency.
+  lsp_tuning_batch - lsp_tuning for many light curves at once
 '''
 
 from __future__ import division
@@ -61,6 +64,56 @@ def lsp_mask ( Wk1, Wk2, upper_f=upper_f, lower_f=lower_f, midrange=midrange ):
 
 
 
+def lsp_mask_batch ( Wk1, Wk2, upper_f=upper_f, lower_f=lower_f, 
+                     midrange=midrange ):
+    """
+    Vectorized lsp_mask over a batch of periodograms on a shared grid.
+
+    Parameters
+    ----------
+    Wk1 : np.ndarray
+        The shared array of Lomb periodogram frequencies.
+    Wk2 : np.ndarray
+        A (number of stars, len(Wk1)) array of periodogram values,
+        as returned by scargle.fasper_batch().
+    upper_f, lower_f, midrange : optional
+        As in lsp_mask().
+
+    Returns
+    -------
+    Jmax : np.ndarray of int
+        For each star, the index of the maximum of Wk2 among the 
+        reliable frequencies.
+
+    """
+
+    trim = lsp_trim( Wk1, upper_f, lower_f, midrange )
+    # lsp_mask() raises here too (max of an empty array).
+    if not trim.any():
+        raise ValueError("No reliable frequencies in this periodogram")
+
+    return np.where( trim, Wk2, -np.inf ).argmax(axis=1)
+
+
+def lsp_trim ( Wk1, upper_f=upper_f, lower_f=lower_f, midrange=midrange ):
+    """
+    Which frequencies of a periodogram lsp_mask() looks for peaks at.
+
+    Pass it to scargle.fasper_batch() as `trim`.
+
+    Returns
+    -------
+    trim : np.ndarray of bool
+        True for each reliable frequency in Wk1.
+
+    """
+
+    Wk1 = np.asarray(Wk1)
+
+    return ( (Wk1 < upper_f) & (Wk1 > lower_f) &
+             ( (Wk1 < midrange[0][0]) | (Wk1 > midrange[0][1]) ) )
+
+
 def lsp_tuning(t, upper_frequency=0.5):
     """
     Tunes the `hifac` value in a periodogram to a desired upper frequency.
@@ -99,3 +152,32 @@ def lsp_tuning(t, upper_frequency=0.5):
     hifac = np.ceil(2. * tdif / n * upper_frequency)
 
     return hifac
+
+
+def lsp_tuning_batch(t, offsets, upper_frequency=0.5):
+    """
+    lsp_tuning() for many light curves at once.
+
+    Parameters
+    ----------
+    t : np.ndarray
+        Every light curve's timestamps, end to end.
+    offsets : array-like of int
+        Light curve i is t[offsets[i]:offsets[i+1]]; none may be empty.
+    upper_frequency : float, optional
+        As in lsp_tuning().
+
+    Returns
+    -------
+    hifac : np.ndarray
+        What lsp_tuning() would give each light curve.
+
+    """
+
+    offsets = np.asarray(offsets)
+
+    n = np.diff(offsets)
+    tdif = (np.maximum.reduceat(t, offsets[:-1]) -
+            np.minimum.reduceat(t, offsets[:-1]))
+
+    return np.ceil(2. * tdif / n * upper_frequency)
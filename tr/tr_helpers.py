@@ -1,7 +1,8 @@
 '''
 This is a module that contains 'helper' functions that are called 
 by the other packages in wuvars. It does not import any of my other 
-modules, for dependency reasons.
+modules, for dependency reasons (except source_index and
+season_calendar, which import nothing).
 
 Useful functions:
   season_cut - Cuts a table for a selection of sources and seasons
@@ -10,8 +11,27 @@ Useful functions:
 import atpy
 import numpy as np
 
+from source_index import season_rows
+from season_calendar import get_calendar
 
-def data_cut (table, sid_list, season, flags=-1):
+
+def _season_bounds (season, calendar=None, everything=-1):
+    ''' The (low, high) MJD bounds of a season, the way the cuts in
+    this module have always read `season`: a single season (1, 2, 3)
+    is itself, `everything` means no cut at all, and anything else
+    means all the seasons together. '''
+
+    calendar = get_calendar(calendar)
+
+    if everything is not None and season == everything:
+        return calendar.everything
+    elif season in calendar.seasons():
+        return calendar.bounds(season)
+    else:
+        return calendar.bounds(calendar.all_seasons)
+
+
+def data_cut (table, sid_list, season, flags=-1, calendar=None):
     ''' Returns a subset of a table that corresponds to 
     one (or more!) source(s) for one (or more!) season(s). 
 
@@ -25,6 +45,8 @@ def data_cut (table, sid_list, season, flags=-1):
     Optional inputs:
       flags -- whether to remove bad observations (default: no)
                and where to draw the cutoff.
+      calendar -- which field's seasons to use (default: Cyg OB7;
+                  see season_calendar.py)
 
     Note:
       If "season" is set to "-1", then cut at 0 and 1e6 
@@ -33,40 +55,10 @@ def data_cut (table, sid_list, season, flags=-1):
       into seasons.
     '''
 
-    # First, select these sources' data from the table
-    source = table.where( 
-        np.array( [sid in sid_list for sid in table.SOURCEID] )
-        )
-#        table.SOURCEID == sid)
-
-    # If we had Numpy 1.4 or higher, we could use the following:
-    # source = table.where( np.in1d(table.SOURCEID, sid_list) )
-
-
-    # Next, figure out where to slice the data (in terms of dates)
-    offset = 54579
-    cut1 = 100
-    cut2 = 300
-    cut3 = 600
-
-    if season == 1:
-        low = offset
-        high = offset+cut1
-    elif season == 2:
-        low = offset+cut1
-        high = offset+cut2
-    elif season == 3:
-        low = offset+cut2
-        high = offset+cut3
-    elif season == -1:
-        low = 0
-        high = 1e6
-    else:
-        low = offset
-        high = offset+cut3
-    
-    source = source.where( (source.MEANMJDOBS < high) & 
-                           (source.MEANMJDOBS > low))
+    # Select these sources' data for this season from the table
+    # (binary searches in the table's cached, date-sorted source index).
+    low, high = _season_bounds(season, calendar)
+    source = table.rows( season_rows(table, sid_list, low, high) )
 
     if flags >= 0:
         source = source.where( (source.JPPERRBITS <= flags) &
@@ -79,7 +71,7 @@ def data_cut (table, sid_list, season, flags=-1):
 
 
 
-def season_cut (table, sid, season, flags=-1) :
+def season_cut (table, sid, season, flags=-1, calendar=None) :
     ''' Returns a subset of a table that corresponds to 
     one source for one (or more!) season(s). 
 
@@ -93,35 +85,12 @@ def season_cut (table, sid, season, flags=-1) :
     Keywords:
       flags: whether to remove bad observations (default: no)
              and where to draw the cutoff.
+      calendar: which field's seasons to use (default: Cyg OB7)
     '''
 
-    # First, select this source's data from the table
-    source = table.where(table.SOURCEID == sid)
-
-    # Next, figure out where to slice the data (in terms of dates)
-    offset = 54579
-    cut1 = 100
-    cut2 = 300
-    cut3 = 600
-
-    if season == 1:
-        low = offset
-        high = offset+cut1
-    elif season == 2:
-        low = offset+cut1
-        high = offset+cut2
-    elif season == 3:
-        low = offset+cut2
-        high = offset+cut3
-    elif season == -1:
-        low = 0
-        high = 1e6
-    else:
-        low = offset
-        high = offset+cut3
-    
-    source = source.where( (source.MEANMJDOBS < high) & 
-                           (source.MEANMJDOBS > low))
+    # Select this source's data for this season from the table
+    low, high = _season_bounds(season, calendar)
+    source = table.rows( season_rows(table, sid, low, high) )
 
     if flags >= 0:
         source = source.where( (source.JPPERRBITS <= flags) &
@@ -131,7 +100,7 @@ def season_cut (table, sid, season, flags=-1) :
     return source
 
 # I hope to deprecate this function someday.
-def ensemble_cut (corr_table, chip, season, flags=-1) :
+def ensemble_cut (corr_table, chip, season, flags=-1, calendar=None) :
     ''' Returns a subset of a correction table that corresponds to 
     one chip for one (or more!) season(s). 
 
@@ -141,30 +110,16 @@ def ensemble_cut (corr_table, chip, season, flags=-1) :
       chip: a WFCAM chip (1-16)
       season: Which observing season of our dataset (1,2, or 3)
 
+    Keywords:
+      calendar: which field's seasons to use (default: Cyg OB7)
     '''
 
     # First, select this source's data from the table
     source = corr_table.where(corr_table.chip == chip)
 
     # Next, figure out where to slice the data (in terms of dates)
-    offset = 54579
-    cut1 = 100
-    cut2 = 300
-    cut3 = 600
-
-    if season == 1:
-        low = offset
-        high = offset+cut1
-    elif season == 2:
-        low = offset+cut1
-        high = offset+cut2
-    elif season == 3:
-        low = offset+cut2
-        high = offset+cut3
-    else:
-        low = offset
-        high = offset+cut3
-    
+    low, high = _season_bounds(season, calendar, everything=None)
+
     source = source.where( (source.date < high) & 
                            (source.date > low))
     